@@ -0,0 +1,116 @@
+'''Compares the sync build of the app with the async build of create_app(async_views=True) at growing numbers of concurrent requests in one worker process. Both builds are driven through the same ASGI adapter, the way an ASGI server would run them, so the only difference is the view functions and the database layer. Every request lists the first page of trips or of the expenses of a trip as JSON. Run it from the repository root:
+
+python benchmarks/async_views.py --trips 200 --expenses 50 --requests 2000
+'''
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.security import generate_password_hash
+from tripstracking import create_app
+from tripstracking.db import open_db, init_db
+
+def seed(app, trips, expenses):
+    with app.app_context():
+        init_db()
+        db = open_db()
+        db.execute(
+            "INSERT INTO user (username, password, fullname, email) VALUES ('bench', ?, 'Bench User', 'bench@example.com')",
+            (generate_password_hash('benchpassword', 'pbkdf2:sha256:1000'),)
+        )
+        db.executemany(
+            "INSERT INTO trip (destination, date, description, budget, user_id) VALUES (?, ?, 'Benchmark trip', 1000, 1)",
+            [(f'City {i}', f'2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}') for i in range(trips)]
+        )
+        db.executemany(
+            "INSERT INTO expense (expense_description, expense_date, amount, base_amount, rate_version, trip_id) VALUES ('Benchmark expense', '2024-01-01', ?, ?, 1, ?)",
+            [(i % 500 + 1, i % 500 + 1, trip_id) for trip_id in range(1, trips + 1) for i in range(expenses)]
+        )
+        db.commit()
+
+async def request(app, path, cookie):
+    path, _, query = path.partition('?')
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': query.encode(), 'root_path': '',
+        'headers': [(b'host', b'localhost'), (b'accept', b'application/json'), (b'cookie', cookie)],
+        'client': ('127.0.0.1', 50000), 'server': ('localhost', 80),
+    }
+    status = None
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+
+    await app(scope, receive, send)
+    return status
+
+async def drive(app, paths, cookie, requests, concurrency):
+    latencies = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def client():
+        nonlocal errors
+        for i in remaining:
+            start = time.perf_counter()
+            status = await request(app, paths[i % len(paths)], cookie)
+            latencies.append(time.perf_counter() - start)
+            errors += status != 200
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'throughput': requests / elapsed,
+        'p50_ms': statistics.median(latencies) * 1000,
+        'p95_ms': latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        'errors': errors,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Compares the sync and async builds at growing concurrency.')
+    parser.add_argument('--trips', type=int, default=200)
+    parser.add_argument('--expenses', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32, 128])
+    args = parser.parse_args()
+
+    paths = ['/trips/?limit=20'] + [f'/trips/expenses/{trip_id}/x?limit=20' for trip_id in range(1, args.trips + 1, max(1, args.trips // 20))]
+
+    print(f"{'build':<6} {'clients':>7} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'errors':>6}")
+    for build in ('sync', 'async'):
+        db_fd, db_path = tempfile.mkstemp()
+        app = create_app(async_views=build == 'async')
+        app.config.update(DATABASE=db_path, DB_POOL_SIZE=max(args.concurrency))
+        seed(app, args.trips, args.expenses)
+
+        client = app.test_client()
+        client.post('/users/login', data={'username': 'bench', 'password': 'benchpassword'})
+        cookie = f"session={client.get_cookie('session').value}".encode()
+
+        asgi = WsgiToAsgi(app)
+        for concurrency in args.concurrency:
+            result = asyncio.run(drive(asgi, paths, cookie, args.requests, concurrency))
+            print(f"{build:<6} {concurrency:>7} {result['throughput']:>9.1f} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} {result['errors']:>6}")
+
+        app.extensions['db_pool'].close()
+        if 'aiodb_pool' in app.extensions:
+            app.extensions['aiodb_pool'].close()
+        os.close(db_fd)
+        os.unlink(db_path)
+
+if __name__ == '__main__':
+    main()
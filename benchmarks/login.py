@@ -0,0 +1,79 @@
+'''Measures how many logins per second the app handles at each password hash cost. Every cost gets a fresh temporary database with one user whose password was hashed with that cost, and the logins are sent by concurrent threads through the Flask test client. Logins turned away with 503 because the hasher was saturated are counted separately. Run it from the repository root:
+
+python benchmarks/login.py --logins 200 --concurrency 8 --workers 2
+'''
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.security import generate_password_hash
+from tripstracking import create_app
+from tripstracking.db import open_db, init_db
+
+METHODS = ['pbkdf2:sha256:100000', 'pbkdf2:sha256:600000', 'scrypt:16384:8:1', 'scrypt:32768:8:1', 'scrypt:65536:8:1']
+
+def run(method, logins, concurrency, workers, queue):
+    db_fd, db_path = tempfile.mkstemp()
+    app = create_app()
+    app.config.update(DATABASE=db_path, PASSWORD_METHOD=method, PASSWORD_HASH_WORKERS=workers, PASSWORD_HASH_QUEUE=queue)
+
+    with app.app_context():
+        init_db()
+        db = open_db()
+        db.execute(
+            "INSERT INTO user (username, password, fullname, email) VALUES ('bench', ?, 'Bench User', 'bench@example.com')",
+            (generate_password_hash('benchpassword', method),)
+        )
+        db.commit()
+
+    statuses = {}
+    lock = threading.Lock()
+    remaining = iter(range(logins))
+
+    def login():
+        client = app.test_client()
+        while True:
+            with lock:
+                if next(remaining, None) is None:
+                    return
+            status = client.post(
+                '/users/login', json={'username': 'bench', 'password': 'benchpassword'}, headers={'Accept': 'application/json'}
+            ).status_code
+            with lock:
+                statuses[status] = statuses.get(status, 0) + 1
+
+    threads = [threading.Thread(target=login) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    app.extensions['password_hasher'].shutdown()
+    app.extensions['db_pool'].close()
+    os.close(db_fd)
+    os.unlink(db_path)
+    return statuses.get(200, 0) / elapsed, statuses
+
+def main():
+    parser = argparse.ArgumentParser(description='Reports logins/sec at each password hash cost.')
+    parser.add_argument('--methods', nargs='+', default=METHODS)
+    parser.add_argument('--logins', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=2, help='PASSWORD_HASH_WORKERS')
+    parser.add_argument('--queue', type=int, default=16, help='PASSWORD_HASH_QUEUE')
+    args = parser.parse_args()
+
+    print(f"{'method':<24} {'logins/sec':>10}  statuses")
+    for method in args.methods:
+        rate, statuses = run(method, args.logins, args.concurrency, args.workers, args.queue)
+        print(f"{method:<24} {rate:>10.1f}  {dict(sorted(statuses.items()))}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+'''Measures the cost per row of building the JSON body of GET /trips/, the old way with escape and jsonify on every value and with the row serializers, encoded by orjson when it is installed and by the json module. The rows come from an in-memory database with the columns and types of the trips query, so they are the same sqlite3.Row objects the view gets. Run it from the repository root:
+
+python benchmarks/serialize.py --rows 50 --repeat 2000
+'''
+import argparse
+import os
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import jsonify
+from markupsafe import escape
+from tripstracking import create_app, serialize
+
+def trip_rows(count):
+    db = sqlite3.connect(':memory:', detect_types=sqlite3.PARSE_DECLTYPES)
+    db.row_factory = sqlite3.Row
+    db.execute(
+        'CREATE TABLE trip (trip_id INTEGER PRIMARY KEY, destination TEXT, date TEXT, description TEXT, budget REAL, created TIMESTAMP, '
+        'expense_count INTEGER, expense_total REAL, expense_min REAL, expense_max REAL, remaining_budget REAL)'
+    )
+    db.executemany(
+        "INSERT INTO trip VALUES (?, 'Paris', '2024-05-01', 'City break in Paris', 1200.0, '2024-04-20 10:15:00', 50, 980.5, 1.2, 310.0, 219.5)",
+        [(trip_id,) for trip_id in range(1, count + 1)]
+    )
+    return db.execute('SELECT * FROM trip').fetchall()
+
+def escaped(trips):
+    '''The dicts the views built before the row serializers: every value escaped to a string.'''
+    return [{key: escape(trip[key]) for key in serialize.TRIP_JSON.fields} for trip in trips]
+
+def old(trips):
+    return jsonify({"trips": escaped(trips), "next_cursor": None}).get_data()
+
+def new(trips):
+    return serialize.json_response({"trips": serialize.TRIP_JSON.many(trips), "next_cursor": None}).get_data()
+
+def timed(build, trips, repeat):
+    build(trips)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        build(trips)
+    return (time.perf_counter() - start) / (repeat * len(trips))
+
+def main():
+    parser = argparse.ArgumentParser(description='Reports microseconds per row of the trips JSON response.')
+    parser.add_argument('--rows', type=int, default=50, help='Rows per response, the default page size.')
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+
+    trips = trip_rows(args.rows)
+    app = create_app()
+    orjson = serialize.orjson
+    with app.test_request_context():
+        results = [('escape + jsonify', timed(old, trips, args.repeat))]
+        serialize.orjson = None
+        results.append(('serializer + json', timed(new, trips, args.repeat)))
+        serialize.orjson = orjson
+        if orjson is not None:
+            results.append(('serializer + orjson', timed(new, trips, args.repeat)))
+
+    baseline = results[0][1]
+    print(f"{'method':<20} {'us/row':>8} {'speedup':>8}")
+    for name, seconds in results:
+        print(f"{name:<20} {seconds * 1e6:>8.2f} {baseline / seconds:>7.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+'''Load and latency benchmark of the main routes. For every dataset size the app is created by the app factory on a temporary database, seeded with that many expense rows by flask seed-db, and every route is driven by concurrent threads through the Flask test client. For each route the suite reports throughput, p50/p95/p99 latency, errors and the peak RSS of the process while the route ran, and writes everything as JSON, so runs of different commits can be compared. Run it from the repository root:
+
+python benchmarks/suite.py --sizes 1000 100000 1000000 --output results.json
+
+Every user gets --trips-per-user trips of --expenses-per-trip expenses, so the sizes change the number of users while the data behind every request stays the same; raise --expenses-per-trip to see how a route scales with the data of one user.
+'''
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import quote
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tripstracking import create_app
+from tripstracking.db import open_db, init_db
+from tripstracking.seed import seed_db
+
+PASSWORD = 'benchpassword'
+
+class PeakRSS:
+    '''Samples the resident set size of the process every few milliseconds while a route runs, because ru_maxrss only ever grows and would report the peak of the seeding instead. Falls back to ru_maxrss where /proc is not available.'''
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._page_size = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+    def _rss(self):
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * self._page_size
+        except OSError:
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self._rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self._rss()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self._rss())
+
+def seed(app, rows, trips_per_user, expenses_per_trip, seed):
+    '''Fills the database with rows expenses through flask seed-db, spread over as many users as needed. Returns the number of users.'''
+    users = max(1, rows // (trips_per_user * expenses_per_trip))
+    with app.app_context():
+        init_db()
+        seed_db(open_db(), users, trips_per_user, expenses_per_trip, password=PASSWORD, seed=seed)
+    return users
+
+def user_targets(app, user_id):
+    '''Returns a trip and an expense of the user, so the routes that take ids read real rows.'''
+    with app.app_context():
+        row = open_db().execute(
+            'SELECT trip.trip_id, trip.destination, MIN(expense.expense_id) AS expense_id FROM trip JOIN expense ON expense.trip_id = trip.trip_id '
+            'WHERE trip.user_id = ? GROUP BY trip.trip_id ORDER BY trip.trip_id LIMIT 1', (user_id,)
+        ).fetchone()
+    return {"trip_id": row['trip_id'], "destination": quote(row['destination']), "expense_id": row['expense_id']}
+
+ROUTES = [
+    ('get_all_trips', 'GET', lambda t: '/trips/?limit=50', None),
+    ('get_all_trips_html', 'GET', lambda t: '/trips/', None),
+    ('get_trip', 'GET', lambda t: f"/trip/{t['trip_id']}/{t['destination']}", None),
+    ('get_all_expenses', 'GET', lambda t: f"/trips/expenses/{t['trip_id']}/{t['destination']}?limit=50", None),
+    ('get_expense', 'GET', lambda t: f"/trips/expenses/{t['trip_id']}/{t['expense_id']}/{t['destination']}", None),
+    ('get_analytics', 'GET', lambda t: '/trips/analytics', None),
+    ('search', 'GET', lambda t: '/search?q=dinner%20paris', None),
+    ('post_expense', 'POST', lambda t: f"/trips/add_expense/{t['trip_id']}/{t['destination']}", lambda t: {'amount': 12.5, 'expense_description': 'coffee'}),
+    ('post_batch', 'POST', lambda t: '/batch', lambda t: {'operations': [{'op': 'create', 'type': 'expense', 'trip_id': t['trip_id'], 'data': {'amount': 12.5, 'expense_description': 'coffee'}}] * 20}),
+    ('login_user', 'POST', lambda t: '/users/login', lambda t: {'username': t['username'], 'password': PASSWORD}),
+]
+'''(name, method, path, JSON body) of every benchmarked route. path and body get the targets of the user the client is logged in as.'''
+
+def drive(app, clients, method, path, body, requests, concurrency):
+    '''Sends requests requests to a route from concurrency threads, each with its own logged in test client, and returns the latency statistics.'''
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    remaining = iter(range(requests))
+
+    def worker(client, targets):
+        nonlocal errors
+        url = path(targets)
+        data = body(targets) if body else None
+        while True:
+            with lock:
+                if next(remaining, None) is None:
+                    return
+            started = time.perf_counter()
+            response = client.open(url, method=method, json=data, headers={'Accept': 'application/json'})
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                errors += response.status_code >= 400
+
+    threads = [threading.Thread(target=worker, args=clients[i % len(clients)]) for i in range(concurrency)]
+    with PeakRSS() as rss:
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+    quantiles = statistics.quantiles(latencies, n=100, method='inclusive')
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "throughput": round(requests / elapsed, 1),
+        "p50_ms": round(quantiles[49] * 1000, 3),
+        "p95_ms": round(quantiles[94] * 1000, 3),
+        "p99_ms": round(quantiles[98] * 1000, 3),
+        "errors": errors,
+        "peak_rss_mb": round(rss.peak / 2**20, 1),
+    }
+
+def run_dataset(args, rows):
+    db_fd, db_path = tempfile.mkstemp(suffix='.db')
+    app = create_app()
+    app.config.update(
+        DATABASE=db_path, DB_POOL_SIZE=max(args.concurrency, 8), THUMBNAIL_WORKERS=0,
+        PASSWORD_METHOD=args.password_method, PASSWORD_HASH_QUEUE=max(args.concurrency, 16)
+    )
+    try:
+        started = time.perf_counter()
+        users = seed(app, rows, args.trips_per_user, args.expenses_per_trip, args.seed)
+        result = {"rows": rows, "users": users, "seed_seconds": round(time.perf_counter() - started, 2), "routes": {}}
+
+        clients = []
+        for user_id in range(1, min(users, args.concurrency) + 1):
+            targets = user_targets(app, user_id)
+            targets['username'] = f'seed{user_id}'
+            client = app.test_client()
+            client.post('/users/login', json={'username': targets['username'], 'password': PASSWORD}, headers={'Accept': 'application/json'})
+            clients.append((client, targets))
+
+        for name, method, path, body in ROUTES:
+            if args.routes and name not in args.routes:
+                continue
+            requests = args.login_requests if name == 'login_user' else args.requests
+            result["routes"][name] = drive(app, clients, method, path, body, requests, args.concurrency)
+            print(f"{rows:>8} rows {name:<20} {result['routes'][name]}", file=sys.stderr)
+        return result
+    finally:
+        app.extensions['password_hasher'].shutdown()
+        app.extensions['db_pool'].close()
+        os.close(db_fd)
+        os.unlink(db_path)
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the main routes on seeded datasets and reports the results as JSON.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000], help='Numbers of expense rows to seed.')
+    parser.add_argument('--trips-per-user', type=int, default=20)
+    parser.add_argument('--expenses-per-trip', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=500, help='Requests per route.')
+    parser.add_argument('--login-requests', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--routes', nargs='*', help='Only benchmark these routes.')
+    parser.add_argument('--password-method', default='pbkdf2:sha256:1000', help='Hash of the seeded passwords, cheap by default so login_user measures the route rather than the hash.')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Write the JSON results to this file instead of stdout.')
+    args = parser.parse_args()
+
+    results = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "datasets": [run_dataset(args, rows) for rows in args.sizes],
+    }
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
@@ -7,5 +7,11 @@ setup(
     include_package_data=True,
     install_requires=[
         "flask",
+        "numpy",
+        "Pillow",
     ],
+    extras_require={
+        "async": ["asgiref", "aiosqlite"],
+        "json": ["orjson"],
+    },
 )
\ No newline at end of file
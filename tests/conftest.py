@@ -7,14 +7,14 @@ from tripstracking.db import open_db, init_db
 with open(os.path.join(os.path.dirname(__file__), 'test_schema.sql'), 'rb') as f:
     _test_schema_sql = f.read().decode('utf8')
 
-@pytest.fixture
-def app():
+def make_app(async_views=False):
     db_fd, db_path = tempfile.mkstemp()
 
-    app = create_app()
+    app = create_app(async_views=async_views)
     app.config.update({
         'TESTING': True,
         'DATABASE': db_path,
+        'THUMBNAIL_WORKERS': 0,
     })
 
     with app.app_context():
@@ -23,9 +23,21 @@ def app():
     
     yield app
 
+    app.extensions['db_pool'].close()
+    if 'aiodb_pool' in app.extensions:
+        app.extensions['aiodb_pool'].close()
     os.close(db_fd)
     os.unlink(db_path)
 
+@pytest.fixture
+def app():
+    yield from make_app()
+
+@pytest.fixture
+def async_app():
+    pytest.importorskip('aiosqlite')
+    yield from make_app(async_views=True)
+
 @pytest.fixture
 def client(app):
     return app.test_client()
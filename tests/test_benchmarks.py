@@ -0,0 +1,26 @@
+import json
+import os
+import subprocess
+import sys
+
+SUITE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks', 'suite.py')
+
+def test_suite_smoke(tmp_path):
+    output = tmp_path / 'results.json'
+    subprocess.run(
+        [sys.executable, SUITE, '--sizes', '100', '--trips-per-user', '2', '--expenses-per-trip', '50',
+         '--requests', '4', '--login-requests', '2', '--concurrency', '2', '--output', str(output)],
+        check=True, capture_output=True, timeout=120
+    )
+
+    results = json.loads(output.read_text())
+    dataset, = results['datasets']
+    assert dataset['rows'] == 100
+    assert dataset['users'] == 1
+    assert set(dataset['routes']) == {
+        'get_all_trips', 'get_all_trips_html', 'get_trip', 'get_all_expenses', 'get_expense',
+        'get_analytics', 'search', 'post_expense', 'post_batch', 'login_user'
+    }
+    for name, route in dataset['routes'].items():
+        assert route['errors'] == 0, name
+        assert route['p50_ms'] <= route['p99_ms']
@@ -0,0 +1,139 @@
+import json
+import pytest
+from tripstracking.db import open_db, get_pool, ConnectionPool
+
+
+def test_open_db_sets_pragmas(app):
+    with app.app_context():
+        db = open_db()
+        assert db.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert db.execute('PRAGMA synchronous').fetchone()[0] == 1
+        assert db.execute('PRAGMA foreign_keys').fetchone()[0] == 1
+        assert db.execute('PRAGMA busy_timeout').fetchone()[0] == 5000
+
+def test_busy_timeout_is_separate_from_pool_timeout(app):
+    app.config.update(DB_POOL_TIMEOUT=0.05, DB_BUSY_TIMEOUT=2.5)
+    pool = ConnectionPool(app)
+    db = pool.checkout()
+    assert db.execute('PRAGMA busy_timeout').fetchone()[0] == 2500
+    pool.checkin(db)
+
+def test_connections_are_reused(app):
+    with app.app_context():
+        first = open_db()
+    with app.app_context():
+        second = open_db()
+        stats = get_pool().stats()
+
+    assert first is second
+    assert stats['hits'] >= 1
+    assert stats['checkouts'] >= 2
+
+def test_close_db_rolls_back_open_transaction(app):
+    with app.app_context():
+        db = open_db()
+        db.execute("INSERT INTO user (fullname, username, password, email) VALUES ('a', 'pooled', 'x', 'a@example.com')")
+        assert db.in_transaction
+    with app.app_context():
+        assert open_db().execute("SELECT * FROM user WHERE username = 'pooled'").fetchone() is None
+
+def test_pool_waits_when_exhausted(app):
+    app.config.update(DB_POOL_SIZE=1, DB_POOL_TIMEOUT=0.05)
+    pool = app.extensions['db_pool']
+    db = pool.checkout()
+    with pytest.raises(RuntimeError):
+        pool.checkout()
+    pool.checkin(db)
+
+    stats = pool.stats()
+    assert stats['waits'] == 1
+    assert stats['timeouts'] == 1
+
+def test_migrate_status(runner):
+    result = runner.invoke(args=['migrate', '--status'])
+    assert '0001_initial_schema: applied' in result.output
+    assert 'pending' not in result.output
+
+    result = runner.invoke(args=['migrate'])
+    assert 'The database is up to date!' in result.output
+
+def test_migrate_keeps_existing_data(app, runner):
+    with app.app_context():
+        db = open_db()
+        db.execute('DELETE FROM schema_version WHERE version = 2')
+        db.execute('DROP INDEX idx_trip_user_date')
+        db.commit()
+
+    result = runner.invoke(args=['migrate'])
+    assert 'Applied 0002_query_indexes' in result.output
+
+    with app.app_context():
+        db = open_db()
+        assert db.execute("SELECT * FROM user WHERE username = 'test'").fetchone() is not None
+        plan = db.execute(
+            'EXPLAIN QUERY PLAN SELECT trip_id FROM trip WHERE user_id = ? ORDER BY date DESC', (1,)
+        ).fetchall()
+        assert any('idx_trip_user_date' in row['detail'] for row in plan)
+        assert not any('TEMP B-TREE' in row['detail'] for row in plan)
+
+def test_seed_db(app, runner, client):
+    app.config['PASSWORD_METHOD'] = 'pbkdf2:sha256:1000'
+    with app.app_context():
+        db = open_db()
+        triggers = db.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger'").fetchone()[0]
+
+    result = runner.invoke(args=['seed-db', '--users', '3', '--trips-per-user', '2', '--expenses-per-trip', '5', '--photos-per-trip', '1'])
+    assert 'Seeded 3 users, 6 trips, 30 expenses and 6 photos!' in result.output
+
+    with app.app_context():
+        db = open_db()
+        assert db.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger'").fetchone()[0] == triggers
+        assert db.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert db.execute('PRAGMA foreign_keys').fetchone()[0] == 1
+        drift = db.execute(
+            'SELECT COUNT(*) FROM trip_stats JOIN (SELECT trip_id, COUNT(*) AS n, SUM(base_amount) AS total FROM expense GROUP BY trip_id) AS actual '
+            'ON actual.trip_id = trip_stats.trip_id WHERE trip_stats.expense_count != actual.n OR abs(trip_stats.expense_total - actual.total) > 0.001'
+        ).fetchone()[0]
+        assert drift == 0
+        assert db.execute("SELECT COUNT(*) FROM search_index WHERE owner = 'u2'").fetchone()[0] == 12
+        assert db.execute('SELECT MIN(ref_count) FROM photo_blob').fetchone()[0] == 1
+        first = [tuple(row) for row in db.execute('SELECT destination, date, budget FROM trip WHERE user_id = 2')]
+
+    response = client.post('/users/login', json={'username': 'seed2', 'password': 'seedpassword'}, headers={'Accept': 'application/json'})
+    assert response.status_code == 200
+
+    runner.invoke(args=['seed-db', '--users', '1', '--trips-per-user', '2', '--expenses-per-trip', '5'])
+    with app.app_context():
+        assert [tuple(row) for row in open_db().execute('SELECT destination, date, budget FROM trip WHERE user_id = 5')] == first
+
+def test_slow_query_tracing(app, runner, tmp_path):
+    log = tmp_path / 'slow.jsonl'
+    app.config.update(SQL_SLOW_QUERY_THRESHOLD=0, SQL_SLOW_QUERY_LOG=str(log))
+    with app.app_context():
+        db = open_db()
+        db.execute('SELECT * FROM trip WHERE description = ?', ('a',)).fetchall()
+        db.execute("SELECT * FROM trip WHERE description = 'b'").fetchall()
+        db.execute('SELECT user_id FROM trip ORDER BY budget').fetchall()
+        db.execute('SELECT * FROM trip WHERE trip_id IN (?, ?, ?)', (1, 2, 3)).fetchall()
+        db.execute('SELECT * FROM trip WHERE trip_id IN (?, ?)', (1, 2)).fetchall()
+
+    entries = [json.loads(line) for line in log.read_text().splitlines()]
+    assert len({entry['fingerprint'] for entry in entries}) == 3
+    scan = next(entry for entry in entries if 'description' in entry['sql'])
+    assert scan['sql'] == 'SELECT * FROM trip WHERE description = ?'
+    assert scan['scan'] and not scan['temp_btree']
+    sort = next(entry for entry in entries if 'ORDER BY budget' in entry['sql'])
+    assert sort['temp_btree']
+    lookup = next(entry for entry in entries if 'IN (?+)' in entry['sql'])
+    assert not lookup['scan']
+
+    result = runner.invoke(args=['sql-report', '--sort', 'count', '--top', '1'])
+    lines = result.output.splitlines()
+    assert ' 2x ' in lines[0] and 'SCAN' in lines[0]
+    assert any(line.strip().startswith('plan: SCAN trip') for line in lines)
+
+def test_slow_query_tracing_is_off_by_default(app, tmp_path):
+    app.config['SQL_SLOW_QUERY_LOG'] = str(tmp_path / 'slow.jsonl')
+    with app.app_context():
+        open_db().execute('SELECT * FROM trip ORDER BY budget').fetchall()
+    assert not (tmp_path / 'slow.jsonl').exists()
@@ -1,5 +1,6 @@
 from flask import g, session
 from tripstracking.db import open_db
+from tripstracking.cache import UserCache
 
 
 def test_register(client, app):
@@ -39,3 +40,61 @@ def test_delete_user(client, auth):
     with client:
         assert client.get('/users/delete_user').status_code == 200
 
+
+def test_user_info_is_cached(client, auth, app):
+    auth.login()
+    client.get('/')
+    client.get('/')
+
+    stats = app.extensions['user_cache'].stats()
+    assert stats['misses'] == 1
+    assert stats['hits'] >= 1
+
+def test_delete_user_invalidates_cache(client, auth, app):
+    auth.login()
+    client.get('/')
+    client.post('/users/delete_user')
+
+    cache = app.extensions['user_cache']
+    assert cache.get(1) is None
+    assert cache.stats()['invalidations'] == 1
+
+    with app.app_context():
+        assert open_db().execute("SELECT * FROM user WHERE user_id = 1").fetchone() is None
+
+def test_user_cache_evicts_least_recently_used():
+    cache = UserCache(size=2, ttl=60)
+    cache.put(1, 'one')
+    cache.put(2, 'two')
+    cache.get(1)
+    cache.put(3, 'three')
+
+    assert cache.get(2) is None
+    assert cache.get(1) == 'one'
+    assert cache.stats()['evictions'] == 1
+
+def test_login_rehashes_password_when_method_changes(client, auth, app):
+    app.config['PASSWORD_METHOD'] = 'pbkdf2:sha256:1000'
+    assert auth.login().status_code == 302
+
+    with app.app_context():
+        password = open_db().execute("SELECT password FROM user WHERE username = 'test'").fetchone()['password']
+    assert password.startswith('pbkdf2:sha256:1000$')
+
+    client.get('/users/logout')
+    assert auth.login().status_code == 302
+    response = client.post('/users/login', data={'username': 'test', 'password': 'wrong'})
+    assert response.headers['Location'].startswith('/users/login')
+
+def test_login_fails_fast_when_hasher_is_busy(client, app):
+    app.config['PASSWORD_HASH_QUEUE'] = 1
+    hasher = app.extensions['password_hasher']
+    hasher._get_slots().acquire()
+
+    response = client.post('/users/login', json={'username': 'test', 'password': 'testpassword'}, headers={'Accept': 'application/json'})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+
+    hasher._get_slots().release()
+    response = client.post('/users/login', json={'username': 'test', 'password': 'testpassword'}, headers={'Accept': 'application/json'})
+    assert response.status_code == 200
@@ -1,5 +1,12 @@
+import csv
+import gzip
+import io
+import json
+import zlib
 from pathlib import Path
-from tripstracking import db
+import pytest
+from PIL import Image
+from tripstracking import analytics, db, importer
 
 def test_home(client, auth):
     response = client.get("/")
@@ -125,3 +132,724 @@ def test_delete_expence(client,auth):
 
     response = client.post("/trips/delete_expense/1/1/Paris")
     assert response.status_code == 302
+
+def collect_pages(client, url, key):
+    items, cursor = [], None
+    while True:
+        query = {'limit': 2}
+        if cursor:
+            query['after'] = cursor
+        response = client.get(url, query_string=query, headers={"Accept": "application/json"})
+        assert response.status_code == 200
+        items.extend(response.json[key])
+        cursor = response.json["next_cursor"]
+        if cursor is None:
+            return items
+
+def test_get_all_trips_pagination(client, auth, app):
+    with app.app_context():
+        connection = db.open_db()
+        for destination, date in [("Rome", "2024-05-01"), ("Oslo", None), ("Lima", "2024-07-01"), ("Bern", "2024-05-01"), ("Kyiv", None)]:
+            connection.execute(
+                "INSERT INTO trip (destination, date, description, budget, user_id) VALUES (?, ?, 'Trip', 100, 1)", (destination, date)
+            )
+        connection.commit()
+
+    auth.login()
+    trips = collect_pages(client, "/trips/", "trips")
+    assert [trip["destination"] for trip in trips] == ["Lima", "Bern", "Rome", "Kyiv", "Oslo"]
+
+def test_get_all_trips_invalid_cursor(client, auth):
+    auth.login()
+    response = client.get("/trips/?after=garbage", headers={"Accept": "application/json"})
+    assert response.status_code == 400
+
+def test_get_all_expenses_pagination(client, auth, app):
+    with app.app_context():
+        connection = db.open_db()
+        trip_id = connection.execute(
+            "INSERT INTO trip (destination, date, description, budget, user_id) VALUES ('Rome', '2024-05-01', 'Trip', 100, 1)"
+        ).lastrowid
+        for amount in [10, 50, 20, 50, 5]:
+            connection.execute("INSERT INTO expense (trip_id, amount, base_amount) VALUES (?, ?, ?)", (trip_id, amount, amount))
+        connection.commit()
+
+    auth.login()
+    expenses = collect_pages(client, f"/trips/expenses/{trip_id}/Rome", "expenses")
+    assert [float(expense["amount"]) for expense in expenses] == [50, 50, 20, 10, 5]
+    assert len({expense["expense_id"] for expense in expenses}) == 5
+
+def test_trip_expense_stats(client, auth, app, runner):
+    auth.login()
+    headers = {"Accept": "application/json"}
+    response = client.post("/add_trip", json={"destination": "Rome", "date": "2024-05-01", "description": "Trip", "budget": 100}, headers=headers)
+    trip_id = response.json["trip"]["trip_id"]
+
+    expense_ids = []
+    for amount in [10, 30, 5]:
+        response = client.post(f"/trips/add_expense/{trip_id}/Rome", json={"amount": amount}, headers=headers)
+        expense_ids.append(response.json["expense"]["expense_id"])
+    client.post(f"/trips/delete_expense/{trip_id}/{expense_ids[1]}/Rome", headers=headers)
+
+    trip = client.get(f"/trip/{trip_id}/Rome", headers=headers).json["trip"]
+    assert float(trip["expense_count"]) == 2
+    assert float(trip["expense_total"]) == 15
+    assert float(trip["expense_max"]) == 10
+    assert float(trip["remaining_budget"]) == 85
+
+    with app.app_context():
+        connection = db.open_db()
+        connection.execute("UPDATE trip_stats SET expense_total = 0")
+        connection.commit()
+
+    result = runner.invoke(args=['rebuild-stats'])
+    assert 'Rebuilt' in result.output
+    trip = client.get("/trips/", headers=headers).json["trips"][0]
+    assert float(trip["expense_total"]) == 15
+
+def test_get_analytics(client, auth, app):
+    with app.app_context():
+        connection = db.open_db()
+        rome = connection.execute(
+            "INSERT INTO trip (destination, date, description, budget, user_id) VALUES ('Rome', '2024-05-01', 'Trip', 100, 1)"
+        ).lastrowid
+        oslo = connection.execute(
+            "INSERT INTO trip (destination, date, description, budget, user_id) VALUES ('Oslo', '2024-06-01', 'Trip', NULL, 1)"
+        ).lastrowid
+        for trip_id, amount, date in [(rome, 10, '2024-05-02'), (rome, 30, '03.05.2024'), (oslo, 60, '2024-06-10')]:
+            connection.execute(
+                "INSERT INTO expense (trip_id, amount, base_amount, expense_date) VALUES (?, ?, ?, ?)", (trip_id, amount, amount, date)
+            )
+        connection.commit()
+
+    auth.login()
+    response = client.get("/trips/analytics")
+    assert response.status_code == 200
+
+    summary = response.json
+    assert summary["expense_count"] == 3
+    assert summary["total"] == 100
+    assert summary["by_month"] == [
+        {"month": "2024-05", "total": 40, "count": 2},
+        {"month": "2024-06", "total": 60, "count": 1},
+    ]
+    assert {row["destination"]: row["total"] for row in summary["by_destination"]} == {"Oslo": 60, "Rome": 40}
+    rome_stats = next(row for row in summary["budget_vs_actual"] if row["trip_id"] == rome)
+    assert rome_stats["remaining"] == 60
+    assert rome_stats["used"] == 0.4
+    assert summary["amount_percentiles"]["p50"] == 30
+
+    with app.app_context():
+        connection = db.open_db()
+        connection.execute("INSERT INTO expense (trip_id, amount, base_amount, expense_date) VALUES (?, 5, 5, 'May 2024')", (oslo,))
+        connection.commit()
+    summary = client.get("/trips/analytics").json
+    assert summary["by_month"][0] == {"month": None, "total": 5, "count": 1}
+    assert summary["total"] == 105
+
+def test_analytics_amounts_out_of_range(app):
+    with app.app_context():
+        connection = db.open_db()
+        trip_id = connection.execute(
+            "INSERT INTO trip (destination, date, description, budget, user_id) VALUES ('Rome', '2024-05-01', 'Trip', 100, 1)"
+        ).lastrowid
+        for amounts in [(10.0, -6.5e9), (4.5e9, -5.1e9), (-3.5e9, 2.5e9)]:
+            connection.execute("DELETE FROM expense")
+            for amount in amounts:
+                connection.execute(
+                    "INSERT INTO expense (trip_id, amount, base_amount, expense_date) VALUES (?, ?, ?, '2024-05-02')", (trip_id, amount, amount)
+                )
+            assert sorted(analytics.load_columns(connection, 1)[0]) == sorted(amounts)
+        connection.rollback()
+
+def test_import_expenses(client, auth, app):
+    with app.app_context():
+        connection = db.open_db()
+        trip_id = connection.execute(
+            "INSERT INTO trip (destination, date, description, budget, user_id) VALUES ('Rome', '2024-05-01', 'Trip', 100, 1)"
+        ).lastrowid
+        connection.commit()
+
+    auth.login()
+    upload = b"amount,expense_description,expense_date\n12.5,Dinner,2024-05-01\n,Missing amount,2024-05-02\n7,Taxi,2024-05-03\n"
+    response = client.post(
+        f"/trips/{trip_id}/expenses/import",
+        data={"file": (io.BytesIO(upload), "expenses.csv")},
+        headers={"Accept": "application/json"}
+    )
+    assert response.status_code == 200
+    assert response.json["imported"] == 2
+    assert response.json["failed"] == 1
+    assert response.json["errors"][0]["row"] == 2
+    assert "amount" in response.json["errors"][0]["errors"]
+
+    upload = b'{"amount": 3, "expense_date": "2024-05-04"}\nnot json\n'
+    response = client.post(
+        f"/trips/{trip_id}/expenses/import?format=ndjson", data=upload,
+        headers={"Accept": "application/json"}
+    )
+    assert response.json["imported"] == 1
+    assert response.json["failed"] == 1
+
+    trip = client.get(f"/trip/{trip_id}/Rome", headers={"Accept": "application/json"}).json["trip"]
+    assert float(trip["expense_count"]) == 3
+    assert float(trip["expense_total"]) == 22.5
+    results = client.get("/search?q=taxi", headers={"Accept": "application/json"}).json["results"]
+    assert [result["description"] for result in results] == ["Taxi"]
+
+    with app.app_context():
+        connection = db.open_db()
+        triggers = connection.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'expense'").fetchone()[0]
+        version = connection.execute("SELECT data_version FROM trip WHERE trip_id = ?", (trip_id,)).fetchone()[0]
+
+    upload = b'{"amount": 5, "expense_description": "Museum"}\n{"amount": "NaN", "expense_description": "Broken"}\n'
+    response = client.post(
+        f"/trips/{trip_id}/expenses/import?format=ndjson", data=upload,
+        headers={"Accept": "application/json"}
+    )
+    assert response.status_code == 200
+    assert response.json == {"imported": 1, "failed": 1, "errors": [{"row": 2, "errors": {"amount": ["amount must be a number"]}}]}
+
+    with app.app_context():
+        connection = db.open_db()
+        with pytest.raises(importer.RowRejected) as rejected:
+            importer.import_expenses(connection, 9999, iter([(1, {"amount": 5, "expense_description": None, "expense_date": None, "currency": None}, None)]), 10, 10)
+        assert rejected.value.report == {"imported": 0, "failed": 1, "errors": [{"row": 1, "errors": {"database": ["FOREIGN KEY constraint failed"]}}]}
+        assert connection.execute("SELECT COUNT(*) FROM expense WHERE trip_id = ?", (trip_id,)).fetchone()[0] == 4
+        assert connection.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'expense'").fetchone()[0] == triggers
+        assert connection.execute("SELECT data_version FROM trip WHERE trip_id = ?", (trip_id,)).fetchone()[0] == version + 1
+
+def test_import_expenses_unknown_trip(client, auth):
+    auth.login()
+    response = client.post("/trips/1/expenses/import", data=b"x", headers={"Accept": "application/json"})
+    assert response.status_code == 404
+
+def test_export(client, auth, app):
+    with app.app_context():
+        connection = db.open_db()
+        trip_id = connection.execute(
+            "INSERT INTO trip (destination, date, description, budget, user_id) VALUES ('Rome', '2024-05-01', 'Trip', 100, 1)"
+        ).lastrowid
+        connection.execute("INSERT INTO expense (trip_id, amount, base_amount, expense_description) VALUES (?, 12.5, 12.5, 'Dinner')", (trip_id,))
+        connection.commit()
+
+    auth.login()
+    response = client.get("/export?format=ndjson")
+    assert response.status_code == 200
+    records = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert [record["type"] for record in records] == ["trip", "expense"]
+    assert records[1]["amount"] == 12.5
+
+    response = client.get("/export?format=csv&gzip=1")
+    assert response.mimetype == "application/gzip"
+    rows = list(csv.DictReader(io.StringIO(gzip.decompress(response.data).decode())))
+    assert [row["record_type"] for row in rows] == ["trip", "expense"]
+    assert rows[0]["destination"] == "Rome"
+
+    with app.app_context():
+        connection = db.open_db()
+        connection.execute("INSERT INTO photo (trip_id, user_id, file_path) VALUES (NULL, 1, 'ab/cd.jpg')")
+        connection.commit()
+    records = [json.loads(line) for line in client.get("/export?format=ndjson").data.decode().splitlines()]
+    assert [(record["type"], record["trip_id"]) for record in records][2:] == [("photo", None)]
+
+def test_list_pages_render_first_page(client, auth, app):
+    with app.app_context():
+        connection = db.open_db()
+        trip_id = connection.execute(
+            "INSERT INTO trip (destination, date, description, budget, user_id) VALUES ('Rome', '2024-05-01', 'Trip', 100, 1)"
+        ).lastrowid
+        connection.execute("INSERT INTO expense (trip_id, amount, base_amount, expense_description) VALUES (?, 12.5, 12.5, 'Gelato')", (trip_id,))
+        connection.commit()
+
+    auth.login()
+    response = client.get("/trips/")
+    assert b"Destination: Rome" in response.data
+    assert b"let nextCursor = null;" in response.data
+
+    response = client.get(f"/trips/expenses/{trip_id}/Rome")
+    assert b"Gelato" in response.data
+
+def test_json_values_are_typed_and_not_escaped(client, auth, app):
+    with app.app_context():
+        connection = db.open_db()
+        trip_id = connection.execute(
+            "INSERT INTO trip (destination, date, description, budget, user_id) VALUES ('Rome', '2024-05-01', 'Fish & <chips>', 100, 1)"
+        ).lastrowid
+        connection.commit()
+
+    auth.login()
+    headers = {"Accept": "application/json"}
+    trip = client.get("/trips/", headers=headers).json["trips"][0]
+    assert trip["description"] == "Fish & <chips>"
+    assert (trip["trip_id"], trip["budget"], trip["expense_count"], trip["expense_min"]) == (trip_id, 100, 0, None)
+    assert client.get(f"/trip/{trip_id}/Rome", headers=headers).json["trip"] == trip
+
+    response = client.get("/trips/")
+    assert b"Fish &amp; &lt;chips&gt;" in response.data
+
+def test_conditional_get(client, auth):
+    auth.login()
+    headers = {"Accept": "application/json"}
+    response = client.post("/add_trip", json={"destination": "Rome", "date": "2024-05-01", "description": "Trip", "budget": 100}, headers=headers)
+    trip_id = response.json["trip"]["trip_id"]
+
+    response = client.get("/trips/", headers=headers)
+    etag = response.headers["ETag"]
+    assert response.last_modified is None
+
+    response = client.get("/trips/", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304
+
+    trip_etag = client.get(f"/trip/{trip_id}/Rome", headers=headers).headers["ETag"]
+    client.post(f"/trips/add_expense/{trip_id}/Rome", json={"amount": 10}, headers=headers)
+
+    response = client.get("/trips/", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+    response = client.get(f"/trip/{trip_id}/Rome", headers={**headers, "If-None-Match": trip_etag})
+    assert response.status_code == 200
+
+    expenses_etag = client.get(f"/trips/expenses/{trip_id}/Rome", headers=headers).headers["ETag"]
+    response = client.get(f"/trips/expenses/{trip_id}/Rome", headers={**headers, "If-None-Match": expenses_etag})
+    assert response.status_code == 304
+
+    response = client.get(f"/trips/expenses/{trip_id}/999/Rome", headers={**headers, "If-None-Match": trip_etag})
+    assert response.status_code == 404
+
+def test_if_modified_since(client, auth, app):
+    auth.login()
+    headers = {"Accept": "application/json"}
+    trip_id = client.post("/add_trip", json={"destination": "Rome", "description": "Trip"}, headers=headers).json["trip"]["trip_id"]
+    with app.app_context():
+        connection = db.open_db()
+        connection.execute("UPDATE user SET data_modified = datetime('now', '-10 seconds') WHERE user_id = 1")
+        connection.commit()
+
+    last_modified = client.get("/trips/", headers=headers).headers["Last-Modified"]
+    assert client.get("/trips/", headers={**headers, "If-Modified-Since": last_modified}).status_code == 304
+
+    client.post(f"/trips/add_expense/{trip_id}/Rome", json={"amount": 10}, headers=headers)
+    response = client.get("/trips/", headers={**headers, "If-Modified-Since": last_modified})
+    assert response.status_code == 200
+    assert response.last_modified is None
+    client.post(f"/trips/add_expense/{trip_id}/Rome", json={"amount": 20}, headers=headers)
+    assert client.get("/trips/", headers={**headers, "If-Modified-Since": last_modified}).json["trips"][0]["expense_total"] == 30
+
+def test_photo_uploads_are_deduplicated(client, auth, app, tmp_path):
+    app.config['UPLOAD_FOLDER'] = str(tmp_path)
+    auth.login()
+    headers = {"Accept": "application/json"}
+
+    photo_ids = []
+    for name in ["IMG_0001.jpg", "copy.JPG"]:
+        response = client.post("/trips/add_photos", data={"photos": (io.BytesIO(b"same image bytes"), name)}, headers=headers)
+        assert response.status_code == 201
+        photo_ids.extend(response.json["photo_ids"])
+
+    with app.app_context():
+        connection = db.open_db()
+        blob = connection.execute("SELECT file_path, ref_count FROM photo_blob").fetchone()
+        assert connection.execute("SELECT COUNT(*) FROM photo_blob").fetchone()[0] == 1
+    assert blob["ref_count"] == 2
+    blob_file = tmp_path / blob["file_path"]
+    assert blob_file.read_bytes() == b"same image bytes"
+    assert blob_file.parent.parent.parent == tmp_path
+
+    assert client.post(f"/trips/delete_photo/{photo_ids[0]}", headers=headers).status_code == 200
+    assert blob_file.exists()
+    assert client.post(f"/trips/delete_photo/{photo_ids[1]}", headers=headers).status_code == 200
+    assert not blob_file.exists()
+    assert client.post(f"/trips/delete_photo/{photo_ids[1]}", headers=headers).status_code == 404
+
+def test_photo_renditions(client, auth, app, runner, tmp_path):
+    app.config['UPLOAD_FOLDER'] = str(tmp_path)
+    image = io.BytesIO()
+    Image.new('RGB', (1000, 600), 'blue').save(image, 'JPEG')
+    auth.login()
+
+    response = client.post("/trips/add_photos", data={"photos": (io.BytesIO(image.getvalue()), "beach.jpg")}, headers={"Accept": "application/json"})
+    photo_id = response.json["photo_ids"][0]
+
+    with app.app_context():
+        connection = db.open_db()
+        renditions = connection.execute("SELECT width, file_path FROM photo_rendition ORDER BY width").fetchall()
+    assert [row["width"] for row in renditions] == [320, 800]
+    with Image.open(tmp_path / renditions[0]["file_path"]) as thumbnail:
+        assert thumbnail.size == (320, 192)
+
+    assert f"/trips/photos/{photo_id}/file?width=320".encode() in client.get("/trips/photos/").data
+    assert f"/trips/photos/{photo_id}/file?width=800".encode() in client.get(f"/trips/photos/{photo_id}").data
+    assert b"file_path" not in client.get(f"/trips/photos/{photo_id}").data
+
+    with app.app_context():
+        connection = db.open_db()
+        connection.execute("DELETE FROM photo_rendition")
+        connection.execute("UPDATE photo_blob SET rendered = NULL")
+        connection.commit()
+
+    assert '1 photos miss' in runner.invoke(args=['thumbnails']).output
+    assert 'Generated the renditions of 1 photos' in runner.invoke(args=['thumbnails', '--backfill', '--workers', '1']).output
+    with app.app_context():
+        assert db.open_db().execute("SELECT COUNT(*) FROM photo_rendition").fetchone()[0] == 2
+
+    client.post(f"/trips/delete_photo/{photo_id}", headers={"Accept": "application/json"})
+    assert not (tmp_path / renditions[0]["file_path"]).exists()
+
+    (tmp_path / "deleted.jpg").write_bytes(image.getvalue())
+    with app.app_context():
+        app.extensions['thumbnail_pool'].submit("deleted", "deleted.jpg")
+    assert sorted(path.name for path in tmp_path.iterdir() if path.name.startswith("deleted")) == ["deleted.jpg"]
+
+def test_photo_file(client, auth, app, tmp_path):
+    app.config['UPLOAD_FOLDER'] = str(tmp_path)
+    image = io.BytesIO()
+    Image.new('RGB', (1000, 600), 'red').save(image, 'JPEG')
+    auth.login()
+
+    response = client.post("/trips/add_photos", data={"photos": (io.BytesIO(image.getvalue()), "sunset.jpg")}, headers={"Accept": "application/json"})
+    photo_id = response.json["photo_ids"][0]
+
+    response = client.get(f"/trips/photos/{photo_id}/file")
+    assert response.status_code == 200
+    assert response.data == image.getvalue()
+    assert response.mimetype == "image/jpeg"
+    assert response.headers["Accept-Ranges"] == "bytes"
+    assert "immutable" in response.headers["Cache-Control"]
+    assert "private" in response.headers["Cache-Control"]
+    assert "public" not in response.headers["Cache-Control"]
+    etag = response.headers["ETag"]
+
+    assert client.get(f"/trips/photos/{photo_id}/file", headers={"If-None-Match": etag}).status_code == 304
+
+    response = client.get(f"/trips/photos/{photo_id}/file", headers={"Range": "bytes=10-19"})
+    assert response.status_code == 206
+    assert response.data == image.getvalue()[10:20]
+    assert response.headers["Content-Range"] == f"bytes 10-19/{len(image.getvalue())}"
+
+    with Image.open(io.BytesIO(client.get(f"/trips/photos/{photo_id}/file?width=320").data)) as thumbnail:
+        assert thumbnail.size == (320, 192)
+    assert client.get(f"/trips/photos/{photo_id}/file?width=321").status_code == 404
+
+    with app.app_context():
+        connection = db.open_db()
+        connection.execute("INSERT INTO user (fullname, username, password, email) VALUES ('Other', 'other', '', 'other@example.com')")
+        connection.execute("UPDATE photo SET user_id = (SELECT user_id FROM user WHERE username = 'other')")
+        connection.commit()
+    assert client.get(f"/trips/photos/{photo_id}/file").status_code == 404
+
+def test_async_views_match_sync_views(app, async_app, tmp_path):
+    headers = {"Accept": "application/json"}
+    image = io.BytesIO()
+    Image.new('RGB', (400, 300), 'green').save(image, 'JPEG')
+    responses = []
+    for build in (app, async_app):
+        build.config['UPLOAD_FOLDER'] = str(tmp_path / str(len(responses)))
+        client = build.test_client()
+        assert client.post('/users/login', json={'username': 'test', 'password': 'testpassword'}, headers=headers).status_code == 200
+
+        trip = client.post('/add_trip', json={'destination': 'Rome', 'date': '2025-05-01', 'description': 'Spring', 'budget': 900}, headers=headers)
+        trip_id = trip.json['trip']['trip_id']
+        expense = client.post(f'/trips/add_expense/{trip_id}/Rome', json={'amount': 120, 'expense_description': 'Museum', 'expense_date': '2025-05-02'}, headers=headers)
+        expense_id = expense.json['expense']['expense_id']
+        photo = client.post('/trips/add_photos', data={'photos': (io.BytesIO(image.getvalue()), 'rome.jpg'), 'trip_id': trip_id}, headers=headers)
+        trips = client.get('/trips/?limit=1', headers=headers)
+        after = client.get(f"/trips/?limit=1&after={trips.json['next_cursor']}", headers=headers)
+
+        responses.append([
+            (response.status_code, response.json) for response in (
+                trip, expense, photo, trips, after,
+                client.get(f'/trip/{trip_id}/Rome', headers=headers),
+                client.get(f'/trips/expenses/{trip_id}/Rome', headers=headers),
+                client.get(f'/trips/expenses/{trip_id}/{expense_id}/Rome', headers=headers),
+                client.get('/trips/expenses/999/Nowhere', headers=headers),
+            )
+        ])
+        etag = client.get(f'/trips/expenses/{trip_id}/Rome', headers=headers).headers['ETag']
+        assert client.get(f'/trips/expenses/{trip_id}/Rome', headers={**headers, 'If-None-Match': etag}).status_code == 304
+        assert b'Rome' in client.get('/trips/').data
+
+    def without_timestamps(value):
+        if isinstance(value, dict):
+            return {key: without_timestamps(item) for key, item in value.items() if key != 'created'}
+        if isinstance(value, (list, tuple)):
+            return [without_timestamps(item) for item in value]
+        return value
+
+    assert without_timestamps(responses[0]) == without_timestamps(responses[1])
+    assert responses[1][2][0] == 201
+    assert (tmp_path / '1').is_dir()
+
+def test_async_build_is_instrumented(async_app, tmp_path):
+    log = tmp_path / 'slow.jsonl'
+    async_app.config.update(SQL_SLOW_QUERY_THRESHOLD=0, SQL_SLOW_QUERY_LOG=str(log))
+    headers = {"Accept": "application/json"}
+    client = async_app.test_client()
+    client.post('/users/login', json={'username': 'test', 'password': 'testpassword'}, headers=headers)
+
+    async_app.extensions['user_cache'].clear()
+    checkouts = async_app.extensions['db_pool'].stats()['checkouts']
+    assert client.get('/trips/', headers=headers).status_code == 404
+    assert async_app.extensions['db_pool'].stats()['checkouts'] == checkouts
+    assert async_app.extensions['user_cache'].stats()['misses'] == 1
+
+    text = client.get('/metrics').get_data(as_text=True)
+    assert 'tripstracking_request_sql_statements_count{endpoint="views.get_all_trips"} 1' in text
+    assert 'tripstracking_request_sql_statements_bucket{endpoint="views.get_all_trips",le="2"} 0' in text
+
+    entries = [json.loads(line) for line in log.read_text().splitlines()]
+    assert {entry['endpoint'] for entry in entries} >= {'users.login_user', 'views.get_all_trips'}
+    assert any(entry['sql'] == 'SELECT * FROM user WHERE user_id = ?' for entry in entries)
+
+def test_search(client, auth, app, runner):
+    auth.login()
+    headers = {"Accept": "application/json"}
+    trip_id = client.post('/add_trip', json={'destination': 'Lisbon', 'date': '2025-06-01', 'description': 'Pastéis & <b>fado</b>', 'budget': 800}, headers=headers).json['trip']['trip_id']
+    expense_id = client.post(f'/trips/add_expense/{trip_id}/Lisbon', json={'amount': 45, 'expense_description': 'Dinner at the market'}, headers=headers).json['expense']['expense_id']
+    client.post(f'/trips/add_expense/{trip_id}/Lisbon', json={'amount': 12, 'expense_description': 'Tram tickets'}, headers=headers)
+
+    with app.app_context():
+        connection = db.open_db()
+        connection.execute("INSERT INTO user (fullname, username, password, email) VALUES ('Other', 'other', '', 'other@example.com')")
+        connection.execute("INSERT INTO trip (destination, description, user_id) VALUES ('Lisbon', 'Dinner with friends', (SELECT user_id FROM user WHERE username = 'other'))")
+        connection.commit()
+
+    results = client.get('/search?q=that dinner in Lisbon', headers=headers).json['results']
+    assert [(result['kind'], result['expense_id']) for result in results][0] == ('expense', expense_id)
+    assert results[0]['description_highlight'] == '<mark>Dinner</mark> at the market'
+    assert all(result['trip_id'] == trip_id for result in results)
+
+    results = client.get('/search?q=pastei', headers=headers).json['results']
+    assert results[0]['description_highlight'] == '<mark>Pastéis</mark> &amp; &lt;b&gt;fado&lt;/b&gt;'
+
+    client.post(f'/edit_trip/{trip_id}/Lisbon', json={'destination': 'Porto', 'description': 'Port wine'}, headers=headers)
+    assert client.get('/search?q=lisbon', headers=headers).json['results'] == []
+    assert len(client.get('/search?q=porto', headers=headers).json['results']) == 3
+
+    client.post(f'/trips/delete_expense/{trip_id}/{expense_id}/Porto', headers=headers)
+    assert client.get('/search?q=dinner', headers=headers).json['results'] == []
+    assert client.get('/search?q=', headers=headers).status_code == 400
+    assert b'<mark>Tram</mark>' in client.get('/search?q=tram').data
+
+    assert 'Indexed 4 trips and expenses' in runner.invoke(args=['rebuild-search']).output
+    assert len(client.get('/search?q=porto', headers=headers).json['results']) == 2
+
+def test_search_results_are_not_escaped(client, auth):
+    auth.login()
+    headers = {"Accept": "application/json"}
+    trip_id = client.post('/add_trip', json={'destination': 'Trinidad & Tobago', 'description': 'Carnival', 'budget': 800}, headers=headers).json['trip']['trip_id']
+
+    result = client.get('/search?q=carnival', headers=headers).json['results'][0]
+    assert result['destination'] == 'Trinidad & Tobago'
+    assert result['destination_highlight'] == 'Trinidad &amp; Tobago'
+
+    response = client.get('/search?q=carnival')
+    assert f'href="/trip/{trip_id}/Trinidad%20&amp;%20Tobago"'.encode() in response.data
+    assert client.get(f'/trip/{trip_id}/Trinidad%20&%20Tobago').status_code == 200
+
+    client.post(f'/trips/add_expense/{trip_id}/Trinidad%20&%20Tobago', json={'amount': 20}, headers=headers)
+    results = client.get('/search?q=tobago', headers=headers).json['results']
+    assert [(result['kind'], result['description'], result['description_highlight']) for result in results if result['kind'] == 'expense'] == [('expense', None, '')]
+    assert b'None' not in client.get('/search?q=tobago').data
+
+def test_expense_currencies(client, auth, app, runner, tmp_path):
+    auth.login()
+    headers = {"Accept": "application/json"}
+    trip_id = client.post('/add_trip', json={'destination': 'Tokyo', 'description': 'Cherry blossoms', 'budget': 1000}, headers=headers).json['trip']['trip_id']
+
+    assert client.post(f'/trips/add_expense/{trip_id}/Tokyo', json={'amount': 1000, 'currency': 'JPY'}, headers=headers).json == {"error": "Unknown currency JPY"}
+    response = client.post(f'/trips/add_expense/{trip_id}/Tokyo', json={'amount': 1, 'currency': 5}, headers=headers)
+    assert response.status_code == 400
+    assert response.json == {"error": "currency must be a three letter code like EUR"}
+    operation = {'op': 'create', 'type': 'expense', 'trip_id': trip_id, 'data': {'amount': 1, 'currency': ['EUR']}}
+    assert client.post('/batch', json={'operations': [operation]}, headers=headers).status_code == 400
+    for amount in ('NaN', 'inf', '-Infinity', '1e309'):
+        response = client.post(f'/trips/add_expense/{trip_id}/Tokyo', json={'amount': amount}, headers=headers)
+        assert (response.status_code, response.json) == (400, {"error": "amount must be a number"})
+    operation = {'op': 'create', 'type': 'expense', 'trip_id': trip_id, 'data': {'amount': 'NaN'}}
+    assert client.post('/batch', json={'operations': [operation]}, headers=headers).status_code == 400
+
+    rates = tmp_path / 'rates.csv'
+    rates.write_text('currency,rate\nJPY,0.006\nUSD,0.9\n')
+    assert 'Loaded 2 rates as version 2' in runner.invoke(args=['load-rates', str(rates)]).output
+
+    response = client.post(f'/trips/add_expense/{trip_id}/Tokyo', json={'amount': 10000, 'currency': 'jpy'}, headers=headers)
+    assert response.status_code == 201
+    assert response.json['expense']['currency'] == 'JPY'
+    assert response.json['expense']['base_amount'] == 60.0
+    expense_id = response.json['expense']['expense_id']
+    client.post(f'/trips/add_expense/{trip_id}/Tokyo', json={'amount': 40}, headers=headers)
+
+    trip = client.get(f'/trip/{trip_id}/Tokyo', headers=headers).json['trip']
+    assert (trip['expense_total'], trip['remaining_budget']) == (100.0, 900.0)
+
+    response = client.post(f'/trips/edit_expense/{trip_id}/{expense_id}/Tokyo', json={'amount': 'NaN'}, headers=headers)
+    assert (response.status_code, response.json) == (400, {"error": "amount must be a number"})
+    client.post(f'/trips/edit_expense/{trip_id}/{expense_id}/Tokyo', json={'amount': 100, 'currency': 'USD'}, headers=headers)
+    expense = client.get(f'/trips/expenses/{trip_id}/{expense_id}/Tokyo', headers=headers).json['expense']
+    assert (expense['currency'], expense['base_amount']) == ('USD', 90.0)
+    assert client.get('/trips/analytics', headers=headers).json['budget_vs_actual'][-1]['spent'] == 130.0
+
+    rates.write_text('currency,rate\nUSD,1.1\n')
+    runner.invoke(args=['load-rates', str(rates)])
+    assert 'Renormalized 3 expenses' in runner.invoke(args=['renormalize']).output
+    trip = client.get(f'/trip/{trip_id}/Tokyo', headers=headers).json['trip']
+    assert (trip['expense_total'], trip['expense_max']) == (150.0, 110.0)
+    assert 'Renormalized 0 expenses' in runner.invoke(args=['renormalize']).output
+
+    client.post(f'/trips/add_expense/{trip_id}/Tokyo', json={'amount': 105}, headers=headers)
+    client.post(f'/trips/add_expense/{trip_id}/Tokyo', json={'amount': 95, 'currency': 'USD'}, headers=headers)
+    expenses = collect_pages(client, f'/trips/expenses/{trip_id}/Tokyo', 'expenses')
+    assert [expense['base_amount'] for expense in expenses] == [110.0, 105.0, 104.5, 40.0]
+
+def test_metrics(client, auth):
+    auth.login()
+    client.get('/trips/', headers={'Accept': 'application/json'})
+    client.get('/trips/', headers={'Accept': 'application/json'})
+    client.get('/trip/999/Nowhere', headers={'Accept': 'application/json'})
+    client.post('/add_trip', json={"destination": "Rome", "date": "2024-05-01", "description": "Food", "budget": 500}, headers={'Accept': 'application/json'})
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain; version=0.0.4')
+    text = response.get_data(as_text=True)
+
+    assert 'tripstracking_request_duration_seconds_count{endpoint="views.get_all_trips",method="GET"} 2' in text
+    assert 'tripstracking_request_duration_seconds_bucket{endpoint="views.get_all_trips",method="GET",le="+Inf"} 2' in text
+    assert 'tripstracking_requests_total{endpoint="views.get_trip",method="GET",status="404"} 1' in text
+    assert 'tripstracking_request_sql_statements_count{endpoint="views.get_all_trips"} 2' in text
+    assert 'tripstracking_request_sql_statements_bucket{endpoint="views.get_all_trips",le="0"} 0' in text
+    assert 'tripstracking_request_body_bytes_total{endpoint="views.post_trip"}' in text
+    assert 'tripstracking_db_pool_connections_opened_total ' in text
+    assert 'endpoint="metrics"' not in text
+
+def test_batch(client, auth, app):
+    auth.login()
+    headers = {'Accept': 'application/json'}
+    operations = [
+        {"op": "create", "type": "trip", "temp_id": "t1", "data": {"destination": "Oslo", "date": "2024-06-01", "description": "Fjords", "budget": 1000}},
+        {"op": "create", "type": "expense", "temp_id": "e1", "trip_id": "t1", "data": {"amount": 100, "expense_description": "Ferry"}},
+        {"op": "create", "type": "expense", "trip_id": "t1", "data": {"amount": 50}},
+        {"op": "update", "type": "expense", "id": "e1", "data": {"amount": 120}},
+        {"op": "update", "type": "trip", "id": "t1", "data": {"budget": 5000}},
+        {"op": "create", "type": "expense", "temp_id": "e3", "trip_id": "t1", "data": {"amount": 30}},
+        {"op": "delete", "type": "expense", "id": "e3"},
+    ]
+    response = client.post('/batch', json={"operations": operations}, headers=headers)
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert [result['status'] for result in results] == [201, 201, 201, 200, 200, 201, 200]
+    trip_id = results[0]['id']
+    assert results[1]['temp_id'] == 'e1' and results[1]['expense']['trip_id'] == trip_id
+    assert results[3]['id'] == results[1]['id']
+    assert results[3]['expense']['expense_description'] == 'Ferry'
+    assert results[3]['expense']['base_amount'] == 120
+    assert results[4]['trip']['destination'] == 'Oslo'
+
+    with app.app_context():
+        db_conn = db.open_db()
+        stats = db_conn.execute('SELECT expense_count, expense_total FROM trip_stats WHERE trip_id = ?', (trip_id,)).fetchone()
+        assert tuple(stats) == (2, 170)
+        assert db_conn.execute('SELECT budget FROM trip WHERE trip_id = ?', (trip_id,)).fetchone()[0] == 5000
+        assert db_conn.execute('SELECT COUNT(*) FROM expense WHERE expense_id = ?', (results[5]['id'],)).fetchone()[0] == 0
+        trips = db_conn.execute('SELECT COUNT(*) FROM trip').fetchone()[0]
+
+    failing = [
+        {"op": "create", "type": "trip", "temp_id": "t2", "data": {"destination": "Bergen", "description": "Rain"}},
+        {"op": "create", "type": "expense", "trip_id": "t2", "data": {"amount": 10, "currency": "XYZ"}},
+    ]
+    response = client.post('/batch', json={"operations": failing}, headers=headers)
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'Operation 1 failed: Unknown currency XYZ'
+
+    response = client.post('/batch', json={"operations": [{"op": "delete", "type": "trip", "id": 1}]}, headers=headers)
+    assert response.status_code == 404
+    response = client.post('/batch', json={"operations": [{"op": "create", "type": "expense", "trip_id": "nope", "data": {"amount": 1}}]}, headers=headers)
+    assert response.status_code == 400
+    assert client.post('/batch', json={"operations": []}, headers=headers).status_code == 400
+
+    with app.app_context():
+        assert db.open_db().execute('SELECT COUNT(*) FROM trip').fetchone()[0] == trips
+
+def test_compression(client, auth, app, tmp_path):
+    with app.app_context():
+        connection = db.open_db()
+        connection.executemany(
+            "INSERT INTO trip (destination, date, description, budget, user_id) VALUES ('Rome', '2024-05-01', 'A week in Rome', 100, 1)", [()] * 40
+        )
+        connection.commit()
+    auth.login()
+    headers = {"Accept": "application/json", "Accept-Encoding": "gzip, deflate"}
+
+    plain = client.get("/trips/", headers={"Accept": "application/json"})
+    assert "Content-Encoding" not in plain.headers
+    response = client.get("/trips/", headers=headers)
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert response.headers["ETag"] == f"W/{plain.headers['ETag']}"
+    assert json.loads(gzip.decompress(response.data)) == plain.json
+    response = client.get("/trips/", headers={**headers, "If-None-Match": response.headers["ETag"]})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == f"W/{plain.headers['ETag']}"
+    assert client.get("/trips/", headers={**headers, "If-None-Match": plain.headers["ETag"]}).headers["ETag"] == plain.headers["ETag"]
+
+    response = client.get("/trips/", headers={**headers, "Accept-Encoding": "gzip;q=0.5, deflate"})
+    assert response.headers["Content-Encoding"] == "deflate"
+    assert json.loads(zlib.decompress(response.data)) == plain.json
+    assert "Content-Encoding" not in client.get("/trips/", headers={**headers, "Accept-Encoding": "gzip;q=0, br"}).headers
+
+    app.config['COMPRESS_MIN_SIZE'] = len(plain.data) + 1
+    assert "Content-Encoding" not in client.get("/trips/", headers=headers).headers
+    app.config['COMPRESS_MIN_SIZE'] = 1024
+
+    response = client.get("/export?format=ndjson", headers=headers)
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert len(gzip.decompress(response.data).decode().splitlines()) == 40
+    response = client.get("/export?format=csv&gzip=1", headers=headers)
+    assert "Content-Encoding" not in response.headers
+    assert gzip.decompress(response.data).startswith(b"record_type")
+
+    app.config['UPLOAD_FOLDER'] = str(tmp_path)
+    image = io.BytesIO()
+    Image.new('RGB', (100, 60), 'red').save(image, 'PNG')
+    response = client.post("/trips/add_photos", data={"photos": (io.BytesIO(image.getvalue()), "red.png")}, headers={"Accept": "application/json"})
+    response = client.get(f"/trips/photos/{response.json['photo_ids'][0]}/file", headers=headers)
+    assert "Content-Encoding" not in response.headers
+    assert response.data == image.getvalue()
+
+def test_assets(client, app, runner, tmp_path):
+    app.config['ASSETS_FOLDER'] = str(tmp_path)
+    response = client.get("/")
+    assert b'href="/static/css/bootstrap.min.css"' in response.data
+
+    result = runner.invoke(args=['assets', 'build'])
+    assert 'Built 2 assets' in result.output
+    manifest = json.loads((tmp_path / "manifest.json").read_text())
+    assert sorted(manifest) == ["css/bootstrap.min.css", "js/html.js"]
+    css = manifest["css/bootstrap.min.css"]
+    original = Path(app.static_folder, "css", "bootstrap.min.css").read_bytes()
+    assert (tmp_path / css).read_bytes() == original
+    assert gzip.decompress((tmp_path / f"{css}.gz").read_bytes()) == original
+
+    response = client.get("/")
+    assert f'href="/static/{css}"'.encode() in response.data
+
+    response = client.get(f"/static/{css}", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.mimetype == "text/css"
+    assert "immutable" in response.headers["Cache-Control"]
+    assert "max-age=31536000" in response.headers["Cache-Control"]
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert gzip.decompress(response.data) == original
+    response.close()
+
+    response = client.get(f"/static/{css}")
+    assert "Content-Encoding" not in response.headers
+    assert response.data == original
+    response.close()
+
+    response = client.get("/static/css/bootstrap.min.css")
+    assert response.status_code == 200
+    assert "immutable" not in response.headers.get("Cache-Control", "")
+    response.close()
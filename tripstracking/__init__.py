@@ -1,22 +1,90 @@
 from flask import Flask
 
-def create_app():
+def create_app(async_views=False):
+    '''Creates the app. With async_views=True the trips, expenses, photo upload, login and register handlers are replaced by the async handlers of aioviews and aioauth, which query SQLite through aiosqlite. Serve that build through an ASGI server, see asgi.py.'''
     app = Flask(__name__)
     
     app.config.from_mapping(
         SECRET_KEY = 'dev',
         DATABASE = 'trips.db',
-        UPLOAD_FOLDER = 'upload_folder'
+        UPLOAD_FOLDER = 'upload_folder',
+        DB_POOL_SIZE = 8,
+        DB_POOL_TIMEOUT = 5.0,
+        DB_BUSY_TIMEOUT = 5.0,
+        DB_MMAP_SIZE = 256 * 1024 * 1024,
+        DB_CACHE_SIZE = -64000,
+        PAGE_SIZE = 50,
+        MAX_PAGE_SIZE = 500,
+        USER_CACHE_SIZE = 1024,
+        USER_CACHE_TTL = 60,
+        IMPORT_CHUNK_SIZE = 5000,
+        IMPORT_MAX_ERRORS = 1000,
+        BATCH_MAX_OPERATIONS = 500,
+        EXPORT_CHUNK_SIZE = 64 * 1024,
+        EXPORT_GZIP_LEVEL = 6,
+        COMPRESS_LEVEL = 6,
+        COMPRESS_MIN_SIZE = 1024,
+        ASSETS_FOLDER = 'static_build',
+        ASSETS_GZIP_LEVEL = 9,
+        PHOTO_CHUNK_SIZE = 256 * 1024,
+        THUMBNAIL_SIZES = (320, 800, 1600),
+        THUMBNAIL_QUALITY = 85,
+        THUMBNAIL_WORKERS = 2,
+        THUMBNAIL_QUEUE = 64,
+        GALLERY_WIDTH = 320,
+        PHOTO_WIDTH = 800,
+        PASSWORD_METHOD = 'scrypt',
+        PASSWORD_HASH_WORKERS = 2,
+        PASSWORD_HASH_QUEUE = 16,
+        PASSWORD_HASH_TIMEOUT = 10.0,
+        BASE_CURRENCY = 'EUR',
+        EXCHANGE_RATES_TTL = 300,
+        SQL_SLOW_QUERY_THRESHOLD = None,
+        SQL_SLOW_QUERY_LOG = 'slow_queries.jsonl'
         )
 
     with app.app_context():
         from .views import views
         from .auth import users
-        from .db import init_db_command, close_db
+        from .db import init_db_command, migrate_command, rebuild_stats_command, close_db, init_pool
+        from .cache import init_user_cache
+        from .photos import gc_photos_command
+        from .thumbnails import init_thumbnail_pool, thumbnails_command
+        from .passwords import init_password_hasher
+        from .search import rebuild_search_command
+        from .currency import init_exchange_rates, load_rates_command, renormalize_command
+        from .seed import seed_db_command
+        from .metrics import init_metrics
+        from .sqltrace import init_slow_query_log, sql_report_command
+        from .compression import init_compression
+        from .assets import init_assets, assets_command
 
+        init_pool(app)
+        init_user_cache(app)
+        init_thumbnail_pool(app)
+        init_password_hasher(app)
+        init_exchange_rates(app)
+        init_metrics(app)
+        init_slow_query_log(app)
+        init_assets(app)
+        init_compression(app)
         app.register_blueprint(views)
         app.register_blueprint(users)
         app.teardown_appcontext(close_db)
         app.cli.add_command(init_db_command)
+        app.cli.add_command(seed_db_command)
+        app.cli.add_command(migrate_command)
+        app.cli.add_command(rebuild_stats_command)
+        app.cli.add_command(gc_photos_command)
+        app.cli.add_command(thumbnails_command)
+        app.cli.add_command(rebuild_search_command)
+        app.cli.add_command(load_rates_command)
+        app.cli.add_command(renormalize_command)
+        app.cli.add_command(sql_report_command)
+        app.cli.add_command(assets_command)
+
+        if async_views:
+            from .aioviews import install
+            install(app)
     return app
 
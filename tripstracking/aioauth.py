@@ -0,0 +1,79 @@
+import sqlite3
+from flask import request, render_template
+from .aiodb import open_db_async, fetchone
+from .aioviews import replaces
+from .auth import hasher_busy, cached_user, remember_user, new_user, registered, login_fields, logged_in
+from .auth import USER_SELECT, USER_INSERT, USER_BY_NAME_SELECT, PASSWORD_UPDATE
+from .cache import get_user_cache
+from .passwords import get_password_hasher, HasherBusy
+from .responses import request_data, error_response
+from .static import forms
+
+async def user_info():
+    '''The async counterpart of auth.user_info, installed in its place by the async build. A user missing from the cache is loaded through the async pool.'''
+    user_id, user = cached_user()
+    if user_id is not None and user is None:
+        user = await fetchone(await open_db_async(), USER_SELECT, (user_id,))
+    remember_user(user_id, user)
+
+@replaces('users.register_user')
+async def register_user():
+    form = forms.RegisterForm(request.form)
+    if request.method == 'POST' and form.validate():
+        json_response = "application/json" in request.headers.get("accept", "")
+
+        try:
+            username, password, fullname, email = new_user(request_data(json_response))
+        except ValueError as e:
+            return error_response(json_response, str(e), 400, 'users.register_user')
+
+        try:
+            pwhash = await get_password_hasher().hash_async(password)
+        except HasherBusy:
+            return hasher_busy(json_response, 'register_user.html', form)
+
+        db = await open_db_async()
+        try:
+            await db.execute(USER_INSERT, (username, pwhash, fullname, email))
+            await db.commit()
+        except sqlite3.IntegrityError:
+            return error_response(json_response, "Registration failed", 400, 'users.register_user')
+        return registered(json_response)
+    return render_template('register_user.html', form=form)
+
+@replaces('users.login_user')
+async def login_user():
+    form = forms.LoginForm(request.form)
+    if request.method == 'POST':
+        json_response = "application/json" in request.headers.get("accept", "")
+
+        try:
+            username, password = login_fields(request_data(json_response))
+        except ValueError as e:
+            return error_response(json_response, str(e), 400, 'users.login_user')
+
+        db = await open_db_async()
+        user = await fetchone(db, USER_BY_NAME_SELECT, (username,))
+
+        if user is None:
+            return error_response(json_response, "Invalid username", 401, 'users.login_user')
+
+        hasher = get_password_hasher()
+        try:
+            valid = await hasher.check_async(user['password'], password)
+        except HasherBusy:
+            return hasher_busy(json_response, 'login.html', form)
+
+        if not valid:
+            error = 'Invalid password'
+            return error_response(json_response, error, 401, 'users.login_user', error=error)
+
+        if hasher.needs_rehash(user['password']):
+            try:
+                await db.execute(PASSWORD_UPDATE, (await hasher.hash_async(password), user['user_id']))
+                await db.commit()
+                get_user_cache().invalidate(user['user_id'])
+            except HasherBusy:
+                pass
+        return logged_in(json_response, user)
+    return render_template('login.html', form=form)
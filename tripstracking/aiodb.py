@@ -0,0 +1,114 @@
+import asyncio
+import functools
+import sqlite3
+import threading
+import aiosqlite
+from flask import current_app, g, request
+from .db import connection_pragmas
+from .metrics import InstrumentedConnection
+from .sqltrace import get_slow_query_log
+
+ITER_CHUNK_SIZE = 64
+'''Rows aiosqlite fetches at a time when a cursor is iterated, its default.'''
+
+class AsyncConnection(aiosqlite.Connection):
+    '''aiosqlite connection running an InstrumentedConnection, so the metrics and the slow query tracer see its SQL like that of the sync pool. The counters live on the sqlite3 connection and are read through here, the way aiosqlite reads in_transaction.'''
+    @property
+    def statements(self):
+        return self._conn.statements
+
+    @property
+    def sql_seconds(self):
+        return self._conn.sql_seconds
+
+    def instrument(self, tracer, endpoint):
+        '''Resets the counters for a new request and sets its slow query tracer. Statements run on the thread of the connection, outside the request context, so the endpoint the tracer logs is kept on the connection.'''
+        self._conn.reset_counters()
+        self._conn.tracer = tracer
+        self._conn.endpoint = endpoint
+
+class AsyncConnectionPool:
+    '''Keeps idle aiosqlite connections for the async views, configured with the same PRAGMAs as the connections of db.ConnectionPool. Every aiosqlite connection runs its queries in a thread of its own and resolves them on whatever event loop awaits them, so a connection can be reused by the requests that follow even though Flask runs every async view in a new event loop. At most DB_POOL_SIZE connections are kept idle; beyond that a request opens a connection of its own, which is closed when it is returned.
+    '''
+    def __init__(self, app):
+        self.app = app
+        self._lock = threading.Lock()
+        self._idle = []
+        self._database = None
+
+    async def _connect(self, database):
+        db = await AsyncConnection(
+            functools.partial(sqlite3.connect, database, detect_types=sqlite3.PARSE_DECLTYPES, factory=InstrumentedConnection),
+            ITER_CHUNK_SIZE
+        )
+        db.row_factory = sqlite3.Row
+        for pragma in connection_pragmas(self.app.config):
+            await db.execute(pragma)
+        return db
+
+    async def checkout(self):
+        database = self.app.config['DATABASE']
+        stale = []
+        with self._lock:
+            if database != self._database:
+                stale, self._idle, self._database = self._idle, [], database
+            db = self._idle.pop() if self._idle else None
+        for connection in stale:
+            await connection.close()
+        if db is None:
+            db = await self._connect(database)
+        return db
+
+    async def checkin(self, db):
+        '''Returns a connection to the pool, rolling back any transaction the request left open.'''
+        try:
+            if db.in_transaction:
+                await db.rollback()
+        except sqlite3.Error:
+            await db.close()
+            return
+        with self._lock:
+            if self._database == self.app.config['DATABASE'] and len(self._idle) < self.app.config['DB_POOL_SIZE']:
+                self._idle.append(db)
+                return
+        await db.close()
+
+    def close(self):
+        '''Closes every idle connection and stops its thread. Called from sync code, e.g. when a test removes its database file.'''
+        with self._lock:
+            idle, self._idle, self._database = self._idle, [], None
+
+        async def close_all():
+            for db in idle:
+                await db.close()
+        if idle:
+            asyncio.run(close_all())
+
+def init_async_pool(app):
+    '''Creates the async connection pool of the app. Called by create_app for the async build.'''
+    app.extensions['aiodb_pool'] = AsyncConnectionPool(app)
+    return app.extensions['aiodb_pool']
+
+async def open_db_async():
+    '''The async counterpart of db.open_db. Returns the aiosqlite connection stored in g, checking one out of the async pool for the first query of the request. Like open_db, its statement counters start from zero and it traces slow statements when SQL_SLOW_QUERY_THRESHOLD is set.'''
+    if 'aiodb' not in g:
+        try:
+            g.aiodb = await current_app.extensions['aiodb_pool'].checkout()
+        except Exception as e:
+            current_app.logger.error(f"Database connection failed: {str(e)}")
+            raise RuntimeError("Failed to connect to the database")
+        g.aiodb.instrument(get_slow_query_log(), request.endpoint)
+    return g.aiodb
+
+async def close_db_async(e=None):
+    db = g.pop('aiodb', None)
+
+    if db is not None:
+        await current_app.extensions['aiodb_pool'].checkin(db)
+
+async def fetchone(db, sql, parameters=()):
+    cursor = await db.execute(sql, parameters)
+    try:
+        return await cursor.fetchone()
+    finally:
+        await cursor.close()
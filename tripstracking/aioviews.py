@@ -0,0 +1,217 @@
+import asyncio
+import sqlite3
+from urllib.parse import unquote, quote
+from flask import request, session, current_app, render_template
+from .aiodb import open_db_async, close_db_async, init_async_pool, fetchone
+from .static import forms
+from .thumbnails import get_thumbnail_pool
+from .responses import request_data, error_response
+from . import pagination, conditional, photos, views
+
+ASYNC_ENDPOINTS = {}
+'''Maps the endpoints of the views and users blueprints to their async handlers. The async build keeps the URL rules of the sync blueprints and only swaps these view functions, so both builds answer on the same URLs with the same responses. Endpoints without an async handler, like analytics, import and export, keep running their sync handler.'''
+
+def replaces(endpoint):
+    '''Registers the decorated coroutine as the async handler of endpoint.'''
+    def decorator(view):
+        ASYNC_ENDPOINTS[endpoint] = view
+        return view
+    return decorator
+
+def install(app):
+    '''Turns an app into the async build: opens an async connection pool next to the sync one, swaps the view functions of ASYNC_ENDPOINTS and loads the logged in user through the async pool. Called by create_app(async_views=True).'''
+    from . import aioauth, auth
+
+    init_async_pool(app)
+    app.teardown_appcontext(close_db_async)
+    for endpoint, view in ASYNC_ENDPOINTS.items():
+        app.view_functions[endpoint] = view
+    loaders = app.before_request_funcs[None]
+    loaders[loaders.index(auth.user_info)] = aioauth.user_info
+
+async def trips_page(db, user_id, limit, after):
+    '''The async counterpart of views.trips_page, running the same keyset queries.'''
+    query = views.dated_trips_query(user_id, limit, after)
+    trips = list(await db.execute_fetchall(*query)) if query else []
+    query = views.undated_trips_query(user_id, limit, after, len(trips))
+    if query:
+        trips.extend(await db.execute_fetchall(*query))
+    return trips
+
+@replaces('views.get_all_trips')
+@views.crud_trips
+async def get_all_trips():
+    db = await open_db_async()
+    json_response = "application/json" in request.headers.get("accept", "")
+    user_id = session.get('user_id')
+
+    try:
+        limit, after = pagination.page_args()
+    except ValueError as e:
+        return error_response(json_response, str(e), 400, 'views.get_all_trips')
+
+    validators = None
+    if json_response:
+        validators = conditional.validators('trips', user_id, await fetchone(db, views.USER_VERSION_SELECT, (user_id,)))
+        if conditional.is_not_modified(*validators):
+            return conditional.not_modified(*validators)
+
+    return views.trips_response(json_response, await trips_page(db, user_id, limit, after), limit, after, validators)
+
+@replaces('views.get_trip')
+@views.crud_trips
+async def get_trip(trip_id, destination):
+    db = await open_db_async()
+    json_response = "application/json" in request.headers.get("accept", "")
+
+    destination = unquote(destination)
+
+    trip = await fetchone(db, views.TRIP_SELECT + ' WHERE trip.trip_id = ? AND trip.destination = ?', (trip_id, destination))
+    return views.trip_response(json_response, trip, trip_id, destination)
+
+@replaces('views.post_trip')
+@views.crud_trips
+async def post_trip():
+    form = forms.AddTripForm(request.form)
+    if request.method == 'POST':
+        db = await open_db_async()
+        json_response = "application/json" in request.headers.get("accept", "")
+
+        try:
+            trip = views.new_trip(request_data(json_response))
+        except ValueError as e:
+            return error_response(json_response, str(e), 400, 'views.post_trip')
+
+        try:
+            trip_id = (await db.execute(views.TRIP_INSERT, views.trip_parameters(trip, session.get('user_id')))).lastrowid
+            await db.commit()
+        except Exception as e:
+            return error_response(json_response, f"Failed to create trip: {str(e)}", 500, 'views.post_trip')
+        return views.trip_created(json_response, trip_id, trip)
+    return render_template('trips/post_trip.html', form=form)
+
+@replaces('views.get_all_expenses')
+@views.crud_trips
+async def get_all_expenses(trip_id, destination):
+    db = await open_db_async()
+    json_response = "application/json" in request.headers.get("accept", "")
+    user_id = session.get('user_id')
+
+    trip = await fetchone(db, views.TRIP_VERSION_SELECT, (trip_id, user_id))
+
+    if not trip:
+        return views.trip_not_found(json_response, trip_id, user_id)
+
+    try:
+        limit, after = pagination.page_args()
+    except ValueError as e:
+        return error_response(json_response, str(e), 400, 'views.get_all_expenses', trip_id=trip_id, destination=quote(trip["destination"]))
+
+    validators = None
+    if json_response:
+        validators = conditional.validators('expenses', trip_id, trip)
+        if conditional.is_not_modified(*validators):
+            return conditional.not_modified(*validators)
+
+    expenses = list(await db.execute_fetchall(*views.expenses_page_query(trip_id, limit, after)))
+    return views.expenses_response(json_response, trip_id, trip, expenses, limit, after, validators)
+
+@replaces('views.get_expense')
+@views.crud_trips
+async def get_expense(expense_id, trip_id, destination):
+    db = await open_db_async()
+    json_response = "application/json" in request.headers.get("accept", "")
+    user_id = session.get('user_id')
+
+    trip = await fetchone(db, views.TRIP_VERSION_SELECT, (trip_id, user_id))
+
+    if not trip:
+        return views.trip_not_found(json_response, trip_id, user_id)
+
+    expense = await fetchone(db, views.EXPENSE_SELECT, (expense_id, trip_id))
+    return views.expense_response(json_response, trip_id, trip, expense_id, expense)
+
+@replaces('views.post_expense')
+@views.crud_trips
+async def post_expense(trip_id, destination):
+    form = forms.AddExpenseForm(request.form)
+    db = await open_db_async()
+    json_response = "application/json" in request.headers.get("accept", "")
+    user_id = session.get('user_id')
+    destination = unquote(destination)
+
+    trip = await fetchone(db, views.TRIP_DESTINATION_SELECT, (trip_id, user_id))
+
+    if not trip:
+        return views.trip_not_found(json_response, trip_id, user_id)
+
+    if request.method == 'POST':
+        try:
+            expense = views.new_expense(request_data(json_response))
+        except ValueError as e:
+            return error_response(json_response, str(e), 400, 'views.post_expense', trip_id=trip_id, destination=quote(trip['destination']))
+
+        try:
+            expense_id = (await db.execute(views.EXPENSE_INSERT, views.expense_parameters(expense, trip_id))).lastrowid
+            await db.commit()
+        except Exception as e:
+            return error_response(json_response, f"Failed to create expense: {str(e)}", 500, 'views.post_expense', trip_id=trip_id, destination=quote(destination))
+        return views.expense_created(json_response, trip_id, destination, expense_id, expense)
+    return render_template('expenses/post_expense.html', trip_id=trip_id, destination=trip['destination'], form=form)
+
+async def save_photo(db, file, extension, trip_id, user_id, upload_folder, chunk_size):
+    '''The async counterpart of photos.save_photo, running the same statements. Copying and hashing the upload and moving the file into place run in worker threads, so the event loop is never blocked on disk writes.'''
+    blob_hash, temporary, size = await asyncio.to_thread(photos.write_temporary, file.stream, upload_folder, chunk_size)
+
+    try:
+        await db.execute('BEGIN IMMEDIATE')
+        blob = await fetchone(db, photos.BLOB_SELECT, (blob_hash,))
+
+        new_blob = blob is None
+        if new_blob:
+            file_path = photos.blob_path(blob_hash, extension)
+            await asyncio.to_thread(photos.move_into_place, temporary, upload_folder, file_path)
+            await db.execute(photos.BLOB_INSERT, (blob_hash, file_path, size))
+        else:
+            file_path = blob['file_path']
+
+        photo = await db.execute(photos.PHOTO_INSERT, (trip_id, user_id, file_path, blob_hash))
+        await db.commit()
+    except (sqlite3.Error, OSError):
+        if db.in_transaction:
+            await db.rollback()
+        raise
+    finally:
+        await asyncio.to_thread(photos.remove_file, temporary)
+    return photo.lastrowid, blob_hash, file_path, new_blob
+
+@replaces('views.post_photo')
+@views.crud_trips
+async def post_photo():
+    if request.method == 'POST':
+        json_response = "application/json" in request.headers.get("accept", "")
+        user_id = session.get('user_id')
+        trip_id = request.form.get('trip_id', type=int)
+        db = await open_db_async()
+
+        if trip_id is not None and not await fetchone(db, views.PHOTO_TRIP_SELECT, (trip_id, user_id)):
+            return views.trip_not_found(json_response, trip_id, user_id, 'views.post_photo')
+
+        files = views.uploaded_photos()
+        if not files:
+            return error_response(json_response, "Invalid file type or no file found", 400, 'views.post_photo')
+
+        photo_ids = []
+        try:
+            for file, extension in files:
+                photo_id, blob_hash, file_path, new_blob = await save_photo(
+                    db, file, extension, trip_id, user_id,
+                    current_app.config['UPLOAD_FOLDER'], current_app.config['PHOTO_CHUNK_SIZE']
+                )
+                photo_ids.append(photo_id)
+                if new_blob:
+                    await asyncio.to_thread(get_thumbnail_pool().submit, blob_hash, file_path)
+        except Exception as e:
+            return views.upload_failed(json_response, str(e), photo_ids)
+        return views.photos_uploaded(json_response, photo_ids)
+    return render_template('photos/post_photo.html')
@@ -0,0 +1,162 @@
+import numpy as np
+
+PERCENTILES = (50, 75, 90, 95, 99)
+
+MONTH = (
+    "CASE "
+    "WHEN expense.expense_date LIKE '____-__-__%' THEN substr(expense.expense_date, 1, 4) * 100 + substr(expense.expense_date, 6, 2) "
+    "WHEN expense.expense_date LIKE '__.__.____' THEN substr(expense.expense_date, 7, 4) * 100 + substr(expense.expense_date, 4, 2) "
+    "ELSE 0 END"
+)
+'''Converts the expense dates, which are stored either as YYYY-MM-DD or DD.MM.YYYY, to a YYYYMM integer in SQL. Expenses without a readable date get month 0.'''
+
+AMOUNT_DIGITS = 16
+AMOUNT_OFFSET = 6 * 10 ** 15
+AMOUNT_LIMITS = (-4 * 10 ** 9, 3 * 10 ** 9)
+'''The expense amounts are read as millionths of the base currency plus AMOUNT_OFFSET, a number of exactly AMOUNT_DIGITS digits for every amount between -5 and 4 billion. Amounts outside the narrower AMOUNT_LIMITS, and missing ones, are sent as a - instead, which makes parse_amounts fall back to reading them row by row. The offset also does the rounding: adding it to the REAL millionths rounds them to an integer, exactly between -1.5 and 3 billion, so the CAST to INTEGER is exact without a call to round(). SQLite formats integers much faster than REALs, and fixed width numbers are parsed by NumPy without splitting the text.'''
+
+DATE_PATTERNS = (
+    (b'dddd-dd-dd,', (0, 1, 2, 3), (5, 6)),
+    (b'dd.dd.dddd,', (6, 7, 8, 9), (3, 4)),
+)
+'''The two date formats of the expenses as fixed width records of group_concat, with the positions of the digits of their year and month. d stands for a digit.'''
+
+def _number_of(digits, positions):
+    '''Returns the integers spelled by the digit columns at positions of a 2D array of digit values, one per row.'''
+    number = np.zeros(len(digits), dtype=np.int64)
+    for position in positions:
+        number *= 10
+        number += digits[:, position]
+    return number
+
+def parse_amounts(text, count):
+    '''Returns the amounts of the group_concat of AMOUNT_DIGITS wide numbers, or None if some amount did not fit.'''
+    if len(text) != count * AMOUNT_DIGITS or not text.isascii():
+        return None
+    digits = np.frombuffer(text.encode('ascii'), dtype=np.uint8).reshape(count, AMOUNT_DIGITS) - ord('0')
+    if (digits > 9).any():
+        return None
+    return (_number_of(digits, range(AMOUNT_DIGITS)) - AMOUNT_OFFSET) / 1e6
+
+def parse_months(text, count):
+    '''Returns the YYYYMM months of the comma separated dates, with 0 for the 0000-00-00 of a missing date, or None if some date is not in one of the DATE_PATTERNS.'''
+    text = text + ','
+    if len(text) != count * 11 or not text.isascii():
+        return None
+    records = np.frombuffer(text.encode('ascii'), dtype=np.uint8).reshape(count, 11)
+    digits = records - ord('0')
+    months = None
+    unmatched = np.ones(count, dtype=bool)
+    for pattern, year, month in DATE_PATTERNS:
+        match = unmatched.copy()
+        for position, character in enumerate(pattern):
+            match &= digits[:, position] < 10 if character == ord('d') else records[:, position] == character
+        if not match.any():
+            continue
+        values = _number_of(digits, year) * 100 + _number_of(digits, month)
+        months = values if months is None else np.where(match, values, months)
+        unmatched &= ~match
+        if not unmatched.any():
+            return months
+    return None
+
+def load_columns(db, user_id):
+    '''Loads the amount in the base currency and the month of every expense of the user with one query and returns them as NumPy arrays. SQLite joins each column into a single string with group_concat: the amounts as fixed width integers and the dates as they are stored, which np.frombuffer turns into arrays without building a Python object per expense. Formatting the values is most of the cost of the query, so the months are parsed by NumPy instead of SQLite. When an amount or date does not have the expected shape, the columns are read again row by row with np.fromiter and the MONTH expression.'''
+    count, amounts, dates = db.execute(
+        f"SELECT COUNT(*), group_concat(CASE WHEN expense.base_amount BETWEEN {AMOUNT_LIMITS[0]} AND {AMOUNT_LIMITS[1]} "
+        f"THEN CAST(expense.base_amount * 1000000 + {AMOUNT_OFFSET} AS INTEGER) ELSE '-' END, ''), "
+        "group_concat(COALESCE(expense.expense_date, '0000-00-00'), ',') "
+        'FROM trip JOIN expense ON expense.trip_id = trip.trip_id WHERE trip.user_id = ?', (user_id,)
+    ).fetchone()
+
+    if not count:
+        return np.empty(0, dtype=np.float64), np.empty(0, dtype=np.int64)
+    amounts = parse_amounts(amounts or '', count)
+    months = parse_months(dates, count)
+    if amounts is not None and months is not None:
+        return amounts, months
+
+    cursor = db.cursor()
+    cursor.row_factory = None
+    columns = np.fromiter(cursor.execute(
+        f'SELECT CAST(COALESCE(expense.base_amount, 0) AS REAL), {MONTH} '
+        'FROM trip JOIN expense ON expense.trip_id = trip.trip_id WHERE trip.user_id = ?', (user_id,)
+    ), dtype=[('amount', np.float64), ('month', np.int64)])
+    return columns['amount'], columns['month']
+
+def load_trips(db, user_id):
+    '''Loads the trips of the user with their expense count and total from trip_stats, which the triggers keep up to date, so the budget versus actual needs no pass over the expenses.'''
+    cursor = db.cursor()
+    cursor.row_factory = None
+    rows = cursor.execute(
+        'SELECT trip.trip_id, trip.destination, CAST(trip.budget AS REAL), COALESCE(trip_stats.expense_count, 0), COALESCE(trip_stats.expense_total, 0) '
+        'FROM trip LEFT JOIN trip_stats ON trip_stats.trip_id = trip.trip_id WHERE trip.user_id = ? ORDER BY trip.trip_id', (user_id,)
+    ).fetchall()
+
+    if not rows:
+        return (
+            np.empty(0, dtype=np.int64), np.empty(0, dtype=object), np.empty(0, dtype=np.float64),
+            np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        )
+    trip_ids, destinations, budgets, counts, spent = zip(*rows)
+    return (
+        np.array(trip_ids, dtype=np.int64),
+        np.array(destinations, dtype=object),
+        np.array([np.nan if budget is None else budget for budget in budgets], dtype=np.float64),
+        np.array(counts, dtype=np.int64),
+        np.array(spent, dtype=np.float64)
+    )
+
+def _number(value):
+    '''Converts a NumPy scalar to a JSON friendly Python number, with None for NaN.'''
+    value = float(value)
+    if np.isnan(value):
+        return None
+    return round(value, 2)
+
+def spending_summary(db, user_id):
+    '''Returns the spend of the user by month, by destination, budget versus actual per trip, and percentiles of the expense amounts. The months and percentiles are computed with np.bincount and np.percentile over the columns returned by load_columns, instead of looping over the rows in Python; the totals per trip and destination come from trip_stats.'''
+    amounts, months = load_columns(db, user_id)
+    trip_ids, destinations, budgets, counts, spent = load_trips(db, user_id)
+
+    # YYYYMM as year * 13 + month is a small dense index, so bincount groups the months without sorting them like np.unique would.
+    month_index = months // 100 * 13 + months % 100
+    month_totals = np.bincount(month_index, weights=amounts)
+    month_counts = np.bincount(month_index)
+    month_index = np.flatnonzero(month_counts)
+    month_keys = month_index // 13 * 100 + month_index % 13
+    month_totals, month_counts = month_totals[month_index], month_counts[month_index]
+
+    destination_keys, destination_index = np.unique(destinations.astype(str), return_inverse=True)
+    destination_totals = np.bincount(destination_index, weights=spent, minlength=len(destination_keys))
+    destination_trips = np.bincount(destination_index, minlength=len(destination_keys))
+
+    remaining = budgets - spent
+    with np.errstate(divide='ignore', invalid='ignore'):
+        used = np.where(budgets > 0, spent / budgets, np.nan)
+
+    if len(amounts):
+        percentiles = np.percentile(amounts, PERCENTILES)
+    else:
+        percentiles = np.full(len(PERCENTILES), np.nan)
+
+    return {
+        "expense_count": int(len(amounts)),
+        "total": _number(amounts.sum()),
+        "by_month": [
+            {"month": f"{month // 100:04d}-{month % 100:02d}" if month else None, "total": _number(total), "count": int(count)}
+            for month, total, count in zip(month_keys, month_totals, month_counts)
+        ],
+        "by_destination": [
+            {"destination": str(destination), "total": _number(total), "trips": int(count)}
+            for destination, total, count in zip(destination_keys, destination_totals, destination_trips)
+        ],
+        "budget_vs_actual": [
+            {"trip_id": int(trip_id), "destination": destination, "budget": _number(budget), "spent": _number(total),
+             "expense_count": int(count), "remaining": _number(left), "used": _number(ratio)}
+            for trip_id, destination, budget, total, count, left, ratio in zip(trip_ids, destinations, budgets, spent, counts, remaining, used)
+        ],
+        "amount_percentiles": {
+            f"p{percentile}": _number(value) for percentile, value in zip(PERCENTILES, percentiles)
+        }
+    }
@@ -0,0 +1,128 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+import threading
+import click
+from flask import current_app, request, send_from_directory, url_for
+from flask.cli import with_appcontext
+from .compression import COMPRESSIBLE_TYPES, negotiate
+
+MANIFEST = 'manifest.json'
+SKIPPED_SUFFIXES = ('.py', '.pyc', '.gz')
+'''Files of the static folder that are not assets: the forms module lives there too.'''
+
+ASSET_MAX_AGE = 365 * 24 * 3600
+'''Built assets are cached for a year and marked immutable. Their names contain the hash of their content, so a changed file gets a new URL instead of being revalidated.'''
+
+def hashed_name(filename, data):
+    root, ext = os.path.splitext(filename)
+    return f'{root}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+
+def build_assets(static_folder, output, level):
+    '''Copies every file of static_folder to output under a name with the hash of its content, writes a gzip compressed .gz sibling next to the text files it makes smaller, and writes the manifest that maps the original names to the hashed ones. output is emptied first. Returns the manifest.'''
+    shutil.rmtree(output, ignore_errors=True)
+    manifest = {}
+    for folder, folders, files in os.walk(static_folder):
+        folders[:] = sorted(name for name in folders if name != '__pycache__')
+        for name in sorted(files):
+            if name.endswith(SKIPPED_SUFFIXES):
+                continue
+            filename = os.path.relpath(os.path.join(folder, name), static_folder).replace(os.sep, '/')
+            with open(os.path.join(folder, name), 'rb') as f:
+                data = f.read()
+            built = manifest[filename] = hashed_name(filename, data)
+            path = os.path.join(output, built)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(data)
+
+            mimetype = mimetypes.guess_type(name)[0] or ''
+            if mimetype.startswith(COMPRESSIBLE_TYPES):
+                compressed = gzip.compress(data, level, mtime=0)
+                if len(compressed) < len(data):
+                    with open(path + '.gz', 'wb') as f:
+                        f.write(compressed)
+
+    with open(os.path.join(output, MANIFEST), 'w', encoding='utf8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+class Assets:
+    '''The manifest written by flask assets build, kept in memory. It is reloaded when ASSETS_FOLDER changes or the manifest file is rewritten, so a new build is picked up without a restart. Without a build the manifest is empty and the plain static files are used.
+    '''
+    def __init__(self, app):
+        self.app = app
+        self._lock = threading.Lock()
+        self._key = None
+        self.manifest = {}
+        self.built = frozenset()
+
+    def current(self):
+        '''Returns the manifest and the set of hashed names it maps to.'''
+        path = os.path.join(self.app.config['ASSETS_FOLDER'], MANIFEST)
+        try:
+            key = (path, os.stat(path).st_mtime_ns)
+        except FileNotFoundError:
+            key = (path, None)
+        with self._lock:
+            if key == self._key:
+                return self.manifest, self.built
+        manifest = {}
+        if key[1] is not None:
+            with open(path, encoding='utf8') as f:
+                manifest = json.load(f)
+        with self._lock:
+            self._key = key
+            self.manifest, self.built = manifest, frozenset(manifest.values())
+        return self.manifest, self.built
+
+def asset_url(filename):
+    '''Template helper returning the URL of a static file, which is its hashed name once the assets are built.'''
+    manifest, _ = get_assets().current()
+    return url_for('static', filename=manifest.get(filename, filename))
+
+def static_file(filename):
+    '''Replaces the static view of Flask. Hashed assets are served from ASSETS_FOLDER with immutable far future caching, as their precompressed .gz when the client accepts gzip. Any other file is left to send_static_file.'''
+    _, built = get_assets().current()
+    if filename not in built:
+        return current_app.send_static_file(filename)
+
+    folder = current_app.config['ASSETS_FOLDER']
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    gzipped = negotiate(request.headers.get('Accept-Encoding')) == 'gzip' and os.path.isfile(os.path.join(folder, filename + '.gz'))
+    response = send_from_directory(
+        os.path.abspath(folder), filename + '.gz' if gzipped else filename, mimetype=mimetype, max_age=ASSET_MAX_AGE
+    )
+    if gzipped:
+        response.content_encoding = 'gzip'
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+def init_assets(app):
+    '''Creates the asset manifest of the app, adds the asset_url template helper and serves built assets through the static endpoint. Called by create_app.'''
+    app.extensions['assets'] = Assets(app)
+    app.add_template_global(asset_url)
+    app.view_functions['static'] = static_file
+    return app.extensions['assets']
+
+def get_assets():
+    return current_app.extensions['assets']
+
+@click.group('assets')
+def assets_command():
+    '''Builds the static assets.'''
+
+@assets_command.command('build')
+@with_appcontext
+def build_assets_command():
+    '''Writes the static files under content hashed names, with gzip compressed copies, to ASSETS_FOLDER, together with the manifest asset_url reads. Run it on every deploy:
+
+    flask --app trips.py assets build
+    '''
+    manifest = build_assets(current_app.static_folder, current_app.config['ASSETS_FOLDER'], current_app.config['ASSETS_GZIP_LEVEL'])
+    click.echo(f"Built {len(manifest)} assets into {current_app.config['ASSETS_FOLDER']}!")
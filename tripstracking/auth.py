@@ -1,11 +1,22 @@
+import sqlite3
 from flask import Blueprint, request, session, g, jsonify, redirect, url_for, render_template, flash
-from werkzeug.security import check_password_hash, generate_password_hash
 from .db import open_db
+from .cache import get_user_cache
+from .passwords import get_password_hasher, HasherBusy
 import functools
 from .static import forms
+from .responses import request_data, error_response
 
 users = Blueprint("users", __name__, url_prefix='/users', template_folder='templates/auth')
 
+def hasher_busy(json_response, template, form):
+    '''Returns the 503 response sent when the password hasher is saturated, asking the client to retry shortly instead of waiting in line.'''
+    error = "Too many logins at the moment, please try again shortly"
+    if json_response:
+        return jsonify({"error": error}), 503, {"Retry-After": "1"}
+    flash(error)
+    return render_template(template, form=form), 503, {"Retry-After": "1"}
+
 def crud_trips(users):
     '''Ensures that only authenicated users can access any users function. Executes the users function if the user is authenticate, else returns a 401 error.'''
     @functools.wraps(users)
@@ -15,18 +26,43 @@ def crud_trips(users):
         return users(**kwargs)
     return wrapped_users
 
-@users.before_request
-def user_info():
-    '''Runs before any users/view function. Selects all user's info from the database and store them in g.'''
-    db = open_db()
-    user_id = session.get('user_id')
+USER_SELECT = 'SELECT * FROM user WHERE user_id = ?'
 
+def cached_user():
+    '''Returns the id of the logged in user and their row from the user cache, which is None when nobody is logged in or the row must be loaded.'''
+    user_id = session.get('user_id')
     if user_id is None:
-        g.user = None
-    else:
-        g.user = db.execute(
-            'SELECT * FROM user WHERE user_id = ?', (user_id,)
-        ).fetchone()
+        return None, None
+    return user_id, get_user_cache().get(user_id)
+
+def remember_user(user_id, user):
+    '''Stores the row of the logged in user in g and in the user cache.'''
+    g.user = user
+    if user is not None:
+        get_user_cache().put(user_id, user)
+
+@users.before_app_request
+def user_info():
+    '''Runs before every request of the app. Loads the logged in user's row, from the user cache when possible, and stores it in g.'''
+    user_id, g.user = cached_user()
+    if user_id is not None and g.user is None:
+        remember_user(user_id, open_db().execute(USER_SELECT, (user_id,)).fetchone())
+
+USER_INSERT = "INSERT INTO user (username, password, fullname, email) VALUES (?, ?, ?, ?)"
+
+def new_user(data):
+    '''Returns the username, password, full name and email of a registration. Raises ValueError when one of them is missing.'''
+    fields = (data.get('username'), data.get('password'), data.get('fullname'), data.get('email'))
+    if not all(fields):
+        raise ValueError('All fields required.')
+    return fields
+
+def registered(json_response):
+    message = "Registered successfully!"
+    if json_response:
+        return jsonify({"message": message}), 201
+    flash(message)
+    return redirect(url_for('users.login_user'))
 
 @users.route('/register', methods=['GET', 'POST'])
 def register_user():
@@ -34,44 +70,23 @@ def register_user():
     if request.method == 'POST' and form.validate():
         json_response = "application/json" in request.headers.get("accept", "")
 
-        if json_response:
-            data = request.get_json()
-        else:
-            data = request.form
+        try:
+            username, password, fullname, email = new_user(request_data(json_response))
+        except ValueError as e:
+            return error_response(json_response, str(e), 400, 'users.register_user')
 
-        username = data.get('username')
-        password = data.get('password')
-        fullname = data.get('fullname')
-        email = data.get('email')
+        try:
+            pwhash = get_password_hasher().hash(password)
+        except HasherBusy:
+            return hasher_busy(json_response, 'register_user.html', form)
 
         db = open_db()
-        error = None
-
-        if not all([username, fullname, password, email]):
-            error = 'All fields required.'
-        
-        if error is None:
-            try:
-                db.execute(
-                    "INSERT INTO user (username, password, fullname, email) VALUES (?, ?, ?, ?)",
-                    (username, generate_password_hash(password), fullname, email)
-                )
-
-                db.commit()
-                
-                message = "Registered successfully!"
-                if json_response:
-                    return jsonify({"message": message}), 201
-                flash(message)
-                return redirect(url_for('users.login_user'))
-
-            except db.IntegrityError:
-                error = "Registration failed"
-
-        if json_response:
-            return jsonify({"error": error}), 400
-        flash(error)
-        return redirect(url_for('users.register_user'))
+        try:
+            db.execute(USER_INSERT, (username, pwhash, fullname, email))
+            db.commit()
+        except sqlite3.IntegrityError:
+            return error_response(json_response, "Registration failed", 400, 'users.register_user')
+        return registered(json_response)
     return render_template('register_user.html', form=form)
 
 @users.route('/delete_user', methods = ['GET', 'POST'])
@@ -101,6 +116,7 @@ def delete_user():
                 'DELETE FROM user WHERE user_id = ?', (user_id,)
             )
             db.commit()
+            get_user_cache().invalidate(user_id)
             session.clear()
             
             message = "User deleted successfully!"
@@ -116,64 +132,67 @@ def delete_user():
             flash(error)
     return render_template('delete_user.html', user_id=user_id, user=user)
 
+USER_BY_NAME_SELECT = 'SELECT * FROM user WHERE username = ?'
+PASSWORD_UPDATE = 'UPDATE user SET password = ? WHERE user_id = ?'
+
+def login_fields(data):
+    '''Returns the username and password of a login. Raises ValueError when one of them is missing.'''
+    username = data.get('username')
+    password = data.get('password')
+    if not username or not password:
+        raise ValueError("Username and password are required")
+    return username, password
+
+def logged_in(json_response, user):
+    '''Starts the session of a user whose password was checked and returns the response of the login.'''
+    session.clear()
+    session['user_id'] = user['user_id']
+
+    message = f"{user['fullname']}, login successful"
+    if json_response:
+        return jsonify({
+            "message": message,
+            "user_id": user['user_id'],
+            "username": user['username'],
+            }), 200
+    flash(message)
+    return redirect(url_for('views.home'))
+
 @users.route('/login', methods = ['GET', 'POST'])
 def login_user():
     form = forms.LoginForm(request.form)
     if request.method == 'POST':
         json_response = "application/json" in request.headers.get("accept", "")
 
-        if json_response:
-            data = request.get_json()
-        else:
-            data = request.form
+        try:
+            username, password = login_fields(request_data(json_response))
+        except ValueError as e:
+            return error_response(json_response, str(e), 400, 'users.login_user')
 
         db = open_db()
-        error = None
-
-        username = data.get('username')
-        password = data.get('password')
-
-        if not username or not password:
-            error = "Username and password are required"
-            if json_response:
-                return jsonify({"error":error}), 400
-            flash(error)
-            return redirect(url_for('users.login_user'))
-
-        user = db.execute(
-            'SELECT * FROM user WHERE username = ?', (username,)
-        ).fetchone()
+        user = db.execute(USER_BY_NAME_SELECT, (username,)).fetchone()
 
         if user is None:
-            error = "Invalid username"
-            if json_response:
-                return jsonify({"error": error}), 401
-            flash(error)
-            return redirect(url_for('users.login_user'))
-
-        if not check_password_hash(user['password'], password):
-            error = 'Invalid password'
-        
-        if error is None:
-            session.clear()
-            session['user_id'] = user['user_id']
-            fullname = user['fullname']
+            return error_response(json_response, "Invalid username", 401, 'users.login_user')
 
-            message = f"{fullname}, login successful"
+        hasher = get_password_hasher()
+        try:
+            valid = hasher.check(user['password'], password)
+        except HasherBusy:
+            return hasher_busy(json_response, 'login.html', form)
 
-            if json_response:
-                return jsonify({
-                    "message": message, 
-                    "user_id": user['user_id'], 
-                    "username": user['username'], 
-                    }), 200
-            flash(message)
-            return redirect(url_for('views.home'))
+        if not valid:
+            error = 'Invalid password'
+            return error_response(json_response, error, 401, 'users.login_user', error=error)
 
-        if json_response:
-            return jsonify({"error": error}), 401
-        flash(error)
-        return redirect(url_for('users.login_user', error=error))
+        if hasher.needs_rehash(user['password']):
+            try:
+                db.execute(PASSWORD_UPDATE, (hasher.hash(password), user['user_id']))
+                db.commit()
+                get_user_cache().invalidate(user['user_id'])
+            except HasherBusy:
+                pass
+        return logged_in(json_response, user)
     return render_template('login.html', form=form)
 
 @users.route('/logout', methods = ['GET','POST'])
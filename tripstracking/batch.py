@@ -0,0 +1,159 @@
+import sqlite3
+from .currency import get_exchange_rates, request_currency
+
+TRIP_FIELDS = ('destination', 'date', 'description', 'budget')
+EXPENSE_FIELDS = ('expense_description', 'expense_date', 'amount', 'currency')
+
+class OperationError(Exception):
+    '''Raised when an operation of a batch cannot be applied. status is the HTTP status the same request would get from the single endpoint.'''
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+def resolve(value, temp_ids, kind):
+    '''Returns the database id of a reference, which is either an id or the temp_id a create earlier in the batch gave its row.'''
+    if isinstance(value, str):
+        if value not in temp_ids.get(kind, {}):
+            raise OperationError(f"Unknown {kind} temp_id {value}")
+        return temp_ids[kind][value]
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    raise OperationError(f"{kind} id must be an integer or a temp_id")
+
+def fields(data, allowed):
+    if not isinstance(data, dict):
+        raise OperationError("data must be an object")
+    unknown = sorted(set(data) - set(allowed))
+    if unknown:
+        raise OperationError(f"Unknown fields: {', '.join(unknown)}")
+    return data
+
+def owned_trip(db, trip_id, user_id):
+    trip = db.execute('SELECT trip_id, destination, date, description, budget FROM trip WHERE trip_id = ? AND user_id = ?', (trip_id, user_id)).fetchone()
+    if trip is None:
+        raise OperationError(f"No trip found with trip_id {trip_id}", 404)
+    return trip
+
+def owned_expense(db, expense_id, user_id):
+    expense = db.execute(
+        'SELECT expense.expense_id, expense.trip_id, expense.expense_description, expense.expense_date, expense.amount, expense.currency '
+        'FROM expense JOIN trip ON trip.trip_id = expense.trip_id WHERE expense.expense_id = ? AND trip.user_id = ?', (expense_id, user_id)
+    ).fetchone()
+    if expense is None:
+        raise OperationError(f"Expense with expense id {expense_id} not found", 404)
+    return expense
+
+def save_trip(db, user_id, trip_id, data):
+    '''Creates a trip when trip_id is None, else updates the given fields of the trip. destination and description are required, like in post_trip and put_trip.'''
+    trip = dict(zip(TRIP_FIELDS, (None,) * len(TRIP_FIELDS)))
+    if trip_id is not None:
+        trip.update(owned_trip(db, trip_id, user_id))
+    trip.update(fields(data, TRIP_FIELDS))
+    if not trip['destination'] or not trip['description']:
+        raise OperationError("destination and description are required")
+
+    values = tuple(trip[field] for field in TRIP_FIELDS)
+    if trip_id is None:
+        trip_id = db.execute('INSERT INTO trip (destination, date, description, budget, user_id) VALUES (?, ?, ?, ?, ?)', values + (user_id,)).lastrowid
+    else:
+        db.execute('UPDATE trip SET destination = ?, date = ?, description = ?, budget = ? WHERE trip_id = ? AND user_id = ?', values + (trip_id, user_id))
+    return {"trip_id": trip_id, **{field: trip[field] for field in TRIP_FIELDS}}
+
+def save_expense(db, user_id, expense_id, trip_id, data, rates):
+    '''Creates an expense in trip_id when expense_id is None, else updates the given fields of the expense. The amount is normalized to the base currency like in post_expense and put_expense.'''
+    expense = dict(zip(EXPENSE_FIELDS, (None,) * len(EXPENSE_FIELDS)))
+    if expense_id is None:
+        owned_trip(db, trip_id, user_id)
+    else:
+        expense.update(owned_expense(db, expense_id, user_id))
+        trip_id = expense['trip_id']
+    expense.update(fields(data, EXPENSE_FIELDS))
+    if not expense['amount']:
+        raise OperationError("Amount is required")
+    try:
+        currency = request_currency(expense)
+        base_amount, rate_version = rates.normalize(expense['amount'], currency)
+    except ValueError as e:
+        raise OperationError(str(e))
+
+    values = (expense['expense_description'], expense['expense_date'], expense['amount'], currency, base_amount, rate_version)
+    if expense_id is None:
+        expense_id = db.execute(
+            'INSERT INTO expense (expense_description, expense_date, amount, currency, base_amount, rate_version, trip_id) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            values + (trip_id,)
+        ).lastrowid
+    else:
+        db.execute(
+            'UPDATE expense SET expense_description = ?, expense_date = ?, amount = ?, currency = ?, base_amount = ?, rate_version = ? WHERE expense_id = ?',
+            values + (expense_id,)
+        )
+    return {
+        "expense_id": expense_id,
+        "trip_id": trip_id,
+        "expense_description": expense['expense_description'],
+        "expense_date": expense['expense_date'],
+        "amount": expense['amount'],
+        "currency": currency,
+        "base_amount": base_amount
+    }
+
+def apply_operation(db, user_id, operation, temp_ids, rates):
+    if not isinstance(operation, dict):
+        raise OperationError("Every operation must be an object")
+    op, kind = operation.get('op'), operation.get('type')
+    if op not in ('create', 'update', 'delete'):
+        raise OperationError("op must be create, update or delete")
+    if kind not in ('trip', 'expense'):
+        raise OperationError("type must be trip or expense")
+
+    result = {"op": op, "type": kind}
+    if op == 'create':
+        temp_id = operation.get('temp_id')
+        if temp_id is not None and (not isinstance(temp_id, str) or temp_id in temp_ids[kind]):
+            raise OperationError("temp_id must be a string not used by an earlier create")
+        if kind == 'trip':
+            row = save_trip(db, user_id, None, operation.get('data', {}))
+        else:
+            row = save_expense(db, user_id, None, resolve(operation.get('trip_id'), temp_ids, 'trip'), operation.get('data', {}), rates)
+        result.update(id=row[f"{kind}_id"], status=201)
+        if temp_id is not None:
+            temp_ids[kind][temp_id] = result['id']
+            result['temp_id'] = temp_id
+        result[kind] = row
+        return result
+
+    row_id = resolve(operation.get('id'), temp_ids, kind)
+    result['id'] = row_id
+    if op == 'update':
+        if kind == 'trip':
+            result['trip'] = save_trip(db, user_id, row_id, operation.get('data', {}))
+        else:
+            result['expense'] = save_expense(db, user_id, row_id, None, operation.get('data', {}), rates)
+    elif kind == 'trip':
+        owned_trip(db, row_id, user_id)
+        db.execute('DELETE FROM trip WHERE trip_id = ?', (row_id,))
+    else:
+        owned_expense(db, row_id, user_id)
+        db.execute('DELETE FROM expense WHERE expense_id = ?', (row_id,))
+    result['status'] = 200
+    return result
+
+def apply_batch(db, user_id, operations):
+    '''Applies an ordered list of create, update and delete operations on the user's trips and expenses in a single transaction, so a sync costs one request and one commit instead of one of each per change. A create may set a temp_id, which later operations use in place of the id of the new row, e.g. as the trip_id of the expenses of a new trip. Updates only change the fields they give. If any operation fails, the whole batch is rolled back and OperationError is raised with the index of the operation added to its message. Returns the per operation results.'''
+    rates = get_exchange_rates()
+    temp_ids = {"trip": {}, "expense": {}}
+    results = []
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        for index, operation in enumerate(operations):
+            try:
+                results.append(apply_operation(db, user_id, operation, temp_ids, rates))
+            except sqlite3.IntegrityError as e:
+                raise OperationError(f"Operation {index} failed: {str(e)}", 409)
+            except OperationError as e:
+                raise OperationError(f"Operation {index} failed: {str(e)}", e.status)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return results
@@ -0,0 +1,57 @@
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+
+class UserCache:
+    '''Bounded LRU cache of user rows keyed by user_id, so that loading the logged in user does not need a database query on every request. Entries expire after ttl seconds, which bounds how stale a row can be when another process changes it. Code that updates or deletes a user must call invalidate.
+    '''
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._rows = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._rows.get(user_id)
+            if entry is not None and entry[0] > time.monotonic():
+                self._rows.move_to_end(user_id)
+                self._stats["hits"] += 1
+                return entry[1]
+            if entry is not None:
+                del self._rows[user_id]
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, user_id, row):
+        with self._lock:
+            self._rows[user_id] = (time.monotonic() + self.ttl, row)
+            self._rows.move_to_end(user_id)
+            while len(self._rows) > self.size:
+                self._rows.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def invalidate(self, user_id):
+        with self._lock:
+            if self._rows.pop(user_id, None) is not None:
+                self._stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._rows.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(size=len(self._rows), max_size=self.size)
+        return stats
+
+def init_user_cache(app):
+    '''Creates the user cache of the app. Called by create_app.'''
+    app.extensions['user_cache'] = UserCache(app.config['USER_CACHE_SIZE'], app.config['USER_CACHE_TTL'])
+    return app.extensions['user_cache']
+
+def get_user_cache():
+    return current_app.extensions['user_cache']
@@ -0,0 +1,90 @@
+import zlib
+from werkzeug.datastructures import Headers
+from werkzeug.http import parse_accept_header, parse_etags, parse_options_header, unquote_etag
+
+ENCODINGS = {'gzip': 31, 'deflate': 15}
+'''Content codings the middleware can produce, mapped to the zlib wbits of their format. deflate is the zlib format, as HTTP defines it.'''
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/x-ndjson', 'application/javascript', 'application/xml', 'image/svg+xml')
+'''Mimetypes, or prefixes of them, worth compressing. Photos, gzip exports and other formats that are compressed already are left out, compressing them again only costs CPU.'''
+
+SKIPPED_STATUSES = (204, 206, 304)
+'''Statuses without a body, or with a byte range of the uncompressed body that must not be encoded.'''
+
+def negotiate(accept_encoding):
+    '''Returns the content coding the client prefers among gzip and deflate, or None when it accepts neither.'''
+    accept = parse_accept_header(accept_encoding)
+    quality, encoding = max((accept.quality(encoding), encoding) for encoding in ('deflate', 'gzip'))
+    return encoding if quality > 0 else None
+
+def is_compressible(status, headers, min_size):
+    if status in SKIPPED_STATUSES or 'Content-Encoding' in headers:
+        return False
+    if 'no-transform' in headers.get('Cache-Control', ''):
+        return False
+    mimetype = parse_options_header(headers.get('Content-Type', ''))[0]
+    if not mimetype.startswith(COMPRESSIBLE_TYPES):
+        return False
+    length = headers.get('Content-Length')
+    return length is None or int(length) >= min_size
+
+def weaken_revalidated_etag(environ, headers):
+    '''Gives a 304 the weak ETag the compressed 200 carried, when that is the tag the client revalidated with, so caches can match the 304 to the response they stored.'''
+    etag = headers.get('ETag')
+    if etag is not None and not etag.startswith('W/'):
+        if parse_etags(environ.get('HTTP_IF_NONE_MATCH')).is_weak(unquote_etag(etag)[0]):
+            headers['ETag'] = f'W/{etag}'
+
+class CompressionMiddleware:
+    '''WSGI middleware that compresses responses with the gzip or deflate coding the client accepts. Only text, JSON and similar mimetypes are compressed, and only when their body is at least COMPRESS_MIN_SIZE bytes long; a streamed response has no Content-Length and is always compressed. The body is compressed chunk by chunk as the app yields it, so streamed responses like the export are never held in memory. Compressed responses lose their Content-Length and their ETag becomes weak, since the bytes differ from the uncompressed ones. COMPRESS_LEVEL = 0 turns compression off.
+    '''
+    def __init__(self, wsgi_app, app):
+        self.wsgi_app = wsgi_app
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        encoding = None
+        if environ.get('REQUEST_METHOD') != 'HEAD' and self.app.config['COMPRESS_LEVEL']:
+            encoding = negotiate(environ.get('HTTP_ACCEPT_ENCODING'))
+        if encoding is None:
+            return self.wsgi_app(environ, start_response)
+
+        compressor = None
+
+        def compressing_start_response(status, headers, exc_info=None):
+            nonlocal compressor
+            headers = Headers(headers)
+            code = int(status.split(' ', 1)[0])
+            if code == 304:
+                weaken_revalidated_etag(environ, headers)
+            elif is_compressible(code, headers, self.app.config['COMPRESS_MIN_SIZE']):
+                compressor = zlib.compressobj(self.app.config['COMPRESS_LEVEL'], zlib.DEFLATED, ENCODINGS[encoding])
+                headers['Content-Encoding'] = encoding
+                headers.remove('Content-Length')
+                etag = headers.get('ETag')
+                if etag is not None and not etag.startswith('W/'):
+                    headers['ETag'] = f'W/{etag}'
+                headers['Vary'] = ', '.join(filter(None, (headers.get('Vary'), 'Accept-Encoding')))
+            write = start_response(status, headers.to_wsgi_list(), exc_info)
+            if compressor is None:
+                return write
+            return lambda data: write(compressor.compress(data))
+
+        body = self.wsgi_app(environ, compressing_start_response)
+        if compressor is None:
+            return body
+        return self.compressed(body, compressor)
+
+    def compressed(self, body, compressor):
+        '''Yields the compressed chunks of body. An empty chunk is yielded while zlib is still collecting input, so the server is never blocked waiting for the next chunk of the app.'''
+        try:
+            for chunk in body:
+                yield compressor.compress(chunk)
+            yield compressor.flush()
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+
+def init_compression(app):
+    '''Wraps the WSGI app in the compression middleware. Called by create_app, after which every response of the app, including static files and errors, is negotiated.'''
+    app.wsgi_app = CompressionMiddleware(app.wsgi_app, app)
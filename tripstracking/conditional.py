@@ -0,0 +1,35 @@
+import hashlib
+from datetime import datetime, timedelta, timezone
+from flask import request, make_response
+
+def validators(scope, key, row):
+    '''Returns the strong ETag and the Last-Modified date of a GET response from the data_version and data_modified columns of row, the user or trip whose data the response shows. The ETag also depends on the query string, so every page of a listing gets its own. data_modified has a resolution of one second, so a second write within the same second would not change it: Last-Modified is None until that second is over, and clients revalidate with the ETag meanwhile.'''
+    tag = f"{scope}:{key}:{row['data_version']}:{request.query_string.decode('latin1')}"
+    etag = hashlib.blake2b(tag.encode('utf8'), digest_size=12).hexdigest()
+
+    last_modified = row['data_modified']
+    if last_modified is not None:
+        last_modified = last_modified.replace(tzinfo=timezone.utc)
+        if last_modified + timedelta(seconds=1) > datetime.now(timezone.utc):
+            last_modified = None
+    return etag, last_modified
+
+def is_not_modified(etag, last_modified):
+    '''Evaluates If-None-Match, or If-Modified-Since when no If-None-Match was sent, against the validators of the current data. If-None-Match uses the weak comparison, so it also matches the weak ETag of a compressed response.'''
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified is not None:
+        return last_modified <= request.if_modified_since
+    return False
+
+def set_validators(response, etag, last_modified):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.update(('Accept', 'Cookie'))
+    return response
+
+def not_modified(etag, last_modified):
+    '''Returns the 304 response sent when the client already has the current data.'''
+    return set_validators(make_response('', 304), etag, last_modified)
@@ -0,0 +1,134 @@
+import csv
+import math
+import re
+import threading
+import time
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from .db import open_db
+
+CURRENCY_CODE = re.compile(r'^[A-Z]{3}$')
+
+AMOUNT_ERROR = "amount must be a number"
+'''Message of the ValueError normalize raises for an amount that is not a finite number.'''
+
+class ExchangeRates:
+    '''Keeps the latest version of the exchange_rate table in memory, so normalizing an expense to the base currency is a dict lookup instead of a query. The rates are loaded on first use and reloaded after EXCHANGE_RATES_TTL seconds or when the DATABASE setting changes, which is how other worker processes pick up the rates loaded by flask load-rates.
+    '''
+    def __init__(self, app):
+        self.app = app
+        self._lock = threading.Lock()
+        self._database = None
+        self._expires = 0
+        self.version = None
+        self.rates = {}
+
+    def _load(self):
+        db = open_db()
+        version = db.execute('SELECT MAX(version) FROM exchange_rate').fetchone()[0]
+        rates = db.execute('SELECT currency, rate FROM exchange_rate WHERE version = ?', (version,)).fetchall()
+        return version, {row['currency']: row['rate'] for row in rates}
+
+    def current(self):
+        '''Returns the (version, {currency: rate}) in use, loading it from the database of the request when the cached copy is stale.'''
+        database = self.app.config['DATABASE']
+        with self._lock:
+            if database == self._database and time.monotonic() < self._expires:
+                return self.version, self.rates
+        version, rates = self._load()
+        with self._lock:
+            self.version, self.rates = version, rates
+            self._database = database
+            self._expires = time.monotonic() + self.app.config['EXCHANGE_RATES_TTL']
+        return version, rates
+
+    def reload(self):
+        with self._lock:
+            self._expires = 0
+
+    def normalize(self, amount, currency):
+        '''Returns the amount in the base currency, rounded to cents, and the rate version used. Raises ValueError for an unknown currency or an amount that is not a finite number, like "NaN", "inf" or one too large to convert.'''
+        version, rates = self.current()
+        rate = rates.get(currency)
+        if rate is None:
+            raise ValueError(f"Unknown currency {currency}")
+        try:
+            base_amount = float(amount) * rate
+        except (TypeError, ValueError):
+            raise ValueError(AMOUNT_ERROR)
+        if not math.isfinite(base_amount):
+            raise ValueError(AMOUNT_ERROR)
+        return round(base_amount, 2), version
+
+def init_exchange_rates(app):
+    '''Creates the exchange rate cache of the app. Called by create_app.'''
+    app.extensions['exchange_rates'] = ExchangeRates(app)
+    return app.extensions['exchange_rates']
+
+def get_exchange_rates():
+    return current_app.extensions['exchange_rates']
+
+def request_currency(data):
+    '''Reads the currency of an expense from the posted data, defaulting to the base currency. Raises ValueError if it is not a three letter code, including when JSON gave a number or another type.'''
+    currency = data.get('currency') or current_app.config['BASE_CURRENCY']
+    if not isinstance(currency, str) or not CURRENCY_CODE.match(currency.strip().upper()):
+        raise ValueError("currency must be a three letter code like EUR")
+    return currency.strip().upper()
+
+def load_rates(db, rates):
+    '''Stores rates, a {currency: base currency per unit} dict, as a new version of the exchange_rate table. The base currency always keeps rate 1. Returns the new version.'''
+    rates = dict(rates)
+    rates[current_app.config['BASE_CURRENCY']] = 1.0
+    with db:
+        version = db.execute('SELECT COALESCE(MAX(version), 0) + 1 FROM exchange_rate').fetchone()[0]
+        db.executemany(
+            'INSERT INTO exchange_rate (version, currency, rate) VALUES (?, ?, ?)',
+            [(version, currency, rate) for currency, rate in rates.items()]
+        )
+    get_exchange_rates().reload()
+    return version
+
+def renormalize(db, batch_size):
+    '''Recomputes base_amount for every expense normalized with an older rate version, batch_size expenses per transaction, so writers are never locked out for long. The conversion runs in SQL with the rate looked up from exchange_rate, and the trip_stats triggers adjust the totals of every updated trip. Expenses in currencies missing from the current rates are left as they are. Returns the number of updated expenses.'''
+    version = get_exchange_rates().current()[0]
+    updated = 0
+    last_id = 0
+    while True:
+        with db:
+            batch = db.execute(
+                'SELECT expense_id FROM expense WHERE expense_id > ? AND rate_version IS NOT ? AND currency IN (SELECT currency FROM exchange_rate WHERE version = ?) '
+                'ORDER BY expense_id LIMIT ?', (last_id, version, version, batch_size)
+            ).fetchall()
+            if not batch:
+                return updated
+            last_id = batch[-1]['expense_id']
+            updated += db.execute(
+                'UPDATE expense SET base_amount = round(amount * (SELECT rate FROM exchange_rate WHERE version = ? AND currency = expense.currency), 2), rate_version = ? '
+                'WHERE expense_id BETWEEN ? AND ? AND rate_version IS NOT ? AND currency IN (SELECT currency FROM exchange_rate WHERE version = ?)',
+                (version, version, batch[0]['expense_id'], last_id, version, version)
+            ).rowcount
+
+@click.command('load-rates')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@with_appcontext
+def load_rates_command(path):
+    '''Loads exchange rates from a CSV file with currency and rate columns, the rate being the amount of the base currency one unit is worth, as a new version of the rate table. Run the command, followed by flask renormalize:
+
+    flask --app trips.py load-rates rates.csv
+    '''
+    with open(path, newline='', encoding='utf8') as f:
+        rates = {row['currency'].strip().upper(): float(row['rate']) for row in csv.DictReader(f)}
+    version = load_rates(open_db(), rates)
+    click.echo(f'Loaded {len(rates)} rates as version {version}!')
+
+@click.command('renormalize')
+@click.option('--batch-size', type=int, default=5000, help='Number of expenses updated per transaction.')
+@with_appcontext
+def renormalize_command(batch_size):
+    '''Recomputes the base currency amounts of the expenses with the latest exchange rates. Run the command after flask load-rates:
+
+    flask --app trips.py renormalize
+    '''
+    count = renormalize(open_db(), batch_size)
+    click.echo(f'Renormalized {count} expenses!')
@@ -1,36 +1,224 @@
+import os
+import re
 import sqlite3
+import threading
+import time
 from flask import current_app, g
+from flask.cli import with_appcontext
 import click
 from datetime import datetime
+from .metrics import InstrumentedConnection
+from .sqltrace import get_slow_query_log
+
+MIGRATION_FILE = re.compile(r'^(\d+)_(\w+)\.sql$')
+
+def connection_pragmas(config):
+    '''Returns the PRAGMA statements every connection of the app runs once when it is opened, sync or async.'''
+    return [
+        'PRAGMA journal_mode = WAL',
+        'PRAGMA synchronous = NORMAL',
+        f'PRAGMA mmap_size = {int(config["DB_MMAP_SIZE"])}',
+        f'PRAGMA cache_size = {int(config["DB_CACHE_SIZE"])}',
+        'PRAGMA foreign_keys = ON',
+        f'PRAGMA busy_timeout = {int(config["DB_BUSY_TIMEOUT"] * 1000)}',
+    ]
+
+class ConnectionPool:
+    '''Keeps a bounded set of sqlite3 connections that are reused across requests instead of being opened and closed every time. Every connection is configured once with the PRAGMAs from the app config (WAL journal, synchronous=NORMAL, mmap_size, cache_size, foreign_keys and a busy_timeout of DB_BUSY_TIMEOUT seconds, how long a write waits for the lock of another one). When all connections are checked out, callers wait up to DB_POOL_TIMEOUT seconds for one to be returned.
+    '''
+    def __init__(self, app):
+        self.app = app
+        self._lock = threading.Condition()
+        self._idle = []
+        self._size = 0
+        self._database = None
+        self._stats = {"checkouts": 0, "hits": 0, "misses": 0, "waits": 0, "timeouts": 0}
+
+    def _connect(self, database):
+        db = sqlite3.connect(
+            database,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=False,
+            factory=InstrumentedConnection
+        )
+        db.row_factory = sqlite3.Row
+        for pragma in connection_pragmas(self.app.config):
+            db.execute(pragma)
+        return db
+
+    def _reset(self, database):
+        '''Drops the idle connections when the DATABASE setting changed since they were opened, e.g. when tests point the app to a temporary file.'''
+        for db in self._idle:
+            db.close()
+        self._size -= len(self._idle)
+        self._idle = []
+        self._database = database
+
+    def checkout(self):
+        database = self.app.config['DATABASE']
+        deadline = time.monotonic() + self.app.config['DB_POOL_TIMEOUT']
+        with self._lock:
+            if database != self._database:
+                self._reset(database)
+            self._stats["checkouts"] += 1
+            waited = False
+            while not self._idle and self._size >= self.app.config['DB_POOL_SIZE']:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise RuntimeError("Timed out waiting for a database connection")
+                if not waited:
+                    self._stats["waits"] += 1
+                    waited = True
+                self._lock.wait(remaining)
+            if self._idle:
+                self._stats["hits"] += 1
+                return self._idle.pop()
+            self._size += 1
+            self._stats["misses"] += 1
+        try:
+            return self._connect(database)
+        except Exception:
+            with self._lock:
+                self._size -= 1
+                self._lock.notify()
+            raise
+
+    def checkin(self, db):
+        '''Returns a connection to the pool. Any transaction left open by the request is rolled back so the next user gets a clean connection.'''
+        try:
+            if db.in_transaction:
+                db.rollback()
+        except sqlite3.Error:
+            db.close()
+            with self._lock:
+                self._size -= 1
+                self._lock.notify()
+            return
+        with self._lock:
+            if self._database != self.app.config['DATABASE'] or len(self._idle) >= self.app.config['DB_POOL_SIZE']:
+                db.close()
+                self._size -= 1
+            else:
+                self._idle.append(db)
+            self._lock.notify()
+
+    def close(self):
+        '''Closes every idle connection, e.g. when the app shuts down or a test removes its database file.'''
+        with self._lock:
+            self._reset(None)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(size=self._size, idle=len(self._idle), max_size=self.app.config['DB_POOL_SIZE'])
+        return stats
+
+def init_pool(app):
+    '''Creates the connection pool of the app. Called by create_app.'''
+    app.extensions['db_pool'] = ConnectionPool(app)
+    return app.extensions['db_pool']
+
+def get_pool():
+    return current_app.extensions['db_pool']
 
 def open_db():
-    '''Returns the database connection stored in g, after creating the sqlite3 connection, connecting the file in which the function was called, with the database.
+    '''Returns the database connection stored in g, after checking out a pooled sqlite3 connection for the database of the current app. Its statement counters start from zero, so the metrics of the request only count its own SQL, and it traces slow statements when SQL_SLOW_QUERY_THRESHOLD is set.
     '''
     if 'db' not in g:
         try:
-            g.db = sqlite3.connect(
-                current_app.config['DATABASE'],
-                detect_types=sqlite3.PARSE_DECLTYPES
-            )
-            g.db.row_factory = sqlite3.Row
+            g.db = get_pool().checkout()
         except Exception as e:
             current_app.logger.error(f"Database connection failed: {str(e)}")
             raise RuntimeError("Failed to connect to the database")
+        g.db.reset_counters()
+        g.db.tracer = get_slow_query_log()
     return g.db
 
 def close_db(e=None):
+    '''Returns the connection stored in g to the pool at the end of the request.'''
     db = g.pop('db', None)
 
     if db is not None:
-        db.close()
+        get_pool().checkin(db)
 
 def init_db():
-    '''Initializes the database using the schema.sql code for creating or resetting the database. The function reads the contents of the schema.sql file and executes them as a script to set up the database structure.
+    '''Initializes the database for creating or resetting it. The function executes the schema.sql script, which drops every existing table, and then applies all the migrations to build the current schema from scratch.
     '''
     db = open_db()
 
     with current_app.open_resource('schema.sql') as f:
         db.executescript(f.read().decode('utf8'))
+    apply_migrations(db)
+
+def list_migrations():
+    '''Returns the (version, name, path) of every file in the migrations folder, sorted by version. Migration files are named <version>_<name>.sql, e.g. 0002_query_indexes.sql.'''
+    folder = os.path.join(current_app.root_path, 'migrations')
+    migrations = []
+    for filename in os.listdir(folder):
+        match = MIGRATION_FILE.match(filename)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(folder, filename)))
+    return sorted(migrations)
+
+def applied_migrations(db):
+    '''Returns a dict of version -> applied timestamp for the migrations recorded in the schema_version table.'''
+    db.execute(
+        'CREATE TABLE IF NOT EXISTS schema_version ('
+        'version INTEGER PRIMARY KEY, '
+        'name TEXT NOT NULL, '
+        'applied TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP)'
+    )
+    db.commit()
+    rows = db.execute('SELECT version, applied FROM schema_version').fetchall()
+    return {row['version']: row['applied'] for row in rows}
+
+def apply_migrations(db):
+    '''Applies the pending migrations in version order. Each migration runs in its own transaction together with its schema_version row, so a failing migration leaves the database at the previous version. Returns the list of (version, name) applied.'''
+    applied = applied_migrations(db)
+    done = []
+    for version, name, path in list_migrations():
+        if version in applied:
+            continue
+        with open(path, encoding='utf8') as f:
+            sql = f.read()
+        try:
+            db.executescript(
+                f"BEGIN;\n{sql}\n;INSERT INTO schema_version (version, name) VALUES ({version}, '{name}');\nCOMMIT;"
+            )
+        except sqlite3.Error as e:
+            if db.in_transaction:
+                db.rollback()
+            raise RuntimeError(f"Migration {version:04d}_{name} failed: {str(e)}")
+        done.append((version, name))
+    return done
+
+@click.command('migrate')
+@click.option('--status', is_flag=True, help='Only list the applied and pending migrations.')
+@with_appcontext
+def migrate_command(status):
+    '''Upgrades the database to the latest schema version without touching the existing data. Run the command:
+
+    flask --app trips.py migrate
+
+    or list which migrations have been applied with:
+
+    flask --app trips.py migrate --status
+    '''
+    db = open_db()
+
+    if status:
+        applied = applied_migrations(db)
+        for version, name, path in list_migrations():
+            state = f"applied {applied[version]}" if version in applied else "pending"
+            click.echo(f"{version:04d}_{name}: {state}")
+        return
+
+    done = apply_migrations(db)
+    for version, name in done:
+        click.echo(f"Applied {version:04d}_{name}")
+    if not done:
+        click.echo('The database is up to date!')
 
 @click.command('init-db')
 def init_db_command():
@@ -51,6 +239,28 @@ def init_db_command():
     init_db()
     click.echo('The new database has been created!')
 
+def rebuild_trip_stats(db):
+    '''Recomputes the trip_stats rows of every trip from the expense table in a single statement. The triggers keep trip_stats up to date on every write, so this is only needed after bulk imports that bypassed them or to repair drift.'''
+    with db:
+        db.execute('DELETE FROM trip_stats')
+        db.execute(
+            'INSERT INTO trip_stats (trip_id, expense_count, expense_total, expense_min, expense_max, remaining_budget) '
+            'SELECT trip.trip_id, COUNT(expense.expense_id), COALESCE(SUM(expense.base_amount), 0), MIN(expense.base_amount), MAX(expense.base_amount), '
+            'trip.budget - COALESCE(SUM(expense.base_amount), 0) '
+            'FROM trip LEFT JOIN expense ON expense.trip_id = trip.trip_id GROUP BY trip.trip_id'
+        )
+    return db.execute('SELECT COUNT(*) FROM trip_stats').fetchone()[0]
+
+@click.command('rebuild-stats')
+@with_appcontext
+def rebuild_stats_command():
+    '''Recomputes the expense count, total, min, max and remaining budget of every trip. Run the command after bulk imports:
+
+    flask --app trips.py rebuild-stats
+    '''
+    count = rebuild_trip_stats(open_db())
+    click.echo(f'Rebuilt the expense statistics of {count} trips!')
+
 sqlite3.register_converter (
     "timestamp", lambda x: datetime.fromisoformat(x.decode())
 )
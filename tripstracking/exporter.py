@@ -0,0 +1,77 @@
+import csv
+import io
+import json
+import zlib
+
+TABLES = (
+    ('trip', 'SELECT trip_id, destination, date, description, budget, created FROM trip WHERE user_id = ? ORDER BY trip_id'),
+    ('expense', 'SELECT expense.expense_id, expense.trip_id, expense.expense_description, expense.expense_date, expense.amount, expense.currency, expense.base_amount, expense.created '
+                'FROM trip JOIN expense ON expense.trip_id = trip.trip_id WHERE trip.user_id = ? ORDER BY expense.trip_id, expense.expense_id'),
+    ('photo', 'SELECT photo.photo_id, photo.trip_id, photo.file_path, photo.created '
+              'FROM photo WHERE photo.user_id = ? ORDER BY photo.photo_id'),
+)
+
+CSV_COLUMNS = ('record_type', 'trip_id', 'expense_id', 'photo_id', 'destination', 'date', 'description', 'budget',
+               'expense_description', 'expense_date', 'amount', 'currency', 'base_amount', 'file_path', 'created')
+
+def iter_records(db, user_id):
+    '''Yields (record type, row) for every trip, expense and photo of the user. The rows are read by iterating the cursors, which step through the results one row at a time, so the account is never loaded into memory as a whole.'''
+    for record_type, sql in TABLES:
+        for row in db.execute(sql, (user_id,)):
+            yield record_type, row
+
+def _buffered(lines, size):
+    '''Joins lines into chunks of about size characters, so the response is written in a few large pieces instead of one per row.'''
+    buffer = []
+    length = 0
+    for line in lines:
+        buffer.append(line)
+        length += len(line)
+        if length >= size:
+            yield ''.join(buffer)
+            buffer = []
+            length = 0
+    if buffer:
+        yield ''.join(buffer)
+
+def ndjson_lines(records):
+    for record_type, row in records:
+        record = {"type": record_type}
+        record.update(zip(row.keys(), row))
+        yield json.dumps(record, default=str) + '\n'
+
+def csv_lines(records):
+    '''Yields the records as CSV lines. Trips, expenses and photos share one header made of all their columns, and the record_type column tells them apart.'''
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=CSV_COLUMNS)
+    writer.writeheader()
+    for record_type, row in records:
+        record = {"record_type": record_type}
+        record.update(zip(row.keys(), row))
+        writer.writerow(record)
+        yield output.getvalue()
+        output.seek(0)
+        output.truncate()
+    yield output.getvalue()
+
+def encode_chunks(lines, chunk_size):
+    for chunk in _buffered(lines, chunk_size):
+        yield chunk.encode('utf8')
+
+def gzip_chunks(chunks, level):
+    '''Compresses a stream of byte chunks into the gzip format incrementally, one chunk at a time.'''
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def export(db, user_id, format, gzip, chunk_size, level):
+    '''Returns the generator of the response body of an export in the given format, optionally gzip compressed.'''
+    records = iter_records(db, user_id)
+    lines = csv_lines(records) if format == 'csv' else ndjson_lines(records)
+    chunks = encode_chunks(lines, chunk_size)
+    if gzip:
+        chunks = gzip_chunks(chunks, level)
+    return chunks
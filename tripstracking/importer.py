@@ -0,0 +1,193 @@
+import csv
+import io
+import json
+import math
+import re
+import sqlite3
+from datetime import date
+from werkzeug.datastructures import MultiDict
+from .static import forms
+from .currency import AMOUNT_ERROR, get_exchange_rates, request_currency
+
+FIELDS = ('expense_description', 'expense_date', 'amount', 'currency')
+
+INSERT_EXPENSE = 'INSERT INTO expense (expense_description, expense_date, amount, currency, base_amount, rate_version, trip_id) VALUES (?, ?, ?, ?, ?, ?, ?)'
+
+DEFERRED_TRIGGERS = ('version_expense_insert', 'search_expense_insert', 'trip_stats_expense_insert')
+'''Triggers of expense inserts that are dropped for the duration of an import, like seed-db does. The change version, search index rows and trip_stats row they maintain are updated once for the whole import instead, which is most of the time an import of 100k rows takes otherwise. The triggers are recreated in the same transaction, so other connections never see them missing, and a failed import rolls the drop back with everything else. The price is that every import changes the schema: SQLite prepares each statement a pooled connection has cached again the first time it runs after the import, one prepare per statement and connection, which is small next to running the triggers once per imported row.'''
+
+DECIMAL = re.compile(r'^-?\d+(\.\d+)?$')
+CURRENCY = re.compile(r'^[A-Za-z]{3}$')
+
+class RowRejected(Exception):
+    '''Raised when the database rejects a row that passed validation, e.g. because its trip was deleted meanwhile. The import is rolled back; report is its result in the shape import_expenses returns, with the rejected row among the errors.'''
+    def __init__(self, number, message):
+        super().__init__(message)
+        self.number = number
+        self.report = None
+
+def detect_format(filename, mimetype):
+    '''Returns 'csv' or 'ndjson' from the file extension or the content type of an upload, or None if neither matches.'''
+    filename = (filename or '').lower()
+    mimetype = (mimetype or '').lower()
+    if filename.endswith('.csv') or mimetype in ('text/csv', 'application/csv'):
+        return 'csv'
+    if filename.endswith(('.ndjson', '.jsonl')) or mimetype in ('application/x-ndjson', 'application/jsonl', 'application/ndjson'):
+        return 'ndjson'
+    return None
+
+def read_rows(stream, format):
+    '''Parses the uploaded binary stream one line at a time and yields (row number, dict of the expense fields, error). The error is set instead of the dict when a line cannot be parsed, so a bad line is reported without stopping the import.'''
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+
+    if format == 'csv':
+        for number, row in enumerate(csv.DictReader(text), start=1):
+            yield number, {field: row.get(field) for field in FIELDS}, None
+        return
+
+    for number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield number, None, f"Invalid JSON: {str(e)}"
+            continue
+        if not isinstance(row, dict):
+            yield number, None, "Each line must be a JSON object"
+            continue
+        yield number, {field: row.get(field) for field in FIELDS}, None
+
+def plainly_valid(row):
+    '''Returns the (description, date, amount) of a row whose values are plainly valid by the rules of AddExpenseForm: a short text, an ISO date, a non-zero decimal amount and a three letter currency. Returns None for any other row, which is then validated by the form itself, so the form stays the judge of every row this shortcut does not accept and produces all the error messages. Skipping the form for the common rows makes validation several times faster.'''
+    description, expense_date, amount, currency = (row[field] for field in FIELDS)
+    if description is not None and (not isinstance(description, str) or len(description) > 100):
+        return None
+    if currency and (not isinstance(currency, str) or not CURRENCY.match(currency)):
+        return None
+    if expense_date is not None:
+        if not isinstance(expense_date, str) or len(expense_date) != 10 or expense_date[4] != '-' or expense_date[7] != '-':
+            return None
+        try:
+            date.fromisoformat(expense_date)
+        except ValueError:
+            return None
+    if isinstance(amount, bool) or not isinstance(amount, (str, int, float)) or not DECIMAL.match(str(amount)):
+        return None
+    amount = float(str(amount))
+    if not amount or not math.isfinite(amount):
+        return None
+    return description or None, expense_date, amount
+
+def insert_chunk(db, batch, numbers):
+    '''Inserts a chunk of rows with executemany. If the database rejects one, the chunk is inserted again row by row to find it, and RowRejected is raised with the number of that row.'''
+    db.execute('SAVEPOINT import_chunk')
+    try:
+        db.executemany(INSERT_EXPENSE, batch)
+    except sqlite3.IntegrityError:
+        db.execute('ROLLBACK TO import_chunk')
+        for number, values in zip(numbers, batch):
+            try:
+                db.execute(INSERT_EXPENSE, values)
+            except sqlite3.IntegrityError as e:
+                raise RowRejected(number, str(e)) from e
+        raise
+    db.execute('RELEASE import_chunk')
+
+def derive(db, trip_id, last_id):
+    '''Does for the imported expenses, the ones of trip_id after last_id, what the DEFERRED_TRIGGERS would have done row by row.'''
+    db.execute('UPDATE trip SET data_version = data_version + 1, data_modified = CURRENT_TIMESTAMP WHERE trip_id = ?', (trip_id,))
+    db.execute(
+        'UPDATE user SET data_version = data_version + 1, data_modified = CURRENT_TIMESTAMP WHERE user_id = (SELECT user_id FROM trip WHERE trip_id = ?)', (trip_id,)
+    )
+    db.execute(
+        "INSERT INTO search_index (rowid, owner, destination, description, kind, trip_id) "
+        "SELECT expense.expense_id, 'u' || trip.user_id, trip.destination, expense.expense_description, 'expense', trip.trip_id "
+        "FROM expense JOIN trip ON trip.trip_id = expense.trip_id WHERE expense.trip_id = ? AND expense.expense_id > ?", (trip_id, last_id)
+    )
+    db.execute(
+        'INSERT OR REPLACE INTO trip_stats (trip_id, expense_count, expense_total, expense_min, expense_max, remaining_budget) '
+        'SELECT trip.trip_id, COUNT(expense.expense_id), COALESCE(SUM(expense.base_amount), 0), MIN(expense.base_amount), MAX(expense.base_amount), '
+        'trip.budget - COALESCE(SUM(expense.base_amount), 0) '
+        'FROM trip LEFT JOIN expense ON expense.trip_id = trip.trip_id WHERE trip.trip_id = ? GROUP BY trip.trip_id', (trip_id,)
+    )
+
+def import_expenses(db, trip_id, rows, chunk_size, max_errors):
+    '''Validates every row with the rules of AddExpenseForm, normalizes its amount to the base currency with the cached exchange rates and inserts the valid ones into the trip with executemany, chunk_size rows at a time, inside a single transaction with the DEFERRED_TRIGGERS dropped. Invalid rows are skipped and reported, up to max_errors of them. Rows that are plainly valid skip the form; the others go through one form instance reused for all rows, since building a form is the most expensive part of the validation. A row the database rejects aborts the whole import with RowRejected.'''
+    form = forms.AddExpenseForm()
+    rates = get_exchange_rates()
+    batch = []
+    numbers = []
+    imported = 0
+    failed = 0
+    errors = []
+
+    def report(number, error):
+        if len(errors) < max_errors:
+            errors.append({"row": number, "errors": error})
+
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        placeholders = ', '.join('?' * len(DEFERRED_TRIGGERS))
+        triggers = db.execute(
+            f"SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND name IN ({placeholders})", DEFERRED_TRIGGERS
+        ).fetchall()
+        for trigger in triggers:
+            db.execute(f'DROP TRIGGER "{trigger["name"]}"')
+        last_id = db.execute('SELECT COALESCE(MAX(expense_id), 0) FROM expense').fetchone()[0]
+
+        for number, row, error in rows:
+            if row is not None:
+                values = plainly_valid(row)
+                if values is None:
+                    form.process(MultiDict({key: str(value) for key, value in row.items() if value is not None}))
+                    if not form.validate():
+                        error = form.errors
+                    elif not math.isfinite(float(form.amount.data)):
+                        error = {"amount": [AMOUNT_ERROR]}
+                    else:
+                        expense_date = form.expense_date.data
+                        values = (
+                            form.expense_description.data or None,
+                            expense_date.isoformat() if expense_date else None,
+                            float(form.amount.data)
+                        )
+                if values is not None:
+                    try:
+                        currency = request_currency(row)
+                        base_amount, rate_version = rates.normalize(values[2], currency)
+                        batch.append((*values, currency, base_amount, rate_version, trip_id))
+                        numbers.append(number)
+                    except ValueError as e:
+                        error = {"amount" if str(e) == AMOUNT_ERROR else "currency": [str(e)]}
+
+            if error is not None:
+                failed += 1
+                report(number, error)
+
+            if len(batch) >= chunk_size:
+                insert_chunk(db, batch, numbers)
+                imported += len(batch)
+                batch = []
+                numbers = []
+
+        if batch:
+            insert_chunk(db, batch, numbers)
+            imported += len(batch)
+        if imported:
+            derive(db, trip_id, last_id)
+        for trigger in triggers:
+            db.execute(trigger['sql'])
+        db.commit()
+    except RowRejected as e:
+        db.rollback()
+        e.report = {
+            "imported": 0, "failed": failed + 1,
+            "errors": errors + [{"row": e.number, "errors": {"database": [str(e)]}}]
+        }
+        raise
+    except Exception:
+        db.rollback()
+        raise
+
+    return {"imported": imported, "failed": failed, "errors": errors}
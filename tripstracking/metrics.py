@@ -0,0 +1,230 @@
+import bisect
+import sqlite3
+import threading
+import time
+from flask import current_app, g, request
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+'''Content type of the Prometheus text exposition format.'''
+
+class InstrumentedCursor(sqlite3.Cursor):
+    '''Cursor that adds the time spent executing and fetching to its connection. Rows read by iterating the cursor are not timed, to keep row by row reads like the export free of any overhead. When the connection has a slow query tracer, the time of the current statement is summed up as well and the statement is traced once it exceeds the threshold.'''
+    sql = None
+    parameters = None
+    seconds = 0.0
+    traced = False
+
+    def _record(self, start, statements=1):
+        elapsed = time.perf_counter() - start
+        connection = self.connection
+        connection.statements += statements
+        connection.sql_seconds += elapsed
+        tracer = connection.tracer
+        if tracer is not None and not self.traced:
+            self.seconds += elapsed
+            if self.seconds >= tracer.threshold:
+                self.traced = True
+                tracer.trace(connection, self.sql, self.parameters, self.seconds)
+
+    def execute(self, sql, parameters=()):
+        self.sql, self.parameters, self.seconds, self.traced = sql, parameters, 0.0, False
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._record(start)
+
+    def executemany(self, sql, parameters):
+        self.sql, self.parameters, self.seconds, self.traced = sql, None, 0.0, False
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            self._record(start)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            self._record(start, statements=0)
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        try:
+            return super().fetchmany(self.arraysize if size is None else size)
+        finally:
+            self._record(start, statements=0)
+
+    def fetchall(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            self._record(start, statements=0)
+
+class InstrumentedConnection(sqlite3.Connection):
+    '''sqlite3 connection that counts the statements it runs and the time spent in them, read by the metrics at the end of every request. The sync and async pools create every connection with this class, and open_db and open_db_async reset the counters and set the slow query tracer when a request checks one out.'''
+    statements = 0
+    sql_seconds = 0.0
+    tracer = None
+    endpoint = None
+
+    def reset_counters(self):
+        self.statements = 0
+        self.sql_seconds = 0.0
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, parameters):
+        return self.cursor().executemany(sql, parameters)
+
+    def executescript(self, script):
+        start = time.perf_counter()
+        try:
+            return super().executescript(script)
+        finally:
+            self.statements += 1
+            self.sql_seconds += time.perf_counter() - start
+
+class Histogram:
+    '''Prometheus histogram keyed by label values. Only the count of the bucket a value falls in is incremented, and the counts are summed up into cumulative buckets when rendered.'''
+    def __init__(self, name, help, labels, buckets):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, key, value):
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} histogram'
+        for key, (counts, total) in sorted(self.series.items()):
+            labels = format_labels(self.labels, key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+            yield f'{self.name}_sum{{{labels}}} {total}'
+            yield f'{self.name}_count{{{labels}}} {cumulative}'
+
+class Counter:
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.series = {}
+
+    def inc(self, key, value=1):
+        self.series[key] = self.series.get(key, 0) + value
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} counter'
+        for key, value in sorted(self.series.items()):
+            yield f'{self.name}{{{format_labels(self.labels, key)}}} {value}'
+
+def format_labels(names, values):
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for value in values)
+    return ','.join(f'{name}="{value}"' for name, value in zip(names, escaped))
+
+class Metrics:
+    '''In-process registry of the request metrics of the app, served at /metrics in the Prometheus text format. Series are labelled by endpoint name instead of path, so ids in URLs do not grow the number of series. Every process keeps its own registry, so with several workers Prometheus should scrape each of them. The SQL metrics cover the pooled sqlite3 connection of the request and, in the async build, its aiosqlite connection.'''
+    def __init__(self, app):
+        self.app = app
+        self._lock = threading.Lock()
+        self.request_duration = Histogram(
+            'tripstracking_request_duration_seconds', 'Time spent handling a request.', ('endpoint', 'method'), LATENCY_BUCKETS
+        )
+        self.requests = Counter('tripstracking_requests_total', 'Handled requests by response status.', ('endpoint', 'method', 'status'))
+        self.sql_statements = Histogram(
+            'tripstracking_request_sql_statements', 'SQL statements run by a request.', ('endpoint',), STATEMENT_BUCKETS
+        )
+        self.sql_duration = Histogram(
+            'tripstracking_request_sql_duration_seconds', 'Time a request spent executing SQL and fetching rows.', ('endpoint',), LATENCY_BUCKETS
+        )
+        self.upload_bytes = Counter('tripstracking_request_body_bytes_total', 'Bytes of request bodies received, e.g. uploaded photos and imports.', ('endpoint',))
+
+    def observe(self, endpoint, method, status, seconds, upload_bytes, connections):
+        '''Records a request. connections are the database connections it checked out, whose SQL counts are summed up; a request that ran no SQL has none.'''
+        with self._lock:
+            self.request_duration.observe((endpoint, method), seconds)
+            self.requests.inc((endpoint, method, status))
+            if upload_bytes:
+                self.upload_bytes.inc((endpoint,), upload_bytes)
+            if connections:
+                self.sql_statements.observe((endpoint,), sum(db.statements for db in connections))
+                self.sql_duration.observe((endpoint,), sum(db.sql_seconds for db in connections))
+
+    def render(self):
+        '''Returns the metrics in the Prometheus text format, together with the connection pool and user cache statistics the app already keeps.'''
+        with self._lock:
+            lines = []
+            for metric in (self.request_duration, self.requests, self.sql_statements, self.sql_duration, self.upload_bytes):
+                lines.extend(metric.render())
+
+        pool = self.app.extensions['db_pool'].stats()
+        lines.extend(unlabelled('tripstracking_db_pool', 'counter', [
+            ('connections_opened_total', 'Database connections opened by the pool.', pool['misses']),
+            ('checkouts_total', 'Connections checked out of the pool.', pool['checkouts']),
+            ('waits_total', 'Checkouts that waited for a connection to be returned.', pool['waits']),
+            ('timeouts_total', 'Checkouts that timed out waiting for a connection.', pool['timeouts']),
+        ]))
+        lines.extend(unlabelled('tripstracking_db_pool', 'gauge', [
+            ('connections', 'Open database connections.', pool['size']),
+            ('idle_connections', 'Open database connections waiting in the pool.', pool['idle']),
+        ]))
+        cache = self.app.extensions['user_cache'].stats()
+        lines.extend(unlabelled('tripstracking_user_cache', 'counter', [
+            ('hits_total', 'Logged in users loaded from the cache.', cache['hits']),
+            ('misses_total', 'Logged in users loaded from the database.', cache['misses']),
+            ('evictions_total', 'Users evicted from the full cache.', cache['evictions']),
+        ]))
+        return '\n'.join(lines) + '\n'
+
+def unlabelled(prefix, type, values):
+    for name, help, value in values:
+        yield f'# HELP {prefix}_{name} {help}'
+        yield f'# TYPE {prefix}_{name} {type}'
+        yield f'{prefix}_{name} {value}'
+
+def start_timer():
+    g.request_start = time.perf_counter()
+
+def record_request(response):
+    start = g.pop('request_start', None)
+    if start is not None and request.endpoint != 'metrics':
+        get_metrics().observe(
+            request.endpoint or 'unmatched', request.method, response.status_code,
+            time.perf_counter() - start, request.content_length or 0,
+            [db for db in (g.get('db'), g.get('aiodb')) if db is not None]
+        )
+    return response
+
+def metrics_endpoint():
+    return current_app.response_class(get_metrics().render(), content_type=CONTENT_TYPE)
+
+def init_metrics(app):
+    '''Creates the metrics registry of the app, hooks it into every request and adds the /metrics endpoint. Called by create_app before the blueprints are registered, so the request time includes their before and after request functions.'''
+    app.extensions['metrics'] = Metrics(app)
+    app.before_request(start_timer)
+    app.after_request(record_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_endpoint)
+    return app.extensions['metrics']
+
+def get_metrics():
+    return current_app.extensions['metrics']
@@ -0,0 +1,39 @@
+-- Tables as created by the original init-db. IF NOT EXISTS lets databases created before migrations existed adopt this version without losing data.
+
+CREATE TABLE IF NOT EXISTS user (
+    user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    fullname TEXT NOT NULL,
+    username TEXT UNIQUE NOT NULL,
+    password TEXT NOT NULL,
+    email TEXT NOT NULL,
+    created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS trip (
+    trip_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    destination TEXT NOT NULL,
+    date TEXT,
+    description TEXT NOT NULL,
+    budget REAL,
+    user_id INTEGER,
+    created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES user (user_id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS expense (
+    expense_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    trip_id INTEGER,
+    amount REAL NOT NULL,
+    expense_description TEXT,
+    expense_date TEXT,
+    created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (trip_id) REFERENCES trip (trip_id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS photo (
+    photo_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    trip_id INTEGER,
+    file_path TEXT REQUIRED NOT NULL,
+    created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (trip_id) REFERENCES trip (trip_id) ON DELETE CASCADE
+);
@@ -0,0 +1,13 @@
+-- Indexes for the queries in views.py. Each one serves both the WHERE clause and the ORDER BY of its query, so the lookups seek instead of scanning the table and no temporary B-tree is needed for sorting.
+
+-- get_all_trips: WHERE user_id = ? ORDER BY date DESC. Also used by ON DELETE CASCADE from user.
+CREATE INDEX IF NOT EXISTS idx_trip_user_date ON trip (user_id, date DESC, trip_id DESC);
+
+-- get_all_expenses: WHERE trip_id = ? ORDER BY amount DESC. Also used by ON DELETE CASCADE from trip.
+CREATE INDEX IF NOT EXISTS idx_expense_trip_amount ON expense (trip_id, amount DESC, expense_id DESC);
+
+-- ON DELETE CASCADE from trip.
+CREATE INDEX IF NOT EXISTS idx_photo_trip ON photo (trip_id);
+
+-- get_all_photos: ORDER BY created DESC.
+CREATE INDEX IF NOT EXISTS idx_photo_created ON photo (created DESC);
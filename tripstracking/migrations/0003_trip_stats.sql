@@ -0,0 +1,92 @@
+-- Per trip expense aggregates kept up to date by triggers, so reading a trip's spend is a primary key lookup instead of a scan of its expenses.
+-- MIN and MAX cannot be updated incrementally when an expense is removed. They are recomputed with a seek on the expense index led by trip_id and the amount:
+-- idx_expense_trip_amount, idx_expense_trip_amount_date since 0004 and idx_expense_trip_base_amount_id since 0010.
+
+CREATE TABLE IF NOT EXISTS trip_stats (
+    trip_id INTEGER PRIMARY KEY,
+    expense_count INTEGER NOT NULL DEFAULT 0,
+    expense_total REAL NOT NULL DEFAULT 0,
+    expense_min REAL,
+    expense_max REAL,
+    remaining_budget REAL,
+    FOREIGN KEY (trip_id) REFERENCES trip (trip_id) ON DELETE CASCADE
+);
+
+CREATE TRIGGER IF NOT EXISTS trip_stats_trip_insert AFTER INSERT ON trip
+BEGIN
+    INSERT OR IGNORE INTO trip_stats (trip_id, remaining_budget) VALUES (NEW.trip_id, NEW.budget);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trip_stats_trip_budget AFTER UPDATE OF budget ON trip
+BEGIN
+    UPDATE trip_stats SET remaining_budget = NEW.budget - expense_total WHERE trip_id = NEW.trip_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trip_stats_trip_delete AFTER DELETE ON trip
+BEGIN
+    DELETE FROM trip_stats WHERE trip_id = OLD.trip_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trip_stats_expense_insert AFTER INSERT ON expense
+WHEN NEW.trip_id IS NOT NULL
+BEGIN
+    INSERT INTO trip_stats (trip_id, expense_count, expense_total, expense_min, expense_max, remaining_budget)
+    VALUES (NEW.trip_id, 1, NEW.amount, NEW.amount, NEW.amount, (SELECT budget FROM trip WHERE trip_id = NEW.trip_id) - NEW.amount)
+    ON CONFLICT (trip_id) DO UPDATE SET
+        expense_count = expense_count + 1,
+        expense_total = expense_total + NEW.amount,
+        expense_min = MIN(COALESCE(expense_min, NEW.amount), NEW.amount),
+        expense_max = MAX(COALESCE(expense_max, NEW.amount), NEW.amount),
+        remaining_budget = remaining_budget - NEW.amount;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trip_stats_expense_delete AFTER DELETE ON expense
+WHEN OLD.trip_id IS NOT NULL
+BEGIN
+    UPDATE trip_stats SET
+        expense_count = expense_count - 1,
+        expense_total = expense_total - OLD.amount,
+        expense_min = (SELECT MIN(amount) FROM expense WHERE trip_id = OLD.trip_id),
+        expense_max = (SELECT MAX(amount) FROM expense WHERE trip_id = OLD.trip_id),
+        remaining_budget = remaining_budget + OLD.amount
+    WHERE trip_id = OLD.trip_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trip_stats_expense_update AFTER UPDATE OF amount, trip_id ON expense
+WHEN OLD.trip_id IS NEW.trip_id AND NEW.trip_id IS NOT NULL
+BEGIN
+    UPDATE trip_stats SET
+        expense_total = expense_total - OLD.amount + NEW.amount,
+        expense_min = (SELECT MIN(amount) FROM expense WHERE trip_id = NEW.trip_id),
+        expense_max = (SELECT MAX(amount) FROM expense WHERE trip_id = NEW.trip_id),
+        remaining_budget = remaining_budget + OLD.amount - NEW.amount
+    WHERE trip_id = NEW.trip_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trip_stats_expense_move AFTER UPDATE OF trip_id ON expense
+WHEN OLD.trip_id IS NOT NEW.trip_id
+BEGIN
+    UPDATE trip_stats SET
+        expense_count = expense_count - 1,
+        expense_total = expense_total - OLD.amount,
+        expense_min = (SELECT MIN(amount) FROM expense WHERE trip_id = OLD.trip_id),
+        expense_max = (SELECT MAX(amount) FROM expense WHERE trip_id = OLD.trip_id),
+        remaining_budget = remaining_budget + OLD.amount
+    WHERE trip_id = OLD.trip_id;
+
+    INSERT INTO trip_stats (trip_id, expense_count, expense_total, expense_min, expense_max, remaining_budget)
+    SELECT NEW.trip_id, 1, NEW.amount, NEW.amount, NEW.amount, (SELECT budget FROM trip WHERE trip_id = NEW.trip_id) - NEW.amount
+    WHERE NEW.trip_id IS NOT NULL
+    ON CONFLICT (trip_id) DO UPDATE SET
+        expense_count = expense_count + 1,
+        expense_total = expense_total + NEW.amount,
+        expense_min = MIN(COALESCE(expense_min, NEW.amount), NEW.amount),
+        expense_max = MAX(COALESCE(expense_max, NEW.amount), NEW.amount),
+        remaining_budget = remaining_budget - NEW.amount;
+END;
+
+-- Fill the table for the trips and expenses that existed before this migration.
+INSERT OR REPLACE INTO trip_stats (trip_id, expense_count, expense_total, expense_min, expense_max, remaining_budget)
+SELECT trip.trip_id, COUNT(expense.expense_id), COALESCE(SUM(expense.amount), 0), MIN(expense.amount), MAX(expense.amount), trip.budget - COALESCE(SUM(expense.amount), 0)
+FROM trip LEFT JOIN expense ON expense.trip_id = trip.trip_id
+GROUP BY trip.trip_id;
@@ -0,0 +1,5 @@
+-- Adds expense_date to the expense listing index, so the spending analytics query reads amount, trip_id and expense_date from the index alone instead of looking up every expense row in the table.
+-- The leading (trip_id, amount DESC, expense_id DESC) columns are unchanged, so get_all_expenses keeps seeking on it.
+
+DROP INDEX IF EXISTS idx_expense_trip_amount;
+CREATE INDEX IF NOT EXISTS idx_expense_trip_amount_date ON expense (trip_id, amount DESC, expense_id DESC, expense_date);
@@ -0,0 +1,43 @@
+-- Change versions used as HTTP validators (ETag and Last-Modified) by the GET endpoints.
+-- trip.data_version changes on every write to the trip or its expenses. user.data_version changes on every write to any of the user's trips or expenses.
+-- They are bumped by triggers, so every write path, including bulk imports, is covered.
+
+ALTER TABLE user ADD COLUMN data_version INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE user ADD COLUMN data_modified TIMESTAMP;
+ALTER TABLE trip ADD COLUMN data_version INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE trip ADD COLUMN data_modified TIMESTAMP;
+
+CREATE TRIGGER IF NOT EXISTS version_trip_insert AFTER INSERT ON trip
+BEGIN
+    UPDATE trip SET data_version = data_version + 1, data_modified = CURRENT_TIMESTAMP WHERE trip_id = NEW.trip_id;
+    UPDATE user SET data_version = data_version + 1, data_modified = CURRENT_TIMESTAMP WHERE user_id = NEW.user_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS version_trip_update AFTER UPDATE OF destination, date, description, budget, user_id ON trip
+BEGIN
+    UPDATE trip SET data_version = data_version + 1, data_modified = CURRENT_TIMESTAMP WHERE trip_id = NEW.trip_id;
+    UPDATE user SET data_version = data_version + 1, data_modified = CURRENT_TIMESTAMP WHERE user_id IN (OLD.user_id, NEW.user_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS version_trip_delete AFTER DELETE ON trip
+BEGIN
+    UPDATE user SET data_version = data_version + 1, data_modified = CURRENT_TIMESTAMP WHERE user_id = OLD.user_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS version_expense_insert AFTER INSERT ON expense
+BEGIN
+    UPDATE trip SET data_version = data_version + 1, data_modified = CURRENT_TIMESTAMP WHERE trip_id = NEW.trip_id;
+    UPDATE user SET data_version = data_version + 1, data_modified = CURRENT_TIMESTAMP WHERE user_id = (SELECT user_id FROM trip WHERE trip_id = NEW.trip_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS version_expense_update AFTER UPDATE ON expense
+BEGIN
+    UPDATE trip SET data_version = data_version + 1, data_modified = CURRENT_TIMESTAMP WHERE trip_id IN (OLD.trip_id, NEW.trip_id);
+    UPDATE user SET data_version = data_version + 1, data_modified = CURRENT_TIMESTAMP WHERE user_id IN (SELECT user_id FROM trip WHERE trip_id IN (OLD.trip_id, NEW.trip_id));
+END;
+
+CREATE TRIGGER IF NOT EXISTS version_expense_delete AFTER DELETE ON expense
+BEGIN
+    UPDATE trip SET data_version = data_version + 1, data_modified = CURRENT_TIMESTAMP WHERE trip_id = OLD.trip_id;
+    UPDATE user SET data_version = data_version + 1, data_modified = CURRENT_TIMESTAMP WHERE user_id = (SELECT user_id FROM trip WHERE trip_id = OLD.trip_id);
+END;
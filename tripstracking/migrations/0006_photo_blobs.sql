@@ -0,0 +1,31 @@
+-- Content addressed photo storage. Every distinct file is stored once as a blob named by its SHA-256 hash, and photo rows point to it.
+-- ref_count is kept up to date by triggers on photo, so delete_photo knows when the last photo using a blob is gone and its file can be removed.
+
+CREATE TABLE IF NOT EXISTS photo_blob (
+    blob_hash TEXT PRIMARY KEY,
+    file_path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    ref_count INTEGER NOT NULL DEFAULT 0,
+    created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+ALTER TABLE photo ADD COLUMN blob_hash TEXT REFERENCES photo_blob (blob_hash);
+ALTER TABLE photo ADD COLUMN user_id INTEGER REFERENCES user (user_id) ON DELETE CASCADE;
+
+-- Photos uploaded before this migration belong to the user of their trip.
+UPDATE photo SET user_id = (SELECT trip.user_id FROM trip WHERE trip.trip_id = photo.trip_id) WHERE user_id IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_photo_blob ON photo (blob_hash);
+CREATE INDEX IF NOT EXISTS idx_photo_user_created ON photo (user_id, created DESC);
+
+CREATE TRIGGER IF NOT EXISTS photo_blob_ref_insert AFTER INSERT ON photo
+WHEN NEW.blob_hash IS NOT NULL
+BEGIN
+    UPDATE photo_blob SET ref_count = ref_count + 1 WHERE blob_hash = NEW.blob_hash;
+END;
+
+CREATE TRIGGER IF NOT EXISTS photo_blob_ref_delete AFTER DELETE ON photo
+WHEN OLD.blob_hash IS NOT NULL
+BEGIN
+    UPDATE photo_blob SET ref_count = ref_count - 1 WHERE blob_hash = OLD.blob_hash;
+END;
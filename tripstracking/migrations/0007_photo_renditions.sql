@@ -0,0 +1,12 @@
+-- Resized renditions of the stored photos, generated in the background after upload. They belong to the blob, so photos sharing a blob share its renditions.
+-- photo_blob.rendered is set once the renditions of a blob were generated, including blobs too small to need any, so the backfill does not process them again.
+
+CREATE TABLE IF NOT EXISTS photo_rendition (
+    blob_hash TEXT NOT NULL,
+    width INTEGER NOT NULL,
+    file_path TEXT NOT NULL,
+    PRIMARY KEY (blob_hash, width),
+    FOREIGN KEY (blob_hash) REFERENCES photo_blob (blob_hash) ON DELETE CASCADE
+);
+
+ALTER TABLE photo_blob ADD COLUMN rendered TIMESTAMP;
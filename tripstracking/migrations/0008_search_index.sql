@@ -0,0 +1,61 @@
+-- Full-text index over trips and expenses, used by the /search endpoint.
+-- Trips are stored under rowid -trip_id and expenses under rowid expense_id, so the triggers update a single row by rowid.
+-- owner holds the token u<user_id>, so a search is the intersection of the user's posting list with the terms and never filters other users' rows after the match.
+-- Expense rows repeat the destination of their trip, so "dinner lisbon" finds the dinner expense of the Lisbon trip.
+
+CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+    owner,
+    destination,
+    description,
+    kind UNINDEXED,
+    trip_id UNINDEXED,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+);
+
+-- Ranks matches on the destination twice as high as matches on the description; owner never contributes.
+INSERT INTO search_index (search_index, rank) VALUES ('rank', 'bm25(0.0, 2.0, 1.0)');
+
+CREATE TRIGGER IF NOT EXISTS search_trip_insert AFTER INSERT ON trip
+BEGIN
+    INSERT INTO search_index (rowid, owner, destination, description, kind, trip_id)
+    VALUES (-NEW.trip_id, 'u' || NEW.user_id, NEW.destination, NEW.description, 'trip', NEW.trip_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS search_trip_update AFTER UPDATE OF destination, description, user_id ON trip
+BEGIN
+    UPDATE search_index SET owner = 'u' || NEW.user_id, destination = NEW.destination, description = NEW.description
+    WHERE rowid = -NEW.trip_id;
+    UPDATE search_index SET owner = 'u' || NEW.user_id, destination = NEW.destination
+    WHERE rowid IN (SELECT expense_id FROM expense WHERE trip_id = NEW.trip_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS search_trip_delete AFTER DELETE ON trip
+BEGIN
+    DELETE FROM search_index WHERE rowid = -OLD.trip_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS search_expense_insert AFTER INSERT ON expense
+BEGIN
+    INSERT INTO search_index (rowid, owner, destination, description, kind, trip_id)
+    SELECT NEW.expense_id, 'u' || user_id, destination, NEW.expense_description, 'expense', trip_id FROM trip WHERE trip_id = NEW.trip_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS search_expense_update AFTER UPDATE OF expense_description, trip_id ON expense
+BEGIN
+    DELETE FROM search_index WHERE rowid = OLD.expense_id;
+    INSERT INTO search_index (rowid, owner, destination, description, kind, trip_id)
+    SELECT NEW.expense_id, 'u' || user_id, destination, NEW.expense_description, 'expense', trip_id FROM trip WHERE trip_id = NEW.trip_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS search_expense_delete AFTER DELETE ON expense
+BEGIN
+    DELETE FROM search_index WHERE rowid = OLD.expense_id;
+END;
+
+INSERT INTO search_index (rowid, owner, destination, description, kind, trip_id)
+SELECT -trip_id, 'u' || user_id, destination, description, 'trip', trip_id FROM trip;
+
+INSERT INTO search_index (rowid, owner, destination, description, kind, trip_id)
+SELECT expense.expense_id, 'u' || trip.user_id, trip.destination, expense.expense_description, 'expense', trip.trip_id
+FROM expense JOIN trip ON trip.trip_id = expense.trip_id;
@@ -0,0 +1,95 @@
+-- Multi-currency expenses. Every expense keeps the amount and currency it was entered in, and base_amount, its amount in the base currency (EUR).
+-- base_amount is computed by the app when the expense is written, with the rates of the exchange_rate version stored in rate_version.
+-- Rates are versioned: loading new rates adds a version, and flask renormalize recomputes the base amounts of the expenses of older versions.
+-- trip_stats now sums base_amount, so totals and remaining budgets stay in the base currency.
+
+CREATE TABLE IF NOT EXISTS exchange_rate (
+    version INTEGER NOT NULL,
+    currency TEXT NOT NULL,
+    rate REAL NOT NULL,
+    created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (version, currency)
+);
+
+INSERT OR IGNORE INTO exchange_rate (version, currency, rate) VALUES (1, 'EUR', 1.0);
+
+ALTER TABLE expense ADD COLUMN currency TEXT NOT NULL DEFAULT 'EUR';
+ALTER TABLE expense ADD COLUMN base_amount REAL;
+ALTER TABLE expense ADD COLUMN rate_version INTEGER;
+
+-- version_expense_update would bump the change versions of every trip and user once per backfilled row, so it is dropped for the backfill and recreated as 0005 defines it.
+DROP TRIGGER IF EXISTS version_expense_update;
+
+UPDATE expense SET base_amount = amount, rate_version = 1;
+
+CREATE TRIGGER IF NOT EXISTS version_expense_update AFTER UPDATE ON expense
+BEGIN
+    UPDATE trip SET data_version = data_version + 1, data_modified = CURRENT_TIMESTAMP WHERE trip_id IN (OLD.trip_id, NEW.trip_id);
+    UPDATE user SET data_version = data_version + 1, data_modified = CURRENT_TIMESTAMP WHERE user_id IN (SELECT user_id FROM trip WHERE trip_id IN (OLD.trip_id, NEW.trip_id));
+END;
+
+-- Serves the MIN/MAX seeks of the trip_stats triggers and covers the columns the spending analytics read.
+CREATE INDEX IF NOT EXISTS idx_expense_trip_base_amount ON expense (trip_id, base_amount, expense_date);
+
+DROP TRIGGER IF EXISTS trip_stats_expense_insert;
+DROP TRIGGER IF EXISTS trip_stats_expense_delete;
+DROP TRIGGER IF EXISTS trip_stats_expense_update;
+DROP TRIGGER IF EXISTS trip_stats_expense_move;
+
+CREATE TRIGGER IF NOT EXISTS trip_stats_expense_insert AFTER INSERT ON expense
+WHEN NEW.trip_id IS NOT NULL
+BEGIN
+    INSERT INTO trip_stats (trip_id, expense_count, expense_total, expense_min, expense_max, remaining_budget)
+    VALUES (NEW.trip_id, 1, NEW.base_amount, NEW.base_amount, NEW.base_amount, (SELECT budget FROM trip WHERE trip_id = NEW.trip_id) - NEW.base_amount)
+    ON CONFLICT (trip_id) DO UPDATE SET
+        expense_count = expense_count + 1,
+        expense_total = expense_total + NEW.base_amount,
+        expense_min = MIN(COALESCE(expense_min, NEW.base_amount), NEW.base_amount),
+        expense_max = MAX(COALESCE(expense_max, NEW.base_amount), NEW.base_amount),
+        remaining_budget = remaining_budget - NEW.base_amount;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trip_stats_expense_delete AFTER DELETE ON expense
+WHEN OLD.trip_id IS NOT NULL
+BEGIN
+    UPDATE trip_stats SET
+        expense_count = expense_count - 1,
+        expense_total = expense_total - OLD.base_amount,
+        expense_min = (SELECT MIN(base_amount) FROM expense WHERE trip_id = OLD.trip_id),
+        expense_max = (SELECT MAX(base_amount) FROM expense WHERE trip_id = OLD.trip_id),
+        remaining_budget = remaining_budget + OLD.base_amount
+    WHERE trip_id = OLD.trip_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trip_stats_expense_update AFTER UPDATE OF base_amount, trip_id ON expense
+WHEN OLD.trip_id IS NEW.trip_id AND NEW.trip_id IS NOT NULL
+BEGIN
+    UPDATE trip_stats SET
+        expense_total = expense_total - OLD.base_amount + NEW.base_amount,
+        expense_min = (SELECT MIN(base_amount) FROM expense WHERE trip_id = NEW.trip_id),
+        expense_max = (SELECT MAX(base_amount) FROM expense WHERE trip_id = NEW.trip_id),
+        remaining_budget = remaining_budget + OLD.base_amount - NEW.base_amount
+    WHERE trip_id = NEW.trip_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trip_stats_expense_move AFTER UPDATE OF trip_id ON expense
+WHEN OLD.trip_id IS NOT NEW.trip_id
+BEGIN
+    UPDATE trip_stats SET
+        expense_count = expense_count - 1,
+        expense_total = expense_total - OLD.base_amount,
+        expense_min = (SELECT MIN(base_amount) FROM expense WHERE trip_id = OLD.trip_id),
+        expense_max = (SELECT MAX(base_amount) FROM expense WHERE trip_id = OLD.trip_id),
+        remaining_budget = remaining_budget + OLD.base_amount
+    WHERE trip_id = OLD.trip_id;
+
+    INSERT INTO trip_stats (trip_id, expense_count, expense_total, expense_min, expense_max, remaining_budget)
+    SELECT NEW.trip_id, 1, NEW.base_amount, NEW.base_amount, NEW.base_amount, (SELECT budget FROM trip WHERE trip_id = NEW.trip_id) - NEW.base_amount
+    WHERE NEW.trip_id IS NOT NULL
+    ON CONFLICT (trip_id) DO UPDATE SET
+        expense_count = expense_count + 1,
+        expense_total = expense_total + NEW.base_amount,
+        expense_min = MIN(COALESCE(expense_min, NEW.base_amount), NEW.base_amount),
+        expense_max = MAX(COALESCE(expense_max, NEW.base_amount), NEW.base_amount),
+        remaining_budget = remaining_budget - NEW.base_amount;
+END;
@@ -0,0 +1,6 @@
+-- get_all_expenses lists the expenses of a trip by base_amount, so amounts in different currencies are ordered by what they are worth.
+-- Its keyset seek needs (trip_id, base_amount DESC, expense_id DESC) as the leading columns. The same index serves the MIN/MAX seeks of the trip_stats triggers and covers the columns the spending analytics read, so it replaces both expense amount indexes.
+
+DROP INDEX IF EXISTS idx_expense_trip_amount_date;
+DROP INDEX IF EXISTS idx_expense_trip_base_amount;
+CREATE INDEX IF NOT EXISTS idx_expense_trip_base_amount_id ON expense (trip_id, base_amount DESC, expense_id DESC, expense_date);
@@ -0,0 +1,44 @@
+import base64
+import json
+from flask import current_app, request
+
+def encode_cursor(*key):
+    '''Returns an opaque cursor for the (sort key, id) tuple of the last row of a page. The client sends it back as the after parameter to get the next page.'''
+    raw = json.dumps(key, separators=(',', ':')).encode('utf8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor, size):
+    '''Returns the key tuple stored in a cursor made by encode_cursor. Raises ValueError if the cursor was not made by encode_cursor or does not hold a key of the expected size.'''
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        key = json.loads(raw.decode('utf8'))
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(key, list) or len(key) != size:
+        raise ValueError("Invalid cursor")
+    return key
+
+def page_args(key_size=2):
+    '''Reads the limit and after query parameters of a listing request. Returns the page size, capped at MAX_PAGE_SIZE, and the decoded key of the cursor or None for the first page. Raises ValueError for invalid values.'''
+    limit = request.args.get('limit', current_app.config['PAGE_SIZE'])
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise ValueError("limit must be a number")
+    if limit < 1:
+        raise ValueError("limit must be at least 1")
+    limit = min(limit, current_app.config['MAX_PAGE_SIZE'])
+
+    after = request.args.get('after')
+    if after:
+        after = decode_cursor(after, key_size)
+    else:
+        after = None
+    return limit, after
+
+def next_cursor(rows, limit, key):
+    '''Returns the cursor of the next page, or None if this is the last one. The queries fetch limit + 1 rows, so an extra row means there is another page. The extra row is removed from rows.'''
+    if len(rows) <= limit:
+        return None
+    del rows[limit:]
+    return encode_cursor(*key(rows[-1]))
@@ -0,0 +1,94 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+class HasherBusy(Exception):
+    '''Raised when PASSWORD_HASH_QUEUE passwords are already being hashed or waiting, so the request can fail fast with a 503 instead of queueing behind them. Also raised when a password was not hashed within PASSWORD_HASH_TIMEOUT seconds.'''
+
+def hash_method(pwhash):
+    '''Returns the method and cost part of a werkzeug password hash, e.g. scrypt:32768:8:1 or pbkdf2:sha256:600000.'''
+    return pwhash.split('$', 1)[0]
+
+class PasswordHasher:
+    '''Hashes and checks passwords in a small bounded pool of threads, so a burst of logins can only keep PASSWORD_HASH_WORKERS cores busy and never every worker of the app. hashlib releases the GIL while it runs scrypt and PBKDF2, so the threads run in parallel with the requests. At most PASSWORD_HASH_QUEUE passwords are hashed or waiting at a time; beyond that HasherBusy is raised right away.
+    '''
+    def __init__(self, app):
+        self.app = app
+        self._executor = None
+        self._lock = threading.Lock()
+        self._slots = None
+        self._method = None
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.app.config['PASSWORD_HASH_WORKERS'], thread_name_prefix='password-hash')
+            return self._executor
+
+    def _get_slots(self):
+        '''Creates the semaphore bounding the queue on first use, so PASSWORD_HASH_QUEUE can still be changed after create_app, like the other settings.'''
+        with self._lock:
+            if self._slots is None:
+                self._slots = threading.BoundedSemaphore(self.app.config['PASSWORD_HASH_QUEUE'])
+            return self._slots
+
+    def _submit(self, function, *arguments):
+        if not self._get_slots().acquire(blocking=False):
+            raise HasherBusy()
+        try:
+            future = self._get_executor().submit(function, *arguments)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda future: self._slots.release())
+        return future
+
+    def _run(self, function, *arguments):
+        future = self._submit(function, *arguments)
+        try:
+            return future.result(timeout=self.app.config['PASSWORD_HASH_TIMEOUT'])
+        except TimeoutError:
+            raise HasherBusy()
+
+    async def _run_async(self, function, *arguments):
+        '''Like _run, but awaits the hash instead of blocking the thread, for the async views.'''
+        future = asyncio.wrap_future(self._submit(function, *arguments))
+        try:
+            return await asyncio.wait_for(future, self.app.config['PASSWORD_HASH_TIMEOUT'])
+        except asyncio.TimeoutError:
+            raise HasherBusy()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.app.config['PASSWORD_METHOD'])
+
+    def check(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    async def hash_async(self, password):
+        return await self._run_async(generate_password_hash, password, self.app.config['PASSWORD_METHOD'])
+
+    async def check_async(self, pwhash, password):
+        return await self._run_async(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        '''Tells whether a stored hash was made with another method or cost than PASSWORD_METHOD. A method given without its cost, like scrypt, is expanded to werkzeug's defaults by hashing an empty password once.'''
+        method = self.app.config['PASSWORD_METHOD']
+        if self._method is None or self._method[0] != method:
+            self._method = (method, hash_method(generate_password_hash('', method)))
+        return hash_method(pwhash) != self._method[1]
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+def init_password_hasher(app):
+    '''Creates the password hasher of the app. Called by create_app.'''
+    app.extensions['password_hasher'] = PasswordHasher(app)
+    return app.extensions['password_hasher']
+
+def get_password_hasher():
+    return current_app.extensions['password_hasher']
@@ -0,0 +1,139 @@
+import hashlib
+import os
+import sqlite3
+import uuid
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from .db import open_db
+
+def blob_path(blob_hash, extension):
+    '''Returns the path of a blob relative to the upload folder. Blobs are sharded into two levels of directories named after the first four hex digits of their hash, so no directory grows too large.'''
+    return os.path.join(blob_hash[:2], blob_hash[2:4], f"{blob_hash}.{extension}")
+
+def write_temporary(stream, upload_folder, chunk_size):
+    '''Copies an upload stream to a temporary file in the upload folder chunk by chunk, computing its SHA-256 hash on the way, so the file is never held in memory and is read only once. Returns the hash, the temporary path and the size.'''
+    folder = os.path.join(upload_folder, 'tmp')
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, uuid.uuid4().hex)
+    digest = hashlib.sha256()
+    size = 0
+
+    try:
+        with open(path, 'wb') as f:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+    except Exception:
+        remove_file(path)
+        raise
+    return digest.hexdigest(), path, size
+
+def remove_file(path):
+    '''Removes a file, if it still exists.'''
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def move_into_place(temporary, upload_folder, file_path):
+    '''Moves the temporary file of an upload to the path of its new blob.'''
+    destination = os.path.join(upload_folder, file_path)
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    os.replace(temporary, destination)
+
+BLOB_SELECT = 'SELECT file_path FROM photo_blob WHERE blob_hash = ?'
+BLOB_INSERT = 'INSERT INTO photo_blob (blob_hash, file_path, size) VALUES (?, ?, ?)'
+PHOTO_INSERT = 'INSERT INTO photo (trip_id, user_id, file_path, blob_hash) VALUES (?, ?, ?, ?)'
+
+def save_photo(db, file, extension, trip_id, user_id, upload_folder, chunk_size):
+    '''Stores an uploaded photo and returns the new photo row id, the hash and path of its blob and whether the blob is new. When a blob with the same content already exists only a new photo row pointing to it is inserted. The write lock is taken with BEGIN IMMEDIATE before the blob is looked up and held until the file is in place, so a concurrent delete_photo cannot remove a blob this upload is about to reuse.'''
+    blob_hash, temporary, size = write_temporary(file.stream, upload_folder, chunk_size)
+
+    try:
+        db.execute('BEGIN IMMEDIATE')
+        blob = db.execute(BLOB_SELECT, (blob_hash,)).fetchone()
+
+        new_blob = blob is None
+        if new_blob:
+            file_path = blob_path(blob_hash, extension)
+            move_into_place(temporary, upload_folder, file_path)
+            db.execute(BLOB_INSERT, (blob_hash, file_path, size))
+        else:
+            file_path = blob['file_path']
+
+        photo = db.execute(PHOTO_INSERT, (trip_id, user_id, file_path, blob_hash))
+        db.commit()
+    except (sqlite3.Error, OSError):
+        if db.in_transaction:
+            db.rollback()
+        raise
+    finally:
+        remove_file(temporary)
+    return photo.lastrowid, blob_hash, file_path, new_blob
+
+def delete_photo(db, photo_id, user_id, upload_folder):
+    '''Deletes a photo of the user and, when it was the last photo using its blob, the blob and its file. The file is removed before the transaction commits, while the write lock is held, so an upload of the same content waits and then stores the file again. Returns False if the user has no such photo.'''
+    try:
+        db.execute('BEGIN IMMEDIATE')
+        photo = db.execute(
+            'SELECT blob_hash FROM photo WHERE photo_id = ? AND user_id = ?', (photo_id, user_id)
+        ).fetchone()
+        if photo is None:
+            db.rollback()
+            return False
+
+        db.execute('DELETE FROM photo WHERE photo_id = ?', (photo_id,))
+        if photo['blob_hash'] is not None:
+            remove_unused_blob(db, photo['blob_hash'], upload_folder)
+        db.commit()
+    except (sqlite3.Error, OSError):
+        if db.in_transaction:
+            db.rollback()
+        raise
+    return True
+
+def remove_unused_blob(db, blob_hash, upload_folder):
+    '''Deletes a blob row and its files, including its renditions, if no photo refers to it any more. Must run inside a write transaction.'''
+    blob = db.execute(
+        'SELECT file_path FROM photo_blob WHERE blob_hash = ? AND ref_count <= 0', (blob_hash,)
+    ).fetchone()
+    if blob is None:
+        return False
+    renditions = db.execute(
+        'SELECT file_path FROM photo_rendition WHERE blob_hash = ?', (blob_hash,)
+    ).fetchall()
+    db.execute('DELETE FROM photo_blob WHERE blob_hash = ?', (blob_hash,))
+    for rendition in renditions:
+        remove_file(os.path.join(upload_folder, rendition['file_path']))
+    remove_file(os.path.join(upload_folder, blob['file_path']))
+    return True
+
+def collect_garbage(db, upload_folder):
+    '''Removes every blob that lost its last photo without going through delete_photo, e.g. when a trip or a user was deleted and their photos were removed by ON DELETE CASCADE. Returns the number of blobs removed.'''
+    removed = 0
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        unused = db.execute('SELECT blob_hash FROM photo_blob WHERE ref_count <= 0').fetchall()
+        for blob in unused:
+            if remove_unused_blob(db, blob['blob_hash'], upload_folder):
+                removed += 1
+        db.commit()
+    except (sqlite3.Error, OSError):
+        db.rollback()
+        raise
+    return removed
+
+@click.command('gc-photos')
+@with_appcontext
+def gc_photos_command():
+    '''Removes the stored photo files that no photo refers to any more. Run the command after deleting trips or users:
+
+    flask --app trips.py gc-photos
+    '''
+    removed = collect_garbage(open_db(), current_app.config['UPLOAD_FOLDER'])
+    click.echo(f'Removed {removed} unused photo files!')
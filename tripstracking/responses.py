@@ -0,0 +1,14 @@
+from flask import request, jsonify, redirect, url_for, flash
+
+def request_data(json_response):
+    '''Returns the JSON body of a request that asked for JSON, else its form data.'''
+    if json_response:
+        return request.get_json()
+    return request.form
+
+def error_response(json_response, message, status, endpoint, **values):
+    '''Returns the error message as JSON with status, or flashes it and redirects the browser to endpoint, built with values.'''
+    if json_response:
+        return jsonify({"error": message}), status
+    flash(message)
+    return redirect(url_for(endpoint, **values))
@@ -0,0 +1,83 @@
+import re
+import click
+from flask.cli import with_appcontext
+from markupsafe import escape, Markup
+from .db import open_db
+
+TERM = re.compile(r'\w+', re.UNICODE)
+
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_END = '\x03'
+'''Markers highlight() puts around the matched terms. They cannot appear in typed text, so the snippet can be HTML escaped first and the markers turned into <mark> tags afterwards.'''
+
+SEARCH_SELECT = (
+    'SELECT search_index.rowid, search_index.kind, search_index.trip_id, search_index.destination, search_index.description, '
+    f"highlight(search_index, 1, '{HIGHLIGHT_START}', '{HIGHLIGHT_END}') AS destination_highlight, "
+    f"highlight(search_index, 2, '{HIGHLIGHT_START}', '{HIGHLIGHT_END}') AS description_highlight, "
+    'search_index.rank FROM search_index WHERE search_index MATCH ? ORDER BY search_index.rank LIMIT ?'
+)
+'''Selects the best ranked matches of an FTS5 query. rank is the bm25() ranking configured by migration 0008, so ORDER BY rank LIMIT lets FTS5 return the top results without sorting the rest.'''
+
+def match_query(q, user_id, operator):
+    '''Turns free text like "that dinner in Lisbon" into an FTS5 query of the user's rows. Every word is quoted, so the FTS5 syntax characters users may type are taken literally, and the last word is matched as a prefix, so results show up while the word is being typed. Returns None if the text has no words.'''
+    terms = [f'"{term}"' for term in TERM.findall(q.lower())]
+    if not terms:
+        return None
+    terms[-1] += '*'
+    return f'owner:"u{user_id}" AND ({f" {operator} ".join(terms)})'
+
+def highlight(text):
+    '''Returns the highlight() output of a column as Markup, with the matched terms in <mark> tags. A NULL column, like an expense without description, gives an empty string.'''
+    if text is None:
+        return Markup('')
+    return Markup(str(escape(text)).replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_END, '</mark>'))
+
+def search(db, user_id, q, limit):
+    '''Returns up to limit trips and expenses of the user matching q, best first. destination and description are the raw column values; only the highlights are HTML, as Markup. Rows containing every word are searched first; when there are none, rows containing any of the words are returned instead, ranked by how well they match, so filler words in the query do not hide results.'''
+    results = []
+    for operator in ('AND', 'OR'):
+        query = match_query(q, user_id, operator)
+        if query is None:
+            return results
+        rows = db.execute(SEARCH_SELECT, (query, limit)).fetchall()
+        if rows:
+            break
+
+    for row in rows:
+        results.append({
+            "kind": row["kind"],
+            "trip_id": row["trip_id"],
+            "expense_id": row["rowid"] if row["kind"] == 'expense' else None,
+            "destination": row["destination"],
+            "description": row["description"],
+            "destination_highlight": highlight(row["destination_highlight"]),
+            "description_highlight": highlight(row["description_highlight"]),
+            "rank": row["rank"]
+        })
+    return results
+
+def rebuild_search_index(db):
+    '''Rebuilds the search index from the trip and expense tables and merges its b-trees, for when it got out of sync, e.g. after editing the database by hand with the triggers dropped. Returns the number of indexed rows.'''
+    db.execute('DELETE FROM search_index')
+    db.execute(
+        "INSERT INTO search_index (rowid, owner, destination, description, kind, trip_id) "
+        "SELECT -trip_id, 'u' || user_id, destination, description, 'trip', trip_id FROM trip"
+    )
+    db.execute(
+        "INSERT INTO search_index (rowid, owner, destination, description, kind, trip_id) "
+        "SELECT expense.expense_id, 'u' || trip.user_id, trip.destination, expense.expense_description, 'expense', trip.trip_id "
+        "FROM expense JOIN trip ON trip.trip_id = expense.trip_id"
+    )
+    db.execute("INSERT INTO search_index (search_index) VALUES ('optimize')")
+    db.commit()
+    return db.execute('SELECT COUNT(*) FROM search_index').fetchone()[0]
+
+@click.command('rebuild-search')
+@with_appcontext
+def rebuild_search_command():
+    '''Rebuilds the full-text search index of trips and expenses. Run the command:
+
+    flask --app trips.py rebuild-search
+    '''
+    count = rebuild_search_index(open_db())
+    click.echo(f'Indexed {count} trips and expenses!')
@@ -0,0 +1,190 @@
+import hashlib
+import random
+import sqlite3
+from datetime import date, timedelta
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from .db import open_db, connection_pragmas
+from .currency import get_exchange_rates
+from .passwords import get_password_hasher
+from .photos import blob_path
+
+CITIES = [
+    'Paris', 'London', 'Rome', 'Barcelona', 'Lisbon', 'Amsterdam', 'Berlin', 'Prague', 'Vienna', 'Athens',
+    'Madrid', 'Budapest', 'Dublin', 'Copenhagen', 'Florence', 'Venice', 'New York', 'Tokyo', 'Istanbul', 'Porto',
+    'Edinburgh', 'Krakow', 'Seville', 'Kyoto', 'Reykjavik', 'Thessaloniki', 'Bruges', 'Dubrovnik', 'Marrakesh', 'Tallinn'
+]
+'''Destinations of the seeded trips, most popular first. They are drawn with Zipf weights, so a few cities get most of the trips like in real data.'''
+
+TRIP_KINDS = ['City break in', 'Holiday in', 'Business trip to', 'Weekend in', 'Family visit to', 'Conference in', 'Road trip to']
+
+EXPENSES = [
+    ('Coffee', 1.2, 0.4, 20),
+    ('Lunch', 2.7, 0.5, 15),
+    ('Dinner', 3.4, 0.6, 12),
+    ('Groceries', 3.0, 0.7, 8),
+    ('Taxi', 2.8, 0.6, 8),
+    ('Metro tickets', 1.5, 0.5, 8),
+    ('Museum tickets', 2.6, 0.5, 6),
+    ('Souvenirs', 2.9, 0.9, 5),
+    ('Hotel', 4.8, 0.6, 5),
+    ('Train', 3.8, 0.7, 4),
+    ('Flight', 5.2, 0.6, 2),
+    ('Car rental', 4.9, 0.5, 1),
+]
+'''(description, mu, sigma, weight) of the seeded expenses. Amounts are log-normal with the mu and sigma of their kind, so most expenses are small and a few are large, and cheap kinds are the most frequent.'''
+
+FIRST_DATE = date(2019, 1, 1)
+DATE_RANGE = 6 * 365
+'''Trips start within six years from FIRST_DATE. The dates are fixed instead of relative to today, so a seed always produces the same database.'''
+
+RELAXED_PRAGMAS = [
+    'PRAGMA journal_mode = MEMORY',
+    'PRAGMA synchronous = OFF',
+    'PRAGMA foreign_keys = OFF',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -262144',
+]
+'''PRAGMAs of the connection while seeding. The load runs in one transaction on a database nobody else is using, so durability is traded for speed; the PRAGMAs of the app are restored afterwards.'''
+
+DERIVED_TABLES = ('user', 'trip', 'expense', 'photo')
+'''Tables whose triggers are dropped during the load. The trip_stats, change version, search index and photo blob reference counts they maintain are computed once for the seeded rows instead, with one set-based statement each.'''
+
+def seeded_rows(db, users, trips_per_user, expenses_per_trip, photos_per_trip, password, seed):
+    '''Inserts the users, trips, expenses and photos with executemany from generators, so no table is held in memory. Ids are assigned from the current maximum ids, so seeding adds to an existing database. Returns the first trip id and the counts of inserted rows.'''
+    rng = random.Random(seed)
+    version, rates = get_exchange_rates().current()
+    base = current_app.config['BASE_CURRENCY']
+    currencies = [base] + sorted(currency for currency in rates if currency != base)
+    currency_weights = [len(currencies) * 3] + [1] * (len(currencies) - 1)
+    city_weights = [1 / rank for rank in range(1, len(CITIES) + 1)]
+    expense_weights = [weight for _, _, _, weight in EXPENSES]
+
+    first_user = db.execute('SELECT COALESCE(MAX(user_id), 0) + 1 FROM user').fetchone()[0]
+    first_trip = db.execute('SELECT COALESCE(MAX(trip_id), 0) + 1 FROM trip').fetchone()[0]
+    first_expense = db.execute('SELECT COALESCE(MAX(expense_id), 0) + 1 FROM expense').fetchone()[0]
+    first_photo = db.execute('SELECT COALESCE(MAX(photo_id), 0) + 1 FROM photo').fetchone()[0]
+    dates = [(FIRST_DATE + timedelta(days=day)).isoformat() for day in range(DATE_RANGE + 21)]
+    trips = []
+
+    def user_rows():
+        for user_id in range(first_user, first_user + users):
+            yield user_id, f'seed{user_id}', password, f'Seed User {user_id}', f'seed{user_id}@example.com'
+
+    def trip_rows():
+        trip_id = first_trip
+        for user_id in range(first_user, first_user + users):
+            for city in rng.choices(CITIES, city_weights, k=trips_per_user):
+                start = rng.randrange(DATE_RANGE)
+                trips.append((trip_id, start, rng.randint(2, 21)))
+                yield trip_id, city, dates[start], f'{rng.choice(TRIP_KINDS)} {city}', round(rng.lognormvariate(7, 0.6), -1), user_id
+                trip_id += 1
+
+    def expense_rows():
+        expense_id = first_expense
+        random, lognormvariate = rng.random, rng.lognormvariate
+        for trip_id, start, days in trips:
+            kinds = rng.choices(EXPENSES, expense_weights, k=expenses_per_trip)
+            for (description, mu, sigma, _), currency in zip(kinds, rng.choices(currencies, currency_weights, k=expenses_per_trip)):
+                amount = round(lognormvariate(mu, sigma), 2)
+                yield expense_id, trip_id, amount, description, dates[start + int(random() * days)], currency, round(amount * rates[currency], 2), version
+                expense_id += 1
+
+    def photo_rows():
+        photo_id = first_photo
+        for trip_id, _, _ in trips:
+            user_id = first_user + (trip_id - first_trip) // trips_per_user
+            for _ in range(photos_per_trip):
+                blob_hash = hashlib.sha256(f'seed-{seed}-{photo_id}'.encode()).hexdigest()
+                yield photo_id, trip_id, user_id, blob_path(blob_hash, 'jpg'), blob_hash, int(rng.lognormvariate(14.5, 0.5))
+                photo_id += 1
+
+    db.executemany('INSERT INTO user (user_id, username, password, fullname, email) VALUES (?, ?, ?, ?, ?)', user_rows())
+    db.executemany('INSERT INTO trip (trip_id, destination, date, description, budget, user_id) VALUES (?, ?, ?, ?, ?, ?)', trip_rows())
+    db.executemany(
+        'INSERT INTO expense (expense_id, trip_id, amount, expense_description, expense_date, currency, base_amount, rate_version) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+        expense_rows()
+    )
+    photos = list(photo_rows()) if photos_per_trip else []
+    db.executemany(
+        'INSERT INTO photo_blob (blob_hash, file_path, size, ref_count, rendered) VALUES (?, ?, ?, 1, CURRENT_TIMESTAMP)',
+        [(blob_hash, file_path, size) for _, _, _, file_path, blob_hash, size in photos]
+    )
+    db.executemany(
+        'INSERT INTO photo (photo_id, trip_id, user_id, file_path, blob_hash) VALUES (?, ?, ?, ?, ?)',
+        [photo[:5] for photo in photos]
+    )
+    return first_user, first_trip, {
+        "users": users,
+        "trips": len(trips),
+        "expenses": len(trips) * expenses_per_trip,
+        "photos": len(photos),
+    }
+
+def derive(db, first_user, first_trip):
+    '''Computes what the dropped triggers would have for the seeded users and trips: their trip_stats rows, their change versions and their search index rows.'''
+    db.execute(
+        'INSERT INTO trip_stats (trip_id, expense_count, expense_total, expense_min, expense_max, remaining_budget) '
+        'SELECT trip.trip_id, COUNT(expense.expense_id), COALESCE(SUM(expense.base_amount), 0), MIN(expense.base_amount), MAX(expense.base_amount), '
+        'trip.budget - COALESCE(SUM(expense.base_amount), 0) '
+        'FROM trip LEFT JOIN expense ON expense.trip_id = trip.trip_id WHERE trip.trip_id >= ? GROUP BY trip.trip_id', (first_trip,)
+    )
+    db.execute('UPDATE trip SET data_version = 1, data_modified = CURRENT_TIMESTAMP WHERE trip_id >= ?', (first_trip,))
+    db.execute('UPDATE user SET data_version = 1, data_modified = CURRENT_TIMESTAMP WHERE user_id >= ?', (first_user,))
+    db.execute(
+        "INSERT INTO search_index (rowid, owner, destination, description, kind, trip_id) "
+        "SELECT -trip_id, 'u' || user_id, destination, description, 'trip', trip_id FROM trip WHERE trip_id >= ?", (first_trip,)
+    )
+    db.execute(
+        "INSERT INTO search_index (rowid, owner, destination, description, kind, trip_id) "
+        "SELECT expense.expense_id, 'u' || trip.user_id, trip.destination, expense.expense_description, 'expense', trip.trip_id "
+        "FROM expense JOIN trip ON trip.trip_id = expense.trip_id WHERE trip.trip_id >= ?", (first_trip,)
+    )
+
+def seed_db(db, users, trips_per_user, expenses_per_trip, photos_per_trip=0, password='seedpassword', seed=0):
+    '''Adds users with trips_per_user trips of expenses_per_trip expenses and photos_per_trip photos each to the database, generated from seed so the same arguments always produce the same data. Everything is inserted in one transaction with the triggers of the seeded tables dropped and the PRAGMAs relaxed, and the data the triggers maintain is derived afterwards, which keeps millions of rows within a minute. Every user can log in as seed<user_id> with password. The photo rows point to blobs with no file behind them. Returns the counts of inserted rows.'''
+    password = get_password_hasher().hash(password)
+    for pragma in RELAXED_PRAGMAS:
+        db.execute(pragma)
+
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        placeholders = ', '.join('?' * len(DERIVED_TABLES))
+        triggers = db.execute(
+            f"SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name IN ({placeholders})", DERIVED_TABLES
+        ).fetchall()
+        for trigger in triggers:
+            db.execute(f'DROP TRIGGER "{trigger["name"]}"')
+
+        first_user, first_trip, counts = seeded_rows(db, users, trips_per_user, expenses_per_trip, photos_per_trip, password, seed)
+        derive(db, first_user, first_trip)
+
+        for trigger in triggers:
+            db.execute(trigger['sql'])
+        db.commit()
+    except sqlite3.Error:
+        db.rollback()
+        raise
+    finally:
+        for pragma in connection_pragmas(current_app.config):
+            db.execute(pragma)
+
+    db.execute('PRAGMA optimize')
+    return counts
+
+@click.command('seed-db')
+@click.option('--users', type=int, default=100, help='Number of users to add.')
+@click.option('--trips-per-user', type=int, default=20, help='Number of trips of every user.')
+@click.option('--expenses-per-trip', type=int, default=50, help='Number of expenses of every trip.')
+@click.option('--photos-per-trip', type=int, default=0, help='Number of photo rows of every trip. They have no files behind them.')
+@click.option('--password', default='seedpassword', help='Password of every seeded user.')
+@click.option('--seed', type=int, default=0, help='Seed of the random generator. The same seed produces the same data.')
+@with_appcontext
+def seed_db_command(users, trips_per_user, expenses_per_trip, photos_per_trip, password, seed):
+    '''Fills the database with generated users, trips, expenses and photos, to reproduce production volumes locally. Run the command after init-db, e.g. for a million expenses:
+
+    flask --app trips.py seed-db --users 1000 --trips-per-user 20 --expenses-per-trip 50
+    '''
+    counts = seed_db(open_db(), users, trips_per_user, expenses_per_trip, photos_per_trip, password, seed)
+    click.echo(f"Seeded {counts['users']} users, {counts['trips']} trips, {counts['expenses']} expenses and {counts['photos']} photos!")
@@ -0,0 +1,66 @@
+import json
+from operator import itemgetter
+from flask import current_app
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+class RowSerializer:
+    '''Turns sqlite3 rows into the dicts of a JSON response with a fixed set of fields. The positions of the fields in a result set are looked up once per distinct column list and kept as an itemgetter, so serializing a row is one tuple lookup and one dict, without escaping or per column calls. Values keep their SQL types, so numbers stay numbers and NULL becomes null; only the columns in converters, like timestamps, are converted.
+    '''
+    def __init__(self, fields, converters=None):
+        self.fields = tuple(fields)
+        self.converters = tuple((converters or {}).items())
+        self._getters = {}
+
+    def _getter(self, row):
+        columns = tuple(row.keys())
+        getter = self._getters.get(columns)
+        if getter is None:
+            positions = [columns.index(field) for field in self.fields]
+            if len(positions) == 1:
+                position = positions[0]
+                getter = lambda row: (row[position],)
+            else:
+                getter = itemgetter(*positions)
+            self._getters[columns] = getter
+        return getter
+
+    def many(self, rows):
+        if not rows:
+            return []
+        getter = self._getter(rows[0])
+        fields = self.fields
+        items = [dict(zip(fields, getter(row))) for row in rows]
+        for field, convert in self.converters:
+            for item in items:
+                value = item[field]
+                if value is not None:
+                    item[field] = convert(value)
+        return items
+
+    def one(self, row):
+        return self.many([row])[0]
+
+TRIP_JSON = RowSerializer(
+    ('trip_id', 'destination', 'date', 'description', 'budget', 'created', 'expense_count', 'expense_total', 'expense_min', 'expense_max', 'remaining_budget'),
+    {'created': str}
+)
+EXPENSE_JSON = RowSerializer(
+    ('expense_id', 'expense_description', 'expense_date', 'amount', 'currency', 'base_amount', 'created'),
+    {'created': str}
+)
+EXPENSE_DETAIL_JSON = RowSerializer(EXPENSE_JSON.fields + ('trip_id',), {'created': str})
+'''Serializers of the trip and expense JSON responses. created is a datetime parsed by PARSE_DECLTYPES and is sent as its "YYYY-MM-DD HH:MM:SS" text.'''
+
+def dumps(payload):
+    '''Encodes payload to JSON bytes with orjson when it is installed, else with the json module.'''
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf8')
+
+def json_response(payload, status=200):
+    '''Returns a JSON response of payload, the fast path of the list and detail endpoints instead of jsonify.'''
+    return current_app.response_class(dumps(payload), status=status, mimetype='application/json')
@@ -0,0 +1,148 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+from datetime import datetime, timezone
+import click
+from flask import current_app, has_request_context, request
+from flask.cli import with_appcontext
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+PLACEHOLDER_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+WHITESPACE = re.compile(r'\s+')
+
+EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+'''Statements EXPLAIN QUERY PLAN is run for. Transaction control, PRAGMAs and DDL have no plan worth capturing.'''
+
+def normalize(sql):
+    '''Turns a statement into its fingerprint text: literals become ?, lists of placeholders built for IN clauses collapse to (?+) whatever their length, and whitespace is collapsed, so every run of the same query groups together.'''
+    sql = STRING_LITERAL.sub('?', sql)
+    sql = NUMBER_LITERAL.sub('?', sql)
+    sql = PLACEHOLDER_LIST.sub('(?+)', sql)
+    return WHITESPACE.sub(' ', sql).strip()
+
+def fingerprint(normalized):
+    return hashlib.sha1(normalized.encode()).hexdigest()[:12]
+
+def plan_flags(plan):
+    '''Returns (full scan, temp b-tree) for the detail lines of a query plan. A SCAN that uses no index and is not a virtual table like the search index reads every row of its table; USE TEMP B-TREE means rows are sorted or grouped in a temporary index instead of read in index order.'''
+    scan = any(
+        detail.startswith('SCAN') and 'INDEX' not in detail and 'VIRTUAL TABLE' not in detail and 'CONSTANT ROW' not in detail
+        for detail in plan
+    )
+    temp_btree = any('USE TEMP B-TREE' in detail for detail in plan)
+    return scan, temp_btree
+
+class SlowQueryLog:
+    '''Logs the statements slower than SQL_SLOW_QUERY_THRESHOLD seconds, with their query plan, to the app logger and as JSON lines appended to SQL_SLOW_QUERY_LOG, which flask sql-report aggregates. The plan is captured with EXPLAIN QUERY PLAN on the connection that ran the statement, right after it was slow, so it reflects the same schema and statistics. Only slow statements pay for any of this.
+    '''
+    def __init__(self, app):
+        self.app = app
+        self._lock = threading.Lock()
+
+    @property
+    def threshold(self):
+        return self.app.config['SQL_SLOW_QUERY_THRESHOLD']
+
+    def explain(self, db, sql, parameters):
+        '''Returns the detail lines of the plan of a statement, or None for statements without one. executemany passes no parameters, so its statements are explained with all of them NULL.'''
+        if not sql.lstrip().upper().startswith(EXPLAINABLE):
+            return None
+        if parameters is None:
+            parameters = (None,) * sql.count('?')
+        try:
+            return [row[3] for row in sqlite3.Cursor(db).execute(f'EXPLAIN QUERY PLAN {sql}', parameters)]
+        except sqlite3.Error:
+            return None
+
+    def trace(self, db, sql, parameters, seconds):
+        normalized = normalize(sql)
+        plan = self.explain(db, sql, parameters)
+        scan, temp_btree = plan_flags(plan or [])
+        entry = {
+            "time": datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            "fingerprint": fingerprint(normalized),
+            "sql": normalized,
+            "seconds": round(seconds, 6),
+            "endpoint": request.endpoint if has_request_context() else db.endpoint,
+            "plan": plan,
+            "scan": scan,
+            "temp_btree": temp_btree,
+        }
+        flags = ''.join(flag for flag, on in ((' [SCAN]', scan), (' [TEMP B-TREE]', temp_btree)) if on)
+        self.app.logger.warning(f"Slow query {seconds * 1000:.1f} ms{flags}: {normalized}")
+        with self._lock:
+            with open(self.app.config['SQL_SLOW_QUERY_LOG'], 'a', encoding='utf8') as f:
+                f.write(json.dumps(entry) + '\n')
+
+def init_slow_query_log(app):
+    '''Creates the slow query tracer of the app. Called by create_app.'''
+    app.extensions['slow_query_log'] = SlowQueryLog(app)
+    return app.extensions['slow_query_log']
+
+def get_slow_query_log():
+    '''Returns the tracer open_db attaches to the connection of a request, or None when tracing is off, which is the default.'''
+    if current_app.config['SQL_SLOW_QUERY_THRESHOLD'] is None:
+        return None
+    return current_app.extensions['slow_query_log']
+
+def aggregate(entries):
+    '''Groups logged slow statements by fingerprint. Returns a list of dicts with the count, total, mean and max seconds, the endpoints that ran the statement and the last captured plan.'''
+    offenders = {}
+    for entry in entries:
+        offender = offenders.get(entry['fingerprint'])
+        if offender is None:
+            offender = offenders[entry['fingerprint']] = {
+                "fingerprint": entry['fingerprint'], "sql": entry['sql'], "count": 0, "total": 0.0, "max": 0.0,
+                "endpoints": set(), "plan": None, "scan": False, "temp_btree": False,
+            }
+        offender['count'] += 1
+        offender['total'] += entry['seconds']
+        offender['max'] = max(offender['max'], entry['seconds'])
+        if entry.get('endpoint'):
+            offender['endpoints'].add(entry['endpoint'])
+        if entry.get('plan') is not None:
+            offender.update(plan=entry['plan'], scan=entry['scan'], temp_btree=entry['temp_btree'])
+    for offender in offenders.values():
+        offender['mean'] = offender['total'] / offender['count']
+    return list(offenders.values())
+
+def read_log(path):
+    with open(path, encoding='utf8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+@click.command('sql-report')
+@click.option('--path', type=click.Path(dir_okay=False), help='Slow query log to read, SQL_SLOW_QUERY_LOG by default.')
+@click.option('--top', type=int, default=10, help='Number of statements to list.')
+@click.option('--sort', type=click.Choice(['total', 'count', 'max', 'mean']), default='total', help='Rank statements by total, count, max or mean time.')
+@with_appcontext
+def sql_report_command(path, top, sort):
+    '''Lists the statements that were slow most often or for longest, with their query plans. Enable tracing by setting SQL_SLOW_QUERY_THRESHOLD, e.g. to 0.05 seconds, and then run the command:
+
+    flask --app trips.py sql-report --top 10
+    '''
+    path = path or current_app.config['SQL_SLOW_QUERY_LOG']
+    try:
+        offenders = aggregate(read_log(path))
+    except FileNotFoundError:
+        click.echo(f'No slow queries logged in {path}!')
+        return
+
+    offenders.sort(key=lambda offender: offender[sort], reverse=True)
+    for offender in offenders[:top]:
+        flags = ''.join(flag for flag, on in ((' SCAN', offender['scan']), (' TEMP-B-TREE', offender['temp_btree'])) if on)
+        click.echo(
+            f"{offender['fingerprint']} {offender['count']}x total {offender['total'] * 1000:.1f} ms "
+            f"mean {offender['mean'] * 1000:.1f} ms max {offender['max'] * 1000:.1f} ms{flags}"
+        )
+        click.echo(f"    {offender['sql']}")
+        if offender['endpoints']:
+            click.echo(f"    endpoints: {', '.join(sorted(offender['endpoints']))}")
+        for detail in offender['plan'] or []:
+            click.echo(f"    plan: {detail}")
+    if not offenders:
+        click.echo(f'No slow queries logged in {path}!')
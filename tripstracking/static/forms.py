@@ -1,5 +1,5 @@
 from wtforms import StringField, PasswordField, Form, SubmitField, EmailField, TextAreaField, DateField, DecimalField
-from wtforms.validators import DataRequired, Email, Length
+from wtforms.validators import DataRequired, Email, Length, Optional, Regexp
 
 class RegisterForm(Form):
     fullname = StringField("Fullname", validators = [DataRequired(), Length(min=3, max=20)])
@@ -31,6 +31,7 @@ class PutExpenseForm(Form):
     expense_description = TextAreaField("Expense Discription", validators=[Length(max=100)])
     expense_date = DateField("Expense Date")
     amount = DecimalField("amount", validators=[DataRequired()])
+    currency = StringField("Currency", validators=[Optional(), Regexp(r'^[A-Za-z]{3}$', message="Currency must be a three letter code like EUR")])
     submit = SubmitField("Submit")
 
 
@@ -38,5 +39,6 @@ class AddExpenseForm(Form):
     expense_description = TextAreaField("Expense Discription", validators=[Length(max=100)])
     expense_date = DateField("Expense Date")
     amount = DecimalField("amount", validators=[DataRequired()])
+    currency = StringField("Currency", validators=[Optional(), Regexp(r'^[A-Za-z]{3}$', message="Currency must be a three letter code like EUR")])
     submit = SubmitField("Submit")
 
@@ -0,0 +1,9 @@
+// JSON responses carry raw values, so every value put into innerHTML is escaped here first.
+const HTML_ESCAPES = { '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;' };
+
+function escapeHtml(value) {
+    if (value === null || value === undefined) {
+        return '';
+    }
+    return String(value).replace(/[&<>"']/g, character => HTML_ESCAPES[character]);
+}
@@ -0,0 +1,164 @@
+import multiprocessing
+import os
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from PIL import Image, ImageOps
+from .db import open_db
+
+START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+'''How the worker processes are started. Forking a multi-threaded WSGI process copies locks other threads may be holding, which can deadlock the workers, so they are started from a clean process instead.'''
+
+def rendition_path(blob_path, width):
+    '''Returns the path of a rendition next to its blob, e.g. ab/cd/<hash>_320.jpg.'''
+    return f"{os.path.splitext(blob_path)[0]}_{width}.jpg"
+
+def make_renditions(upload_folder, blob_path, widths, quality):
+    '''Generates a JPEG rendition of the blob fitting in a width x width box for every width smaller than the image. Runs in a worker process, so it only touches files. Every rendition is written to a temporary file first and then renamed, so a half written rendition is never served. Returns a list of (width, rendition path).'''
+    renditions = []
+    with Image.open(os.path.join(upload_folder, blob_path)) as original:
+        image = ImageOps.exif_transpose(original).convert('RGB')
+
+    try:
+        for width in sorted(widths, reverse=True):
+            if max(image.size) <= width:
+                continue
+            image.thumbnail((width, width), Image.LANCZOS)
+            path = rendition_path(blob_path, width)
+            temporary = os.path.join(upload_folder, f"{path}.{uuid.uuid4().hex}.tmp")
+            try:
+                image.save(temporary, 'JPEG', quality=quality, optimize=True)
+                os.replace(temporary, os.path.join(upload_folder, path))
+            except Exception:
+                remove_files(upload_folder, [temporary])
+                raise
+            renditions.append((width, path))
+    except Exception:
+        remove_files(upload_folder, [path for _, path in renditions])
+        raise
+    return renditions
+
+def remove_files(upload_folder, paths):
+    '''Removes the files of renditions that were generated but could not be kept. Files already gone are ignored.'''
+    for path in paths:
+        try:
+            os.remove(os.path.join(upload_folder, path))
+        except FileNotFoundError:
+            pass
+
+def record_renditions(db, blob_hash, renditions, upload_folder):
+    '''Stores the renditions of a blob. If they cannot be stored, e.g. because the blob was deleted while it was rendered, which the foreign key of photo_rendition rejects, their files are removed, so no file is left without a row.'''
+    try:
+        db.executemany(
+            'INSERT OR REPLACE INTO photo_rendition (blob_hash, width, file_path) VALUES (?, ?, ?)',
+            [(blob_hash, width, path) for width, path in renditions]
+        )
+        db.execute('UPDATE photo_blob SET rendered = CURRENT_TIMESTAMP WHERE blob_hash = ?', (blob_hash,))
+        db.commit()
+    except Exception:
+        db.rollback()
+        remove_files(upload_folder, [path for _, path in renditions])
+        raise
+
+class ThumbnailPool:
+    '''Generates the renditions of new uploads in a bounded pool of worker processes, so resizing never runs in the request. At most THUMBNAIL_QUEUE blobs wait at a time. When the queue is full the upload is not held up: the blob is skipped and picked up by flask thumbnails --backfill. With THUMBNAIL_WORKERS = 0 the renditions are generated inline instead, which the tests and the CLI use.
+    '''
+    def __init__(self, app):
+        self.app = app
+        self._executor = None
+        self._lock = threading.Lock()
+        self._slots = None
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.app.config['THUMBNAIL_WORKERS'], mp_context=multiprocessing.get_context(START_METHOD))
+            return self._executor
+
+    def _get_slots(self):
+        '''Creates the semaphore bounding the queue on first use, so THUMBNAIL_QUEUE can still be changed after create_app, like the other settings.'''
+        with self._lock:
+            if self._slots is None:
+                self._slots = threading.BoundedSemaphore(self.app.config['THUMBNAIL_QUEUE'])
+            return self._slots
+
+    def submit(self, blob_hash, blob_path):
+        '''Queues a blob for rendering. Returns False if the queue is full.'''
+        config = self.app.config
+        arguments = (config['UPLOAD_FOLDER'], blob_path, config['THUMBNAIL_SIZES'], config['THUMBNAIL_QUALITY'])
+
+        if not config['THUMBNAIL_WORKERS']:
+            self._finish(blob_hash, make_renditions, arguments)
+            return True
+
+        if not self._get_slots().acquire(blocking=False):
+            return False
+        try:
+            future = self._get_executor().submit(make_renditions, *arguments)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda future: self._done(blob_hash, future))
+        return True
+
+    def _done(self, blob_hash, future):
+        self._slots.release()
+        self._finish(blob_hash, future.result)
+
+    def _finish(self, blob_hash, result, arguments=()):
+        '''Stores the renditions of a blob, or logs why they could not be generated. Called in the request for inline rendering, or in the thread of the executor that handles finished work, which has no app context of its own.'''
+        with self.app.app_context():
+            try:
+                record_renditions(open_db(), blob_hash, result(*arguments), self.app.config['UPLOAD_FOLDER'])
+            except Exception as e:
+                current_app.logger.error(f"Failed to generate the renditions of {blob_hash}: {str(e)}")
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+def init_thumbnail_pool(app):
+    '''Creates the thumbnail pool of the app. Called by create_app.'''
+    app.extensions['thumbnail_pool'] = ThumbnailPool(app)
+    return app.extensions['thumbnail_pool']
+
+def get_thumbnail_pool():
+    return current_app.extensions['thumbnail_pool']
+
+@click.command('thumbnails')
+@click.option('--backfill', is_flag=True, help='Generate the missing renditions of every stored photo.')
+@click.option('--workers', type=int, default=None, help='Number of worker processes, defaults to the number of CPUs.')
+@with_appcontext
+def thumbnails_command(backfill, workers):
+    '''Reports how many stored photos still miss their renditions, or generates them in parallel with --backfill. Run the command:
+
+    flask --app trips.py thumbnails --backfill
+    '''
+    db = open_db()
+    pending = db.execute(
+        'SELECT blob_hash, file_path FROM photo_blob WHERE rendered IS NULL'
+    ).fetchall()
+
+    if not backfill:
+        click.echo(f'{len(pending)} photos miss their renditions.')
+        return
+
+    config = current_app.config
+    done = 0
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(START_METHOD)) as executor:
+        futures = [
+            (blob['blob_hash'], executor.submit(make_renditions, config['UPLOAD_FOLDER'], blob['file_path'], config['THUMBNAIL_SIZES'], config['THUMBNAIL_QUALITY']))
+            for blob in pending
+        ]
+        for blob_hash, future in futures:
+            try:
+                record_renditions(db, blob_hash, future.result(), config['UPLOAD_FOLDER'])
+                done += 1
+            except Exception as e:
+                click.echo(f'Failed to generate the renditions of {blob_hash}: {str(e)}')
+    click.echo(f'Generated the renditions of {done} photos!')
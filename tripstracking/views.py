@@ -1,11 +1,17 @@
-from flask import Blueprint, request, session, jsonify, current_app, g, redirect, url_for, render_template, flash
+from flask import Blueprint, request, session, jsonify, current_app, g, redirect, url_for, render_template, flash, Response, stream_with_context, send_file, abort
 from markupsafe import escape
 from werkzeug.utils import secure_filename 
 from .db import open_db
 from urllib.parse import unquote, quote
 import os
+import csv
 import functools
+import inspect
 from .static import forms
+from . import pagination, analytics, importer, exporter, conditional, photos, search, batch, serialize
+from .thumbnails import get_thumbnail_pool
+from .currency import get_exchange_rates, request_currency
+from .responses import request_data, error_response
 
 views = Blueprint("views", __name__, template_folder='templates')
 
@@ -16,38 +22,84 @@ def home():
         username = g.user['username']
     return render_template('home.html', username=username)
 
+def not_logged_in():
+    json_response = "application/json" in request.headers.get("accept", "")
+    message = "User is not logged in"
+    if json_response:
+        return jsonify({"message": message}), 401
+    flash(message)
+    return redirect(url_for('views.home'))
+
 def crud_trips(view):
-    '''Ensures that only authenicated users can access any view function. Executes the view function if the user is authenticate, else returns a 401 error.'''
+    '''Ensures that only authenicated users can access any view function. Executes the view function if the user is authenticate, else returns a 401 error. Async views of the async build are wrapped by a coroutine.'''
+    if inspect.iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def wrapped_async_view(**kwargs):
+            if g.user is None:
+                return not_logged_in()
+            return await view(**kwargs)
+        return wrapped_async_view
+
     @functools.wraps(view)
     def wrapped_view(**kwargs):
-        json_response = "application/json" in request.headers.get("accept", "")
         if g.user is None:
-            message = "User is not logged in"
-            if json_response:
-                return jsonify({"message": message}), 401
-            flash(message)
-            return redirect(url_for('views.home'))
-        
+            return not_logged_in()
         return view(**kwargs)
     return wrapped_view
 
-@views.before_request
-def user_info():
-    db = open_db()
-    user_id = session.get('user_id')
-
-    if user_id is None:
-        g.user = None
-    else:
-        g.user = db.execute(
-            'SELECT * FROM user WHERE user_id = ?', (user_id,)
-        ).fetchone()
-
 @views.before_request
 def method_override():
     if '_method' in request.form:
         request.environ['REQUEST_METHOD'] = request.form['_method']
 
+TRIP_SELECT = (
+    'SELECT trip.trip_id, trip.destination, trip.date, trip.description, trip.budget, trip.created, trip.data_version, trip.data_modified, '
+    'COALESCE(trip_stats.expense_count, 0) AS expense_count, COALESCE(trip_stats.expense_total, 0) AS expense_total, '
+    'trip_stats.expense_min, trip_stats.expense_max, COALESCE(trip_stats.remaining_budget, trip.budget) AS remaining_budget '
+    'FROM trip LEFT JOIN trip_stats ON trip_stats.trip_id = trip.trip_id'
+)
+'''Selects a trip together with its expense aggregates from trip_stats, which the triggers of migration 0003 keep up to date.'''
+
+USER_VERSION_SELECT = 'SELECT data_version, data_modified FROM user WHERE user_id = ?'
+
+def dated_trips_query(user_id, limit, after):
+    '''Returns the query and parameters of the dated trips of a page, or None when the cursor is already past them.'''
+    if after is None:
+        return TRIP_SELECT + ' WHERE trip.user_id = ? AND trip.date IS NOT NULL ORDER BY trip.date DESC, trip.trip_id DESC LIMIT ?', (user_id, limit + 1)
+    if after[0] is not None:
+        return TRIP_SELECT + ' WHERE trip.user_id = ? AND (trip.date, trip.trip_id) < (?, ?) ORDER BY trip.date DESC, trip.trip_id DESC LIMIT ?', (user_id, after[0], after[1], limit + 1)
+    return None
+
+def undated_trips_query(user_id, limit, after, count):
+    '''Returns the query and parameters of the undated trips that fill up a page holding count dated trips, or None when the page is full.'''
+    if count > limit:
+        return None
+    last_id = after[1] if after is not None and after[0] is None else None
+    if last_id is None:
+        return TRIP_SELECT + ' WHERE trip.user_id = ? AND trip.date IS NULL ORDER BY trip.trip_id DESC LIMIT ?', (user_id, limit + 1 - count)
+    return TRIP_SELECT + ' WHERE trip.user_id = ? AND trip.date IS NULL AND trip.trip_id < ? ORDER BY trip.trip_id DESC LIMIT ?', (user_id, last_id, limit + 1 - count)
+
+def trips_page(db, user_id, limit, after):
+    '''Returns up to limit + 1 trips of the user after the (date, trip_id) key of the cursor, newest date first. The query seeks on idx_trip_user_date instead of skipping rows with OFFSET, so every page costs the same. Trips without a date sort last, so they are read in a second seek once the dated trips are exhausted.'''
+    query = dated_trips_query(user_id, limit, after)
+    trips = db.execute(*query).fetchall() if query else []
+    query = undated_trips_query(user_id, limit, after, len(trips))
+    if query:
+        trips.extend(db.execute(*query).fetchall())
+    return trips
+
+def trips_response(json_response, trips, limit, after, validators):
+    '''Builds the response of get_all_trips from a page of trips.'''
+    next_cursor = pagination.next_cursor(trips, limit, lambda trip: (trip["date"], trip["trip_id"]))
+
+    if not trips and after is None:
+        return error_response(json_response, "No trips found", 404, 'views.post_trip')
+
+    if json_response:
+        response = serialize.json_response({"trips": serialize.TRIP_JSON.many(trips), "next_cursor": next_cursor})
+        return conditional.set_validators(response, *validators), 200
+    return render_template('trips/trips.html', trips=trips, next_cursor=next_cursor, limit=limit)
+
 @views.route('/trips/', methods=['GET'])
 @crud_trips
 def get_all_trips():
@@ -55,32 +107,68 @@ def get_all_trips():
     json_response = "application/json" in request.headers.get("accept", "")
     user_id = session.get('user_id')
 
-    if user_id is not None:
-        trips = db.execute(
-            'SELECT trip_id, destination, date, description, budget, created FROM trip WHERE user_id = ? ORDER BY date DESC', (user_id,)
-        ).fetchall()
+    try:
+        limit, after = pagination.page_args()
+    except ValueError as e:
+        return error_response(json_response, str(e), 400, 'views.get_all_trips')
+
+    validators = None
+    if json_response:
+        validators = conditional.validators('trips', user_id, db.execute(USER_VERSION_SELECT, (user_id,)).fetchone())
+        if conditional.is_not_modified(*validators):
+            return conditional.not_modified(*validators)
 
-    if not trips:
-        error = "No trips found"
+    return trips_response(json_response, trips_page(db, user_id, limit, after), limit, after, validators)
+
+@views.route('/trips/analytics', methods=['GET'])
+@crud_trips
+def get_analytics():
+    '''Returns the spending analytics of the logged in user as JSON: spend by month and by destination, budget versus actual per trip and percentiles of the expense amounts.'''
+    db = open_db()
+    user_id = session.get('user_id')
+
+    return jsonify(analytics.spending_summary(db, user_id)), 200
+
+@views.route('/search', methods=['GET'])
+@crud_trips
+def search_trips():
+    '''Full-text search of the logged in user's trips and expenses through the FTS5 index of migration 0008. Returns the best ranked matches of q, up to limit, with the matched words wrapped in <mark> tags.'''
+    db = open_db()
+    json_response = "application/json" in request.headers.get("accept", "")
+    user_id = session.get('user_id')
+    q = request.args.get('q', '').strip()
+
+    try:
+        limit, _ = pagination.page_args()
+    except ValueError as e:
         if json_response:
-            return jsonify({"error": error}), 404
-        flash(error)
-        return redirect(url_for('views.post_trip'))
-    
-    trips_dict = []
-    for trip in trips:
-        trips_dict.append({
-            "trip_id": escape(trip["trip_id"]),
-            "destination": escape(trip["destination"]),
-            "date": escape(trip["date"]),
-            "description": escape(trip["description"]),
-            "budget": escape(trip["budget"]),
-            "created": escape(trip["created"])
-        })
+            return jsonify({"error": str(e)}), 400
+        flash(str(e))
+        return redirect(url_for('views.search_trips'))
+
+    if not q:
+        if json_response:
+            return jsonify({"error": "q is required"}), 400
+        return render_template('search.html', q=q, results=[])
+
+    results = search.search(db, user_id, q, limit)
 
     if json_response:
-        return jsonify({"trips": trips_dict}), 200
-    return render_template('trips/trips.html', trips=trips_dict)
+        return jsonify({"q": q, "results": results}), 200
+    return render_template('search.html', q=q, results=results)
+
+def trip_response(json_response, trip, trip_id, destination):
+    '''Builds the response of get_trip from the trip row, None when it was not found.'''
+    if trip is None:
+        return error_response(json_response, f"Trip with trip id={trip_id} and destination='{destination}' not found", 404, 'views.get_all_trips')
+
+    if json_response:
+        etag, last_modified = conditional.validators('trip', trip_id, trip)
+        if conditional.is_not_modified(etag, last_modified):
+            return conditional.not_modified(etag, last_modified)
+        response = serialize.json_response({"trip": serialize.TRIP_JSON.one(trip)})
+        return conditional.set_validators(response, etag, last_modified), 200
+    return render_template('trips/trip.html', trip=trip, trip_id=trip_id, destination=quote(destination))
 
 @views.route('/trip/<int:trip_id>/<destination>', methods=['GET'])
 @crud_trips
@@ -91,28 +179,36 @@ def get_trip(trip_id, destination):
     destination = unquote(destination)
 
     trip = db.execute(
-        'SELECT trip_id, destination, date, description, budget, created FROM trip WHERE trip_id = ? AND destination = ?', (trip_id, destination)
+        TRIP_SELECT + ' WHERE trip.trip_id = ? AND trip.destination = ?', (trip_id, destination)
     ).fetchone()
+    return trip_response(json_response, trip, trip_id, destination)
 
-    if trip is None:
-        error = f"Trip with trip id={trip_id} and destination='{destination}' not found"
-        if json_response:
-            return jsonify({"error": error}), 404
-        flash(error)
-        return redirect(url_for('views.get_all_trips'))
-    
-    trip_details = {
-        "trip_id": escape(trip["trip_id"]),
-        "destination": escape(trip["destination"]),
-        "date": escape(trip["date"]),
-        "description": escape(trip["description"]),
-        "budget": escape(trip["budget"]),
-        "created": escape(trip["created"])
-    }
-    
+TRIP_INSERT = 'INSERT INTO trip (destination, date, description, budget, user_id) VALUES (?, ?, ?, ?, ?)'
+
+def new_trip(data):
+    '''Returns the trip sent in the JSON or form data of a request. Raises ValueError when there is no data or it lacks the destination or description.'''
+    if not data:
+        raise ValueError("No data given")
+
+    trip = {
+        "destination": data.get('destination'),
+        "date": data.get('date'),
+        "description": data.get('description'),
+        "budget": data.get('budget')}
+
+    if not trip["destination"] or not trip["description"]:
+        raise ValueError("destination and description are required")
+    return trip
+
+def trip_parameters(trip, user_id):
+    return (trip["destination"], trip["date"], trip["description"], trip["budget"], user_id)
+
+def trip_created(json_response, trip_id, trip):
     if json_response:
-        return jsonify({"trip": trip_details}), 200
-    return render_template('trips/trip.html', trip=trip, trip_id=trip_id, destination=quote(destination))
+        response = {"message": "Trip created successfully!",
+                    "trip": {"trip_id": trip_id, **trip}}
+        return jsonify(response), 201
+    return redirect(url_for('views.get_trip', trip_id=trip_id, destination=quote(trip["destination"])))
 
 @views.route('/add_trip', methods=['GET', 'POST'])
 @crud_trips
@@ -122,54 +218,17 @@ def post_trip():
         db = open_db()
         json_response = "application/json" in request.headers.get("accept", "")
 
-        if json_response:
-            data = request.get_json()
-        else:
-            data = request.form
-
-        error = None
-
-        if not data:
-            if json_response:
-                return jsonify({"error": "No data given"}), 400
-            return redirect(url_for("views.post_trip"))
-
-        destination = data.get('destination')
-        date = data.get('date')
-        description = data.get('description')
-        budget = data.get('budget')
-        user_id = session.get('user_id')
-
-        if not destination or not description:
-            if json_response:
-                return jsonify({"error": "destination and description are required"}), 400
-            return redirect(url_for("views.post_trip"))
-        
-        if error is None:
-            try:
-                trip = db.execute(
-                    'INSERT INTO trip (destination, date, description, budget, user_id) VALUES (?, ?, ?, ?, ?)', (destination, date, description, budget, user_id)
-                )
+        try:
+            trip = new_trip(request_data(json_response))
+        except ValueError as e:
+            return error_response(json_response, str(e), 400, 'views.post_trip')
 
-                db.commit()
-
-                trip_id = trip.lastrowid
-
-                trip_details = {
-                                "trip_id": trip_id,
-                                "destination": destination,
-                                "date": date,
-                                "description": description,
-                                "budget": budget}
-                if json_response:
-                    response = {"message": "Trip created successfully!",
-                                "trip": trip_details}
-                    return jsonify(response), 201  
-                return redirect(url_for('views.get_trip', trip=trip_details, trip_id=trip_id, destination=trip['destination']))
-            except Exception as e:
-                if json_response:
-                    return jsonify({"error": f"Failed to create trip: {str(e)}"}), 500
-                return redirect(url_for("views.post_trip"))
+        try:
+            trip_id = db.execute(TRIP_INSERT, trip_parameters(trip, session.get('user_id'))).lastrowid
+            db.commit()
+        except Exception as e:
+            return error_response(json_response, f"Failed to create trip: {str(e)}", 500, 'views.post_trip')
+        return trip_created(json_response, trip_id, trip)
     return render_template('trips/post_trip.html', form=form)
 
 @views.route('/edit_trip/<int:trip_id>/<destination>', methods=['GET', 'POST'])
@@ -270,102 +329,134 @@ def delete_trip(trip_id, destination):
             return render_template('trips/delete_trip.html', error=error)
     return render_template('trips/delete_trip.html', trip_id=trip_id, trip=trip, destination=destination)
 
+TRIP_VERSION_SELECT = 'SELECT destination, data_version, data_modified FROM trip WHERE trip_id = ? AND user_id = ?'
+'''Selects a trip of the user with the data version its expense responses are validated with.'''
+
+EXPENSE_COLUMNS = 'expense_id, expense_description, expense_date, amount, currency, base_amount, created'
+
+def expenses_page_query(trip_id, limit, after):
+    '''Returns the query and parameters of up to limit + 1 expenses of a trip after the (base_amount, expense_id) key of the cursor, highest base amount first.'''
+    if after is None:
+        return f'SELECT {EXPENSE_COLUMNS} FROM expense WHERE trip_id = ? ORDER BY base_amount DESC, expense_id DESC LIMIT ?', (trip_id, limit + 1)
+    return f'SELECT {EXPENSE_COLUMNS} FROM expense WHERE trip_id = ? AND (base_amount, expense_id) < (?, ?) ORDER BY base_amount DESC, expense_id DESC LIMIT ?', (trip_id, after[0], after[1], limit + 1)
+
+EXPENSE_SELECT = f'SELECT {EXPENSE_COLUMNS}, trip_id FROM expense WHERE expense_id = ? AND trip_id = ?'
+
+def trip_not_found(json_response, trip_id, user_id, endpoint='views.get_all_trips'):
+    return error_response(json_response, f"No trip found with trip_id {trip_id} and user id {user_id}.", 404, endpoint)
+
+def expenses_response(json_response, trip_id, trip, expenses, limit, after, validators):
+    '''Builds the response of get_all_expenses from a page of expenses.'''
+    next_cursor = pagination.next_cursor(expenses, limit, lambda expense: (expense["base_amount"], expense["expense_id"]))
+
+    if not expenses and after is None:
+        return error_response(json_response, "No expenses found", 404, 'views.post_expense', trip_id=trip_id, destination=quote(trip["destination"]))
+
+    if json_response:
+        respond = {"expenses": serialize.EXPENSE_JSON.many(expenses),
+                   "destination": trip['destination'],
+                   "next_cursor": next_cursor}
+        return conditional.set_validators(serialize.json_response(respond), *validators), 200
+    return render_template('expenses/expenses.html', expenses=expenses, trip_id=trip_id, destination=trip['destination'], next_cursor=next_cursor, limit=limit)
+
 @views.route('/trips/expenses/<int:trip_id>/<destination>', methods=['GET'])
 @crud_trips
 def get_all_expenses(trip_id, destination):
-    try:
-        trip_id = int(trip_id)
-    except ValueError:
-        return jsonify({"error": "Invalid trip_id"}), 400
-    
     db = open_db()
     json_response = "application/json" in request.headers.get("accept", "")
     user_id = session.get('user_id')
 
-    destination = unquote(destination)
-
-    trip = db.execute(
-        'SELECT destination FROM trip WHERE trip_id = ? AND user_id = ?', (trip_id, user_id)).fetchone()
+    trip = db.execute(TRIP_VERSION_SELECT, (trip_id, user_id)).fetchone()
 
     if not trip:
-        error = f"No trip found with trip_id {trip_id} and user id {user_id}."
-        if json_response:
-            return jsonify({"error": error}), 404
-        flash(error)
-        return redirect(url_for("views.get_all_trips"))
+        return trip_not_found(json_response, trip_id, user_id)
 
-    expenses = db.execute(
-        'SELECT expense_id, expense_description, expense_date, amount, created FROM expense WHERE trip_id = ? ORDER BY amount DESC', (trip_id,)).fetchall()
-        
-    if not expenses:
-        error = "No expenses found"
+    try:
+        limit, after = pagination.page_args()
+    except ValueError as e:
+        return error_response(json_response, str(e), 400, 'views.get_all_expenses', trip_id=trip_id, destination=quote(trip["destination"]))
+
+    validators = None
+    if json_response:
+        validators = conditional.validators('expenses', trip_id, trip)
+        if conditional.is_not_modified(*validators):
+            return conditional.not_modified(*validators)
+
+    expenses = db.execute(*expenses_page_query(trip_id, limit, after)).fetchall()
+    return expenses_response(json_response, trip_id, trip, expenses, limit, after, validators)
+
+def expense_response(json_response, trip_id, trip, expense_id, expense):
+    '''Builds the response of get_expense from the expense row, None when it was not found.'''
+    if expense is None:
         if json_response:
-            return jsonify({"error": error}), 404
-        flash(error)
-        return redirect(url_for("views.post_expense", trip_id=trip_id, destination=quote(trip["destination"])))
-    
-    all_expenses = []
-
-    for expense in expenses:
-        all_expenses.append({
-            "expense_id": escape(expense["expense_id"]),
-            "expense_description": escape(expense["expense_description"]),
-            "expense_date": escape(expense["expense_date"]),
-            "amount": escape(expense["amount"]),
-            "created": escape(expense["created"])
-        })
+            return jsonify({"error": f"Expense with expense id {expense_id} not found"}), 404
+        flash("No expense found")
+        return redirect(url_for("views.get_all_expenses", trip_id=trip_id, destination=quote(trip['destination'])))
 
     if json_response:
-        respond = {"expenses": all_expenses,
-                   "destination": trip['destination']}
-        return jsonify(respond), 200
-    return render_template('expenses/expenses.html', expenses=expenses, trip_id=trip_id, destination=trip['destination'])
-    
+        etag, last_modified = conditional.validators('expense', expense_id, trip)
+        if conditional.is_not_modified(etag, last_modified):
+            return conditional.not_modified(etag, last_modified)
+        response = {"expense": serialize.EXPENSE_DETAIL_JSON.one(expense)}
+        return conditional.set_validators(serialize.json_response(response), etag, last_modified), 200
+    return render_template('expenses/expense.html', expense=expense, expense_id=expense_id, trip_id=trip_id, destination=trip['destination'])
+
 @views.route('/trips/expenses/<int:trip_id>/<int:expense_id>/<destination>', methods=['GET'])
 @crud_trips
 def get_expense(expense_id, trip_id, destination):
     db = open_db()
     json_response = "application/json" in request.headers.get("accept", "")
     user_id = session.get('user_id')
-    destination = unquote(destination)
 
-    trip = db.execute(
-        'SELECT destination FROM trip WHERE trip_id = ? AND user_id = ?', (trip_id, user_id)).fetchone()
-    
+    trip = db.execute(TRIP_VERSION_SELECT, (trip_id, user_id)).fetchone()
+
     if not trip:
-        error = f"No trip found with trip_id {trip_id} and user id {user_id}."
-        if json_response:
-            return jsonify({"error": error}), 404
-        flash(error)
-        return redirect(url_for("views.get_all_trips"))
+        return trip_not_found(json_response, trip_id, user_id)
 
-    expense = db.execute(
-        'SELECT expense_id, trip_id, expense_description, expense_date, amount, created FROM expense WHERE expense_id = ? AND trip_id = ?', (expense_id, trip_id)
-    ).fetchone()
+    expense = db.execute(EXPENSE_SELECT, (expense_id, trip_id)).fetchone()
+    return expense_response(json_response, trip_id, trip, expense_id, expense)
 
-    try:
-        trip_id = int(trip_id)
-    except ValueError:
-        return jsonify({"error": "Invalid trip_id"}), 400
+EXPENSE_INSERT = "INSERT INTO expense (expense_description, expense_date, amount, currency, base_amount, rate_version, trip_id) VALUES (?, ?, ?, ?, ?, ?, ?)"
 
-    if expense is None:
-        if json_response:
-            return jsonify({"error": f"Expense with expense id {expense_id} not found"}), 404
-        flash("No expense found")
-        return redirect(url_for("views.get_all_expenses", trip_id=trip_id, destination=quote(trip['destination'])))
+def new_expense(data):
+    '''Returns the expense sent in the JSON or form data of a request, with its currency and its amount in the base currency. Raises ValueError when there is no data or no amount, or the currency is not known.'''
+    if not data:
+        raise ValueError("No data given")
 
-    expense_details = {
-        "expense_id": escape(expense["expense_id"]),
-        "expense_description": escape(expense["expense_description"]),
-        "expense_date": escape(expense["expense_date"]),
-        "amount": escape(expense["amount"]),
-        "created": escape(expense["created"]),
-        "trip_id": escape(expense["trip_id"])
-    }
+    amount = data.get('amount')
+    if not amount:
+        raise ValueError("Amount is required")
+
+    currency = request_currency(data)
+    base_amount, rate_version = get_exchange_rates().normalize(amount, currency)
+    return {
+        "expense_description": data.get('expense_description'),
+        "expense_date": data.get('expense_date'),
+        "amount": amount,
+        "currency": currency,
+        "base_amount": base_amount,
+        "rate_version": rate_version}
+
+def expense_parameters(expense, trip_id):
+    return (expense["expense_description"], expense["expense_date"], expense["amount"], expense["currency"], expense["base_amount"], expense["rate_version"], trip_id)
+
+def expense_created(json_response, trip_id, destination, expense_id, expense):
+    message = "Expense created successfully!"
     if json_response:
-        response = {"expense": expense_details}
-        return jsonify(response), 200
-    return render_template('expenses/expense.html', expense=expense, expense_id=expense_id, trip_id=trip_id, destination=trip['destination'])
+        expense_details = {"expense_date": expense["expense_date"],
+                        "amount": expense["amount"],
+                        "currency": expense["currency"],
+                        "base_amount": expense["base_amount"],
+                        "expense_id": expense_id,
+                        "trip_id": trip_id}
+        response = {"message": message,
+                    "expense": expense_details,
+                    "destination": destination}
+        return jsonify(response), 201
+    flash(message)
+    return redirect(url_for("views.get_all_expenses", trip_id=trip_id, destination=quote(destination)))
+
+TRIP_DESTINATION_SELECT = 'SELECT destination FROM trip WHERE trip_id = ? AND user_id = ?'
 
 @views.route('/trips/add_expense/<int:trip_id>/<destination>', methods=['GET', 'POST'])
 @crud_trips
@@ -376,9 +467,36 @@ def post_expense(trip_id, destination):
     user_id = session.get('user_id')
     destination = unquote(destination)
 
+    trip = db.execute(TRIP_DESTINATION_SELECT, (trip_id, user_id)).fetchone()
+
+    if not trip:
+        return trip_not_found(json_response, trip_id, user_id)
+
+    if request.method == 'POST':
+        try:
+            expense = new_expense(request_data(json_response))
+        except ValueError as e:
+            return error_response(json_response, str(e), 400, 'views.post_expense', trip_id=trip_id, destination=quote(trip['destination']))
+
+        try:
+            expense_id = db.execute(EXPENSE_INSERT, expense_parameters(expense, trip_id)).lastrowid
+            db.commit()
+        except Exception as e:
+            return error_response(json_response, f"Failed to create expense: {str(e)}", 500, 'views.post_expense', trip_id=trip_id, destination=quote(destination))
+        return expense_created(json_response, trip_id, destination, expense_id, expense)
+    return render_template('expenses/post_expense.html', trip_id=trip_id, destination=trip['destination'], form=form)
+
+@views.route('/trips/<int:trip_id>/expenses/import', methods=['POST'])
+@crud_trips
+def import_expenses(trip_id):
+    '''Imports expenses into a trip from a CSV or NDJSON upload, sent either as the file field of a multipart form or as the raw request body. Each row holds expense_description, expense_date and amount. Invalid rows are reported and skipped; the valid ones are inserted in a single transaction.'''
+    db = open_db()
+    json_response = "application/json" in request.headers.get("accept", "")
+    user_id = session.get('user_id')
+
     trip = db.execute(
         'SELECT destination FROM trip WHERE trip_id = ? AND user_id = ?', (trip_id, user_id)).fetchone()
-    
+
     if not trip:
         error = f"No trip found with trip_id {trip_id} and user id {user_id}."
         if json_response:
@@ -386,60 +504,43 @@ def post_expense(trip_id, destination):
         flash(error)
         return redirect(url_for("views.get_all_trips"))
 
-    if request.method == 'POST':
+    file = request.files.get('file')
+    if file is not None:
+        stream = file.stream
+        format = importer.detect_format(file.filename, file.mimetype)
+    else:
+        stream = request.stream
+        format = importer.detect_format(None, request.mimetype)
+    format = request.args.get('format', format)
+
+    if format not in ('csv', 'ndjson'):
+        error = "Upload a .csv or .ndjson file, or set the format parameter to csv or ndjson"
         if json_response:
-            data = request.get_json()
-        else:
-            data = request.form
+            return jsonify({"error": error}), 400
+        flash(error)
+        return redirect(url_for("views.get_all_expenses", trip_id=trip_id, destination=quote(trip['destination'])))
 
-        error = None
+    try:
+        result = importer.import_expenses(
+            db, trip_id, importer.read_rows(stream, format),
+            current_app.config['IMPORT_CHUNK_SIZE'], current_app.config['IMPORT_MAX_ERRORS']
+        )
+    except (UnicodeDecodeError, csv.Error) as e:
+        error = f"Failed to read the upload: {str(e)}"
+        if json_response:
+            return jsonify({"error": error}), 400
+        flash(error)
+        return redirect(url_for("views.get_all_expenses", trip_id=trip_id, destination=quote(trip['destination'])))
+    except importer.RowRejected as e:
+        if json_response:
+            return jsonify(e.report), 400
+        flash(f"Row {e.number} was rejected by the database: {str(e)}. Nothing was imported")
+        return redirect(url_for("views.get_all_expenses", trip_id=trip_id, destination=quote(trip['destination'])))
 
-        if not data:
-            error = "No data given"
-            if json_response:
-                return jsonify({"error": error}), 400
-            flash(error)
-            return redirect(url_for('views.post_expense', trip_id=trip_id, destination=quote(trip['destination'])))
-        
-        expense_description = data.get('expense_description')
-        expense_date = data.get('expense_date')
-        amount = data.get('amount')
-        
-        if not amount:
-            error = "Amount is required"
-            if json_response: 
-                return jsonify({"error": error}), 400
-            flash(error)
-            return redirect(url_for("views.post_expense", trip_id=trip_id, destination=quote(trip['destination'])))
-        
-        if error is None:     
-            try:
-                expense = db.execute(
-                    "INSERT INTO expense (expense_description, expense_date, amount, trip_id) VALUES (?, ?, ?, ?)", (expense_description, expense_date, amount, trip_id)
-                )
-                db.commit()
-
-                expense_id = expense.lastrowid
-
-                expense_details = {"expense_date": expense_date,
-                                "amount": amount,
-                                "expense_id": expense_id,
-                                "trip_id": trip_id}
-                
-                message = "Expense created successfully!"
-                if json_response:
-                    response = {"message": message,
-                                "expense": expense_details,
-                                "destination": destination}
-                    return jsonify(response), 201
-                flash(message)
-                return redirect(url_for("views.get_all_expenses", trip_id=trip_id, destination=quote(destination)))
-            except Exception as e:
-                if json_response:
-                    return jsonify({"error": f"Failed to create expense: {str(e)}"}), 500
-                flash(f"{str(e)}")
-                return redirect(url_for('views.post_expense', trip_id=trip_id, destination=quote(destination)))
-    return render_template('expenses/post_expense.html', trip_id=trip_id, destination=trip['destination'], form=form)
+    if json_response:
+        return jsonify(result), 200
+    flash(f"Imported {result['imported']} expenses, {result['failed']} rows failed")
+    return redirect(url_for("views.get_all_expenses", trip_id=trip_id, destination=quote(trip['destination'])))
 
 @views.route('/trips/edit_expense/<int:trip_id>/<int:expense_id>/<destination>', methods=['GET', 'POST'])
 @crud_trips
@@ -461,7 +562,7 @@ def put_expense(expense_id, trip_id, destination):
         return redirect(url_for("views.get_all_trips"))
     
     expense = db.execute(
-        "SELECT expense_id, expense_description, expense_date, amount, created FROM expense WHERE expense_id = ? AND trip_id = ?", (expense_id, trip_id,)
+        "SELECT expense_id, expense_description, expense_date, amount, currency, created FROM expense WHERE expense_id = ? AND trip_id = ?", (expense_id, trip_id,)
     ).fetchone()
 
     try:
@@ -491,9 +592,21 @@ def put_expense(expense_id, trip_id, destination):
                 return jsonify({"error": error}), 400
             flash(error)
             return redirect(url_for("views.put_expense", expense_id=expense_id, trip_id=trip_id, destination=quote(trip['destination'])))
+
+        try:
+            currency = request_currency(data)
+            base_amount, rate_version = get_exchange_rates().normalize(amount, currency)
+        except ValueError as e:
+            error = str(e)
+            if json_response:
+                return jsonify({"error": error}), 400
+            flash(error)
+            return redirect(url_for("views.put_expense", expense_id=expense_id, trip_id=trip_id, destination=quote(trip['destination'])))
+
         try:
             db.execute(
-                "UPDATE expense SET expense_description = ?, expense_date = ?, amount = ? WHERE expense_id = ? AND trip_id = ?", (expense_description, expense_date, amount, expense_id, trip_id)
+                "UPDATE expense SET expense_description = ?, expense_date = ?, amount = ?, currency = ?, base_amount = ?, rate_version = ? WHERE expense_id = ? AND trip_id = ?",
+                (expense_description, expense_date, amount, currency, base_amount, rate_version, expense_id, trip_id)
             )
             db.commit()
             
@@ -502,7 +615,9 @@ def put_expense(expense_id, trip_id, destination):
                             "trip_id": trip_id,
                             "expense_description": expense_description,
                             "expense_date": expense_date,
-                            "amount": amount
+                            "amount": amount,
+                            "currency": currency,
+                            "base_amount": base_amount
                         }
             
             message = "Expense updated successfully!"
@@ -575,18 +690,75 @@ def delete_expense(expense_id, trip_id, destination):
             return redirect(url_for('views.delete_expense', error=error, trip_id=trip_id, expense_id=expense_id, destination=quote(trip['destination'])))
     return render_template('expenses/delete_expense.html', expense_id=expense_id, expense=expense, trip_id=trip_id, destination=quote(trip['destination']))
 
+@views.route('/batch', methods=['POST'])
+@crud_trips
+def post_batch():
+    '''Applies a JSON list of trip and expense operations in one transaction, e.g. {"operations": [{"op": "create", "type": "trip", "temp_id": "t1", "data": {...}}, {"op": "create", "type": "expense", "trip_id": "t1", "data": {...}}]}. Returns the result of every operation, or the error of the first failing one, in which case nothing is applied.'''
+    data = request.get_json(silent=True)
+    operations = data.get('operations') if isinstance(data, dict) else None
+
+    if not isinstance(operations, list) or not operations:
+        return jsonify({"error": "operations must be a non-empty list"}), 400
+    if len(operations) > current_app.config['BATCH_MAX_OPERATIONS']:
+        return jsonify({"error": f"A batch can hold up to {current_app.config['BATCH_MAX_OPERATIONS']} operations"}), 413
+
+    try:
+        results = batch.apply_batch(open_db(), session.get('user_id'), operations)
+    except batch.OperationError as e:
+        return jsonify({"error": str(e)}), e.status
+    return jsonify({"message": "Batch applied successfully!", "results": results}), 200
+
+@views.route('/export', methods=['GET'])
+@crud_trips
+def export_data():
+    '''Streams every trip, expense and photo record of the logged in user as NDJSON or CSV, chosen by the format parameter. With gzip=1 the file is gzip compressed while it is streamed.'''
+    json_response = "application/json" in request.headers.get("accept", "")
+    user_id = session.get('user_id')
+    format = request.args.get('format', 'ndjson')
+    gzip = request.args.get('gzip', '0').lower() in ('1', 'true', 'yes')
+
+    if format not in ('ndjson', 'csv'):
+        error = "format must be ndjson or csv"
+        if json_response:
+            return jsonify({"error": error}), 400
+        flash(error)
+        return redirect(url_for('views.home'))
+
+    body = exporter.export(
+        open_db(), user_id, format, gzip,
+        current_app.config['EXPORT_CHUNK_SIZE'], current_app.config['EXPORT_GZIP_LEVEL']
+    )
+    filename = f"trips-export.{format}"
+    mimetype = "text/csv" if format == 'csv' else "application/x-ndjson"
+    if gzip:
+        filename += ".gz"
+        mimetype = "application/gzip"
+
+    return Response(
+        stream_with_context(body), mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+PHOTO_SELECT = (
+    'SELECT photo.photo_id, photo.trip_id, photo.created, photo_rendition.width, COALESCE(photo_rendition.file_path, photo.file_path) AS file_path '
+    'FROM photo LEFT JOIN photo_rendition ON photo_rendition.blob_hash = photo.blob_hash AND photo_rendition.width = '
+    '(SELECT MIN(width) FROM photo_rendition WHERE blob_hash = photo.blob_hash AND width >= ?)'
+)
+'''Selects photos with the width and path of their smallest rendition at least as wide as the bound width. It falls back to the original, with a NULL width, while the renditions are not generated yet, or when the original is already smaller than that width.'''
+
 @views.route('/trips/photos/', methods=['GET'])
 @crud_trips
 def get_all_photos():
     db = open_db()
+    user_id = session.get('user_id')
     
     photos = db.execute(
-        'SELECT photo_id, file_path, created FROM photo ORDER BY created DESC'
+        PHOTO_SELECT + ' WHERE photo.user_id = ? ORDER BY photo.created DESC', (current_app.config['GALLERY_WIDTH'], user_id)
     ).fetchall()
     
     if not photos:
@@ -598,19 +770,21 @@ def get_all_photos():
     for photo in photos:
         photos_list.append({
             "photo_id" : escape(photo["photo_id"]),
-            "file_path" : escape(photo["file_path"]),
+            "trip_id" : escape(photo["trip_id"]),
+            "width" : photo["width"],
             "created" : escape(photo["created"])
         })
 
-    return render_template('photos.html', photos=photos_list)
+    return render_template('photos/photos.html', photos=photos_list)
 
 @views.route('/trips/photos/<int:photo_id>', methods=['GET'])
 @crud_trips
 def get_photo(photo_id):
     db = open_db()
+    user_id = session.get('user_id')
 
     photo = db.execute(
-        'SELECT photo_id, file_path, created FROM photo where photo_id = ?', (photo_id,)
+        PHOTO_SELECT + ' WHERE photo.photo_id = ? AND photo.user_id = ?', (current_app.config['PHOTO_WIDTH'], photo_id, user_id)
     ).fetchone()
 
     if photo is None:
@@ -618,65 +792,129 @@ def get_photo(photo_id):
         return redirect(url_for('views.get_all_photos'))
     
     photo_details = {
-            "photo_id": escape(photo["Photo_id"]),
-            "file_path": escape(photo["file_path"]),
+            "photo_id": escape(photo["photo_id"]),
+            "trip_id": escape(photo["trip_id"]),
+            "width": photo["width"],
             "created": escape(photo["created"])
             }
 
-    return render_template('photo.html', photo=photo_details)
+    return render_template('photos/photo.html', photo=photo_details)
+
+PHOTO_MAX_AGE = 365 * 24 * 60 * 60
+'''Photo files never change once written, because blobs are named by their hash and a width always names the same rendition, so browsers may keep them for a year without revalidating.'''
+
+@views.route('/trips/photos/<int:photo_id>/file', methods=['GET'])
+@crud_trips
+def get_photo_file(photo_id):
+    '''Serves the bytes of a photo of the user, or of its rendition when a width is given. Ownership is checked with a single query and the file is then handed to send_file, which lets the WSGI server send it with its zero-copy file wrapper (or the front end server with USE_X_SENDFILE) and answers Range and If-None-Match requests. The ETag is the blob hash, so it is derived from the file content without reading it.'''
+    json_response = "application/json" in request.headers.get("accept", "")
+    width = request.args.get('width', type=int)
+    db = open_db()
+    user_id = session.get('user_id')
+
+    photo = db.execute(
+        'SELECT photo.blob_hash, COALESCE(photo_rendition.file_path, photo.file_path) AS file_path, photo_rendition.width '
+        'FROM photo LEFT JOIN photo_rendition ON photo_rendition.blob_hash = photo.blob_hash AND photo_rendition.width = ? '
+        'WHERE photo.photo_id = ? AND photo.user_id = ?', (width, photo_id, user_id)
+    ).fetchone()
+
+    path = None
+    if photo is not None and (width is None or photo["width"] is not None):
+        path = os.path.abspath(os.path.join(current_app.config['UPLOAD_FOLDER'], photo["file_path"]))
+
+    if path is None or not os.path.isfile(path):
+        error = f"Photo with photo id {photo_id} not found"
+        if json_response:
+            return jsonify({"error": error}), 404
+        abort(404, error)
+
+    etag = True
+    if photo["blob_hash"] is not None:
+        etag = f"{photo['blob_hash']}-{width}" if width else photo["blob_hash"]
+
+    response = send_file(path, conditional=True, etag=etag, max_age=PHOTO_MAX_AGE)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    return response
+
+PHOTO_TRIP_SELECT = 'SELECT trip_id FROM trip WHERE trip_id = ? AND user_id = ?'
+
+def uploaded_photos():
+    '''Returns the photos of an upload request whose type is allowed, each with its file extension.'''
+    files = request.files.getlist('photos') + request.files.getlist('file')
+    return [(file, secure_filename(file.filename).rsplit('.', 1)[1].lower()) for file in files if file and allowed_file(file.filename)]
+
+def photos_uploaded(json_response, photo_ids):
+    message = "Photos uploaded successfully"
+    if json_response:
+        return jsonify({"message": message, "photo_ids": photo_ids}), 201
+    flash(message)
+    return redirect(url_for('views.get_all_photos'))
+
+def upload_failed(json_response, error, photo_ids):
+    '''Returns the 500 response of an upload that failed, with the ids of the photos stored before the failure.'''
+    error = f"Failed to upload photo: {error}"
+    if json_response:
+        return jsonify({"error": error, "photo_ids": photo_ids}), 500
+    flash(error)
+    return redirect(url_for('views.post_photo'))
 
 @views.route('/trips/add_photos', methods=['GET', 'POST'])
 @crud_trips
 def post_photo():
     if request.method == 'POST':
-        file = request.files['file']
-        if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-            file.save(file_path)
+        json_response = "application/json" in request.headers.get("accept", "")
+        user_id = session.get('user_id')
+        trip_id = request.form.get('trip_id', type=int)
+        db = open_db()
 
-            db = open_db()
+        if trip_id is not None and not db.execute(PHOTO_TRIP_SELECT, (trip_id, user_id)).fetchone():
+            return trip_not_found(json_response, trip_id, user_id, 'views.post_photo')
 
-            if not file_path:
-                flash("file path is required")
-                return redirect(url_for('views.post_photo'))
-            
-            db.execute(
-                'INSERT INTO photo (file_path) VALUES (?)', (file_path)
-            )
-            db.commit()
+        files = uploaded_photos()
+        if not files:
+            return error_response(json_response, "Invalid file type or no file found", 400, 'views.post_photo')
 
-            flash("Photos uploaded successfully")
-            return render_template('photos/photo.html', file_path=file_path)
-        flash("Invalid file type or no file found")
-        return redirect(url_for('views.post_photo'))
+        photo_ids = []
+        try:
+            for file, extension in files:
+                photo_id, blob_hash, file_path, new_blob = photos.save_photo(
+                    db, file, extension, trip_id, user_id,
+                    current_app.config['UPLOAD_FOLDER'], current_app.config['PHOTO_CHUNK_SIZE']
+                )
+                photo_ids.append(photo_id)
+                if new_blob:
+                    get_thumbnail_pool().submit(blob_hash, file_path)
+        except Exception as e:
+            return upload_failed(json_response, str(e), photo_ids)
+        return photos_uploaded(json_response, photo_ids)
     return render_template('photos/post_photo.html')
 
-@views.route('/trips/delete_photo/<int_photo_id>', methods=['POST'])
+@views.route('/trips/delete_photo/<int:photo_id>', methods=['POST'])
 @crud_trips
 def delete_photo(photo_id):
     json_response = "application/json" in request.headers.get("accept", "")
     db = open_db()
+    user_id = session.get('user_id')
 
-    photo = db.execute(
-        'SELECT * FROM photo WHERE photo_id = ?', (photo_id,)
-    )
+    try:
+        deleted = photos.delete_photo(db, photo_id, user_id, current_app.config['UPLOAD_FOLDER'])
+    except Exception as e:
+        error = f"Failed to delete photo: {str(e)}"
+        if json_response:
+            return jsonify({"error": error}), 500
+        flash(error)
+        return redirect(url_for('views.get_all_photos'))
 
-    if not photo:
+    if not deleted:
         if json_response:
             return jsonify({"error": f"Photo with photo id {photo_id} not found"}), 404
         flash("No photo found")
         return redirect(url_for('views.get_all_photos'))
-    
-    db.execute(
-        'DELETE FROM photo WHERE photo_id = ?', (photo_id,)
-    )
-
-    db.commit()
 
     message = "Photo deleted successfully!"
     if json_response:
         return jsonify({"message": message}), 200
     flash(message)
     return redirect(url_for('views.get_all_photos'))
-